@@ -0,0 +1,271 @@
+"""Near-duplicate question cache for assistant answers (MinHash + LSH in Redis).
+
+A question is normalised (lower case, ё→е, stop words dropped, words cut to a short
+prefix as a cheap stand-in for stemming) and split into character shingles. Its MinHash
+signature is divided into LSH bands; each band hash points to a Redis set of entry ids:
+
+    qcache:band:{i}:{hash}  set of entry ids sharing band i
+    qcache:entry:{id}       hash: question, answer, topic, sig (signature), bands, keys
+    qcache:lru              zset of entry ids by last hit/insert time
+
+Words that flip the legal meaning of a question — numbers, negations and modal words
+("не", "нельзя", "можно") and party roles ("арендатор" vs "арендодатель") — are never
+cut to a prefix and form the question's key: a candidate is only considered when its
+key is exactly the same. Among those, candidates are scored by the estimated Jaccard
+similarity of their signatures; the best one above ``ANSWER_CACHE_THRESHOLD`` is a hit. Entries expire per
+topic (tax answers age faster than general ones) and the least recently used are evicted
+above ``ANSWER_CACHE_MAX_ENTRIES``; band sets drop dangling ids lazily on lookup.
+Everything runs on CPU in the agent process — no embedding service is involved.
+"""
+import logging
+import os
+import struct
+import time
+import uuid
+import zlib
+from typing import List, NamedTuple, Optional, Sequence
+
+from agents_shared.metrics import counter, histogram
+from .router import normalize
+
+logger = logging.getLogger("assistant.answer_cache")
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.8"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "50000"))
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 4
+STEM_CHARS = 6
+PREFIX = "qcache"
+
+# срок жизни ответа по теме вопроса (секунды): налоговые нормы меняются чаще прочих
+TOPIC_TTLS = {
+    "tax": int(os.getenv("ANSWER_CACHE_TTL_TAX", str(24 * 3600))),
+    "labor": int(os.getenv("ANSWER_CACHE_TTL_LABOR", str(7 * 24 * 3600))),
+    "contract": int(os.getenv("ANSWER_CACHE_TTL_CONTRACT", str(7 * 24 * 3600))),
+    "general": int(os.getenv("ANSWER_CACHE_TTL_GENERAL", str(3 * 24 * 3600))),
+}
+TOPIC_KEYWORDS = {
+    "tax": ("налог", "ндс", "ндфл", "усн", "упрощ", "фнс", "вычет", "деклар"),
+    "labor": ("увол", "сотрудн", "работник", "работодат", "отпуск", "трудов", "зарплат", "испытат"),
+    "contract": ("договор", "аренд", "постав", "подряд", "неустойк", "контраг", "расторг"),
+}
+STOP_WORDS = frozenset(
+    "а в во и или к ко как ли на над о об обо от по под при про с со у что чтобы это этот эта "
+    "же бы мне меня мы вы я ты он она они их его ее какой какая какие".split()
+)
+# отрицания и модальность: «нужно ли платить» и «не нужно платить» — разные вопросы
+POLARITY_WORDS = frozenset(
+    "не ни нет нельзя без можно нужно надо должен должна должны обязан обязана обязаны вправе запрещено".split()
+)
+# роли сторон по основе; более длинные основы проверяются первыми («арендодател» раньше «арендатор»)
+ROLE_STEMS = sorted((
+    "арендодател", "арендатор", "наймодател", "нанимател", "работодател", "работник", "покупател", "продавец",
+    "продавц", "поставщик", "заказчик", "подрядчик", "субподрядчик", "исполнител", "кредитор", "должник",
+    "истец", "истц", "ответчик", "займодав", "заимодав", "заемщик", "лизингодател", "лизингополучател",
+    "залогодател", "залогодержател", "цедент", "цессионари", "принципал", "агент", "страховщик", "страховател",
+), key=len, reverse=True)
+CACHED_NOTICE = "Похожий вопрос уже задавали — ниже сохранённый ответ. Если ваша ситуация отличается, уточните детали.\n\n"
+
+_MERSENNE = (1 << 61) - 1
+# фиксированные коэффициенты перестановок — сигнатуры совпадают между репликами и перезапусками
+_PERMS = [
+    (zlib.crc32(f"a{i}".encode()) * 2654435761 % _MERSENNE | 1, zlib.crc32(f"b{i}".encode()) * 40503 % _MERSENNE)
+    for i in range(NUM_PERM)
+]
+
+_lookups = counter("assistant_answer_cache_lookups_total", "Answer cache lookups", ["result"])
+_stores = counter("assistant_answer_cache_stores_total", "Answers added to the cache", ["topic"])
+_evictions = counter("assistant_answer_cache_evictions_total", "Entries evicted to stay under the size limit")
+_similarity = histogram(
+    "assistant_answer_cache_similarity", "Best candidate similarity on lookup",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+)
+
+
+class CachedAnswer(NamedTuple):
+    entry_id: str
+    question: str
+    answer: str
+    similarity: float
+
+
+def _role(word: str) -> Optional[str]:
+    for stem in ROLE_STEMS:
+        if word.startswith(stem):
+            return stem
+    return None
+
+
+def _is_key_word(word: str) -> bool:
+    return word.isdigit() or word in POLARITY_WORDS or _role(word) is not None
+
+
+def question_key(text: str) -> str:
+    """Numbers, negations/modality and party roles of the question; cached answers must match it exactly."""
+    keys = set()
+    for w in normalize(text).split():
+        role = _role(w)
+        if role is not None:
+            keys.add(role)
+        elif w.isdigit() or w in POLARITY_WORDS:
+            keys.add(w)
+    return " ".join(sorted(keys))
+
+
+def shingles(text: str) -> List[str]:
+    words = [w if _is_key_word(w) else w[:STEM_CHARS] for w in normalize(text).split() if w not in STOP_WORDS]
+    joined = " ".join(words)
+    if len(joined) <= SHINGLE_SIZE:
+        return [joined] if joined else []
+    return sorted({joined[i:i + SHINGLE_SIZE] for i in range(len(joined) - SHINGLE_SIZE + 1)})
+
+
+def minhash(items: Sequence[str]) -> List[int]:
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in items]
+    return [min((a * h + b) % _MERSENNE for h in hashes) for a, b in _PERMS]
+
+
+def similarity(sig_a: Sequence[int], sig_b: Sequence[int]) -> float:
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def topic_of(text: str) -> str:
+    normalized = normalize(text)
+    for topic, stems in TOPIC_KEYWORDS.items():
+        if any(stem in normalized for stem in stems):
+            return topic
+    return "general"
+
+
+def _pack(sig: Sequence[int]) -> str:
+    return struct.pack(f">{NUM_PERM}Q", *sig).hex()
+
+
+def _unpack(raw: str) -> List[int]:
+    return list(struct.unpack(f">{NUM_PERM}Q", bytes.fromhex(raw)))
+
+
+def _band_keys(sig: Sequence[int]) -> List[str]:
+    keys = []
+    for i in range(BANDS):
+        band = sig[i * ROWS:(i + 1) * ROWS]
+        keys.append(f"{PREFIX}:band:{i}:{zlib.crc32(struct.pack(f'>{ROWS}Q', *band)):08x}")
+    return keys
+
+
+class AnswerCache:
+    def __init__(self, redis_client, threshold: float = ANSWER_CACHE_THRESHOLD, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.r = redis_client
+        self.threshold = threshold
+        self.max_entries = max_entries
+
+    def lookup(self, question: str) -> Optional[CachedAnswer]:
+        items = shingles(question)
+        if not items:
+            return None
+        key = question_key(question)
+        try:
+            sig = minhash(items)
+            pipe = self.r.pipeline(transaction=False)
+            for band_key in _band_keys(sig):
+                pipe.smembers(band_key)
+            candidates = set().union(*pipe.execute())
+            if not candidates:
+                _lookups.inc(result="miss")
+                return None
+
+            ids = sorted(candidates)
+            pipe = self.r.pipeline(transaction=False)
+            for entry_id in ids:
+                pipe.hmget(f"{PREFIX}:entry:{entry_id}", "sig", "question", "answer", "keys")
+            best = None
+            dangling = []
+            for entry_id, (raw_sig, stored_q, answer, stored_key) in zip(ids, pipe.execute()):
+                if raw_sig is None:
+                    dangling.append(entry_id)
+                    continue
+                if (stored_key or "") != key:
+                    # другие числа, отрицание или стороны — похожий текст, но другой вопрос
+                    continue
+                score = similarity(sig, _unpack(raw_sig))
+                if best is None or score > best.similarity:
+                    best = CachedAnswer(entry_id, stored_q, answer, score)
+            if dangling:
+                self._drop_dangling(sig, dangling)
+        except Exception:
+            logger.exception("Answer cache lookup failed")
+            _lookups.inc(result="error")
+            return None
+
+        if best is not None:
+            _similarity.observe(best.similarity)
+        if best is None or best.similarity < self.threshold:
+            _lookups.inc(result="miss")
+            return None
+        _lookups.inc(result="hit")
+        try:
+            self.r.zadd(f"{PREFIX}:lru", {best.entry_id: time.time()})
+        except Exception:
+            logger.exception("Failed to touch answer cache entry %s", best.entry_id)
+        return best
+
+    def store(self, question: str, answer: str) -> Optional[str]:
+        items = shingles(question)
+        if not items or not answer:
+            return None
+        sig = minhash(items)
+        topic = topic_of(question)
+        ttl = TOPIC_TTLS[topic]
+        entry_id = uuid.uuid4().hex
+        entry_key = f"{PREFIX}:entry:{entry_id}"
+        bands = _band_keys(sig)
+        try:
+            pipe = self.r.pipeline(transaction=False)
+            pipe.hset(entry_key, mapping={
+                "question": question, "answer": answer, "topic": topic,
+                "sig": _pack(sig), "bands": ",".join(bands), "keys": question_key(question),
+                "created_at": str(time.time()),
+            })
+            pipe.expire(entry_key, ttl)
+            for key in bands:
+                pipe.sadd(key, entry_id)
+                # набор банда живёт не меньше самой долгой записи в нём
+                pipe.expire(key, max(TOPIC_TTLS.values()))
+            pipe.zadd(f"{PREFIX}:lru", {entry_id: time.time()})
+            pipe.zcard(f"{PREFIX}:lru")
+            size = pipe.execute()[-1]
+            _stores.inc(topic=topic)
+            if size > self.max_entries:
+                self._evict(size - self.max_entries)
+            return entry_id
+        except Exception:
+            logger.exception("Failed to store answer in cache")
+            return None
+
+    def _evict(self, count: int) -> None:
+        victims = [entry_id for entry_id, _ in self.r.zpopmin(f"{PREFIX}:lru", count)]
+        if not victims:
+            return
+        pipe = self.r.pipeline(transaction=False)
+        for entry_id in victims:
+            pipe.hget(f"{PREFIX}:entry:{entry_id}", "bands")
+        bands = pipe.execute()
+        pipe = self.r.pipeline(transaction=False)
+        for entry_id, band_keys in zip(victims, bands):
+            for key in (band_keys or "").split(","):
+                if key:
+                    pipe.srem(key, entry_id)
+            pipe.delete(f"{PREFIX}:entry:{entry_id}")
+        pipe.execute()
+        _evictions.inc(len(victims))
+
+    def _drop_dangling(self, sig: Sequence[int], entry_ids: List[str]) -> None:
+        # запись истекла по TTL, а ссылки на неё остались в бандах и LRU
+        pipe = self.r.pipeline(transaction=False)
+        for key in _band_keys(sig):
+            pipe.srem(key, *entry_ids)
+        pipe.zrem(f"{PREFIX}:lru", *entry_ids)
+        pipe.execute()
@@ -1,13 +1,20 @@
 import os
+import asyncio
+import time
 import logging
-from typing import NamedTuple, Optional
+from typing import AsyncIterator, Iterator, NamedTuple, Optional
 from gigachat import GigaChat
 from requests.exceptions import RequestException
 
+from agents_shared.hedging import CancelToken, DeadlineExceeded, DEADLINE_SECONDS, get_hedger
+from agents_shared.prompt_budget import record_llm_usage
+from agents_shared.rate_limiter import PERMIT_MAX_WAIT, get_async_rate_limiter, get_rate_limiter
+
 logger = logging.getLogger(__name__)
 
 GIGA_CREDENTIALS = os.getenv("GIGA_CHAT_CREDENTIALS")
 VERIFY_SSL = os.getenv("GIGA_CHAT_VERIFY_SSL", "false").lower() == "true"
+GIGA_MODEL = os.getenv("GIGA_CHAT_MODEL", "GigaChat")
 
 
 class LLMResponse(NamedTuple):
@@ -16,25 +23,125 @@ class LLMResponse(NamedTuple):
     metadata: dict
 
 
+def _chat_once(payload: dict, cancel: CancelToken, hedge: bool) -> LLMResponse:
+    # хедж не ждёт разрешение лимитера: нет свободного слота — значит, не дублируем запрос
+    max_wait = 0 if hedge else PERMIT_MAX_WAIT
+    with get_rate_limiter().permit(GIGA_MODEL, payload.get("priority", "interactive"), max_wait=max_wait):
+        try:
+            timeout = payload.get("deadline", DEADLINE_SECONDS)
+            with GigaChat(credentials=GIGA_CREDENTIALS, verify_ssl_certs=VERIFY_SSL, model=GIGA_MODEL, timeout=timeout) as giga:
+                cancel.bind(giga)
+                started = time.monotonic()
+                response = giga.chat(payload["prompt"])
+                content = response.choices[0].message.content
+                return LLMResponse(
+                    text=content,
+                    id=getattr(response, "id", None),
+                    metadata=record_llm_usage(payload.get("metadata", {}), response, time.monotonic() - started)
+                )
+        except Exception as e:
+            if cancel.cancelled:
+                raise RequestException("GigaChat call cancelled: another request answered first") from e
+            logger.exception("GigaChat API call failed")
+            raise RequestException(f"GigaChat API call failed: {e}") from e
+
+
+async def _achat_once(payload: dict, hedge: bool) -> LLMResponse:
+    max_wait = 0 if hedge else PERMIT_MAX_WAIT
+    async with get_async_rate_limiter().permit(GIGA_MODEL, payload.get("priority", "interactive"), max_wait=max_wait):
+        try:
+            timeout = payload.get("deadline", DEADLINE_SECONDS)
+            async with GigaChat(credentials=GIGA_CREDENTIALS, verify_ssl_certs=VERIFY_SSL, model=GIGA_MODEL, timeout=timeout) as giga:
+                started = time.monotonic()
+                response = await giga.achat(payload["prompt"])
+                content = response.choices[0].message.content
+                return LLMResponse(
+                    text=content,
+                    id=getattr(response, "id", None),
+                    metadata=record_llm_usage(payload.get("metadata", {}), response, time.monotonic() - started)
+                )
+        except asyncio.CancelledError:
+            # проигравший хедж или остановка агента — HTTP-запрос закрывается вместе с клиентом
+            raise
+        except Exception as e:
+            logger.exception("GigaChat API call failed")
+            raise RequestException(f"GigaChat API call failed: {e}") from e
+
+
 def call_llm(payload: dict) -> LLMResponse:
     """
     Адаптация call_llm для GigaChat API с возвратом NamedTuple.
-    payload должен содержать ключ 'prompt'.
+    payload должен содержать ключ 'prompt'; опционально 'deadline' (секунды) и 'priority'.
+    Медленный запрос может быть продублирован (хеджирование) — побеждает первый ответ.
     """
     prompt = payload.get("prompt")
     if not prompt:
         raise ValueError("Payload must contain 'prompt' key")
 
+    template = payload.get("metadata", {}).get("template", "unknown")
     try:
-        with GigaChat(credentials=GIGA_CREDENTIALS, verify_ssl_certs=VERIFY_SSL) as giga:
-            response = giga.chat(prompt)
-            content = response.choices[0].message.content
-            return LLMResponse(
-                text=content,
-                id=getattr(response, "id", None),
-                metadata=payload.get("metadata", {})
-            )
-    except Exception as e:
-        logger.exception("GigaChat API call failed")
-        raise RequestException(f"GigaChat API call failed: {e}") from e
+        # PermitUnavailable общего лимитера пробрасывается вызывающему
+        return get_hedger().call(_chat_once, payload, template=template, deadline=payload.get("deadline", DEADLINE_SECONDS))
+    except DeadlineExceeded as e:
+        logger.warning("GigaChat call exceeded deadline: %s", e)
+        raise RequestException(str(e)) from e
+
+
+async def acall_llm(payload: dict) -> LLMResponse:
+    """Асинхронный вариант call_llm для asyncio-режима агента (GigaChat achat, тот же лимитер и дедлайны)."""
+    if not payload.get("prompt"):
+        raise ValueError("Payload must contain 'prompt' key")
+
+    template = payload.get("metadata", {}).get("template", "unknown")
+    try:
+        return await get_hedger().acall(_achat_once, payload, template=template, deadline=payload.get("deadline", DEADLINE_SECONDS))
+    except DeadlineExceeded as e:
+        logger.warning("GigaChat call exceeded deadline: %s", e)
+        raise RequestException(str(e)) from e
+
+
+def stream_llm(payload: dict) -> Iterator[str]:
+    """
+    Потоковая генерация: отдаёт текстовые дельты по мере их прихода от GigaChat.
+    payload должен содержать ключ 'prompt'.
+    """
+    prompt = payload.get("prompt")
+    if not prompt:
+        raise ValueError("Payload must contain 'prompt' key")
+
+    with get_rate_limiter().permit(GIGA_MODEL, payload.get("priority", "interactive")):
+        try:
+            timeout = payload.get("deadline", DEADLINE_SECONDS)
+            with GigaChat(credentials=GIGA_CREDENTIALS, verify_ssl_certs=VERIFY_SSL, model=GIGA_MODEL, timeout=timeout) as giga:
+                for chunk in giga.stream(prompt):
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield delta
+        except Exception as e:
+            logger.exception("GigaChat streaming call failed")
+            raise RequestException(f"GigaChat streaming call failed: {e}") from e
+
+
+async def astream_llm(payload: dict) -> AsyncIterator[str]:
+    """Асинхронная потоковая генерация (GigaChat astream)."""
+    prompt = payload.get("prompt")
+    if not prompt:
+        raise ValueError("Payload must contain 'prompt' key")
 
+    async with get_async_rate_limiter().permit(GIGA_MODEL, payload.get("priority", "interactive")):
+        try:
+            timeout = payload.get("deadline", DEADLINE_SECONDS)
+            async with GigaChat(credentials=GIGA_CREDENTIALS, verify_ssl_certs=VERIFY_SSL, model=GIGA_MODEL, timeout=timeout) as giga:
+                async for chunk in giga.astream(prompt):
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield delta
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("GigaChat streaming call failed")
+            raise RequestException(f"GigaChat streaming call failed: {e}") from e
@@ -1,22 +1,34 @@
 import os
 import signal
+import asyncio
 import logging
 import redis
+import redis.asyncio as aioredis
 
+from agents_shared.async_runtime import AsyncAgentRuntime
+from agents_shared.deferral import DeferredQueue
 from agents_shared.kafka_client import KafkaClient
+from agents_shared.metrics import start_metrics_server
+from .answer_cache import ANSWER_CACHE_ENABLED, AnswerCache
 from .dialogue import AssistantFormatter
-from .prompts import render
+from .llm_client import call_llm
+from .memory import ConversationMemory
+from .prompts import render, build
+from .router import ROUTER_ENABLED, IntentRouter
 from .service import AssistantService
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
-CONSUME_TOPICS = os.getenv("CONSUME_TOPICS", "analysis.completed,user.message").split(",")
+CONSUME_TOPICS = os.getenv("CONSUME_TOPICS", "analysis.completed,legal.followup.completed,user.message").split(",")
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 KAFKA_GROUP_ID = os.getenv("KAFKA_GROUP_ID", "assistant-group")
+# sync — по одному сообщению за раз; async — asyncio-рантайм с AGENT_MAX_IN_FLIGHT сообщениями в работе
+AGENT_RUNTIME = os.getenv("AGENT_RUNTIME", "sync").lower()
 
 logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s %(message)s")
 logger = logging.getLogger("assistant")
 
 r = redis.from_url(REDIS_URL, decode_responses=True)
+ar = aioredis.from_url(REDIS_URL, decode_responses=True) if AGENT_RUNTIME == "async" else None
 
 kafka_client = KafkaClient(
     group_id=KAFKA_GROUP_ID,
@@ -24,7 +36,15 @@ kafka_client = KafkaClient(
     client_id="assistant"
 )
 
-service = AssistantService(redis_client=r, kafka_client=kafka_client, formatter=AssistantFormatter, prompts_render=render)
+deferrer = DeferredQueue("assistant", kafka_client, redis_client=r)
+
+router = IntentRouter.load() if ROUTER_ENABLED else None
+
+answer_cache = AnswerCache(r) if ANSWER_CACHE_ENABLED else None
+
+memory = ConversationMemory(r, build_prompt=build, call_llm=call_llm, async_redis=ar)
+
+service = AssistantService(redis_client=r, kafka_client=kafka_client, formatter=AssistantFormatter, prompts_render=render, prompts_build=build, deferrer=deferrer, memory=memory, async_redis=ar, router=router, answer_cache=answer_cache)
 
 _should_stop = False
 
@@ -43,9 +63,14 @@ kafka_client.on_message = service.handle_message
 
 
 def main_loop():
-    logger.info("Assistant agent started. Listening topics: %s", CONSUME_TOPICS)
+    logger.info("Assistant agent started (%s runtime). Listening topics: %s", AGENT_RUNTIME, CONSUME_TOPICS)
+    start_metrics_server()
+    deferrer.start()
     try:
-        kafka_client.listen_forever(poll_timeout=1.0)
+        if AGENT_RUNTIME == "async":
+            asyncio.run(AsyncAgentRuntime("assistant", kafka_client, service.ahandle_message).run())
+        else:
+            kafka_client.listen_forever(poll_timeout=1.0, should_stop=lambda: _should_stop)
     except Exception as e:
         logger.exception("Unexpected assistant main loop error: %s", e)
     finally:
@@ -0,0 +1,216 @@
+"""Per-conversation memory in Redis: a window of recent turns plus a running summary.
+
+    conv:{id}:turns    list of JSON turns {role, text, ts}, oldest first
+    conv:{id}:summary  running summary of everything that fell out of the window
+
+The reply prompt gets the summary and the last WINDOW_TURNS turns, so its size does
+not grow with the conversation. Once the list exceeds the window by SUMMARY_BATCH
+turns, the oldest overflow is folded into the summary by a background worker; the
+reply never waits for it. A per-conversation lock keeps replicas from summarising the
+same turns twice, and the overflow is trimmed only after the new summary is written.
+"""
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Optional
+
+from agents_shared.metrics import counter, histogram
+from agents_shared.prompt_budget import Section
+from agents_shared.redis_storage import EXPIRE_TIME
+
+logger = logging.getLogger("assistant.memory")
+
+WINDOW_TURNS = int(os.getenv("MEMORY_WINDOW_TURNS", "8"))
+SUMMARY_BATCH = int(os.getenv("MEMORY_SUMMARY_BATCH", "6"))
+# жёсткий предел списка, если суммаризация отстаёт (LLM недоступна)
+MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "200"))
+SUMMARY_MAX_TOKENS = int(os.getenv("MEMORY_SUMMARY_MAX_TOKENS", "400"))
+SUMMARY_WORKERS = int(os.getenv("MEMORY_SUMMARY_WORKERS", "2"))
+
+_summaries = counter("assistant_memory_summaries_total", "Background summary updates", ["status"])
+_summary_seconds = histogram("assistant_memory_summary_seconds", "Time to fold overflowing turns into the summary")
+
+ROLE_LABELS = {"user": "Пользователь", "assistant": "Ассистент"}
+SUMMARY_LOCK_TTL = 120
+
+# KEYS[1]=lock; ARGV[1]=token — release only a lock we still own
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# KEYS: lock, summary, turns; ARGV: token, summary, folded turns, ttl — write only while holding the lock
+_COMMIT_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+  return 0
+end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', tonumber(ARGV[4]))
+redis.call('LTRIM', KEYS[3], tonumber(ARGV[3]), -1)
+return 1
+"""
+
+
+class Turn(NamedTuple):
+    role: str
+    text: str
+    ts: float
+
+
+class MemorySnapshot(NamedTuple):
+    summary: str
+    turns: List[Turn]
+
+    def history_text(self) -> str:
+        return "\n".join(f"{ROLE_LABELS.get(t.role, t.role)}: {t.text}" for t in self.turns)
+
+
+def _decode(raw: str) -> Turn:
+    data = json.loads(raw)
+    return Turn(data.get("role", "user"), data.get("text", ""), data.get("ts", 0.0))
+
+
+class ConversationMemory:
+    def __init__(self, redis_client, build_prompt: Callable, call_llm: Callable[[dict], object],
+                 window: int = WINDOW_TURNS, batch: int = SUMMARY_BATCH, async_redis=None):
+        self.r = redis_client
+        # redis.asyncio-клиент для aload/aappend; суммаризация всегда идёт в фоновом пуле
+        self.ar = async_redis
+        self.build_prompt = build_prompt
+        self.call_llm = call_llm
+        self.window = window
+        self.batch = batch
+        self._pool = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="memory-summary")
+        self._release = redis_client.register_script(_RELEASE_LUA)
+        self._commit = redis_client.register_script(_COMMIT_LUA)
+
+    @staticmethod
+    def _keys(conversation_id: str):
+        base = f"conv:{conversation_id}"
+        return f"{base}:turns", f"{base}:summary", f"{base}:summary_lock"
+
+    def load(self, conversation_id: str) -> MemorySnapshot:
+        turns_key, summary_key, _ = self._keys(conversation_id)
+        try:
+            pipe = self.r.pipeline(transaction=False)
+            pipe.get(summary_key)
+            pipe.lrange(turns_key, -self.window, -1)
+            summary, raw_turns = pipe.execute()
+            return MemorySnapshot(summary or "", [_decode(t) for t in raw_turns])
+        except Exception:
+            logger.exception("Failed to load conversation memory %s", conversation_id)
+            return MemorySnapshot("", [])
+
+    def append(self, conversation_id: str, *turns: Turn) -> None:
+        """Record turns and, if the window overflowed, schedule a summary update in the background."""
+        turns_key, summary_key, _ = self._keys(conversation_id)
+        try:
+            pipe = self.r.pipeline(transaction=False)
+            pipe.rpush(turns_key, *[json.dumps(t._asdict(), ensure_ascii=False) for t in turns])
+            pipe.ltrim(turns_key, -MAX_TURNS, -1)
+            pipe.expire(turns_key, EXPIRE_TIME)
+            pipe.expire(summary_key, EXPIRE_TIME)
+            pipe.llen(turns_key)
+            length = pipe.execute()[-1]
+        except Exception:
+            logger.exception("Failed to append to conversation memory %s", conversation_id)
+            return
+        if length >= self.window + self.batch:
+            self._pool.submit(self._summarize_safely, conversation_id)
+
+    async def aload(self, conversation_id: str) -> MemorySnapshot:
+        turns_key, summary_key, _ = self._keys(conversation_id)
+        try:
+            pipe = self.ar.pipeline(transaction=False)
+            pipe.get(summary_key)
+            pipe.lrange(turns_key, -self.window, -1)
+            summary, raw_turns = await pipe.execute()
+            return MemorySnapshot(summary or "", [_decode(t) for t in raw_turns])
+        except Exception:
+            logger.exception("Failed to load conversation memory %s", conversation_id)
+            return MemorySnapshot("", [])
+
+    async def aappend(self, conversation_id: str, *turns: Turn) -> None:
+        turns_key, summary_key, _ = self._keys(conversation_id)
+        try:
+            pipe = self.ar.pipeline(transaction=False)
+            pipe.rpush(turns_key, *[json.dumps(t._asdict(), ensure_ascii=False) for t in turns])
+            pipe.ltrim(turns_key, -MAX_TURNS, -1)
+            pipe.expire(turns_key, EXPIRE_TIME)
+            pipe.expire(summary_key, EXPIRE_TIME)
+            pipe.llen(turns_key)
+            length = (await pipe.execute())[-1]
+        except Exception:
+            logger.exception("Failed to append to conversation memory %s", conversation_id)
+            return
+        if length >= self.window + self.batch:
+            self._pool.submit(self._summarize_safely, conversation_id)
+
+    def _summarize_safely(self, conversation_id: str) -> None:
+        try:
+            self.summarize(conversation_id)
+        except Exception:
+            _summaries.inc(status="failed")
+            # перекрытие окна останется в списке и будет свернуто при следующем переполнении
+            logger.exception("Background summary update failed for conversation %s", conversation_id)
+
+    def summarize(self, conversation_id: str) -> bool:
+        """Fold turns beyond the window into the running summary. Returns False if nothing was done."""
+        turns_key, summary_key, lock_key = self._keys(conversation_id)
+        token = uuid.uuid4().hex
+        if not self.r.set(lock_key, token, nx=True, ex=SUMMARY_LOCK_TTL):
+            _summaries.inc(status="locked")
+            return False
+        try:
+            started = time.monotonic()
+            overflow = self.r.llen(turns_key) - self.window
+            if overflow <= 0:
+                return False
+            pipe = self.r.pipeline(transaction=False)
+            pipe.get(summary_key)
+            pipe.lrange(turns_key, 0, overflow - 1)
+            summary, raw_turns = pipe.execute()
+            folded = MemorySnapshot(summary or "", [_decode(t) for t in raw_turns])
+
+            built = self.build_prompt(
+                "summary_update",
+                [
+                    Section("summary", folded.summary, weight=1.0),
+                    Section("turns", folded.history_text(), weight=2.0),
+                ],
+                SUMMARY_MAX_TOKENS,
+            )
+            resp = self.call_llm({
+                "prompt": built.text,
+                "max_tokens": SUMMARY_MAX_TOKENS,
+                # фоновая задача уступает интерактивным ответам
+                "priority": "batch",
+                "metadata": {"template": "summary_update", "prompt_tokens": built.report.total_tokens},
+            })
+
+            # новые реплики дописываются в хвост, поэтому срез головы безопасен;
+            # если блокировка истекла за время вызова LLM, те же реплики уже сворачивает другой воркер
+            if not self._commit(keys=[lock_key, summary_key, turns_key],
+                                args=[token, resp.text.strip(), overflow, EXPIRE_TIME]):
+                _summaries.inc(status="lock_lost")
+                logger.warning("Summary lock of conversation %s expired during the LLM call; result dropped", conversation_id)
+                return False
+            _summaries.inc(status="ok")
+            _summary_seconds.observe(time.monotonic() - started)
+            logger.info("Folded %d turns into the summary of conversation %s", overflow, conversation_id)
+            return True
+        finally:
+            self._release(keys=[lock_key], args=[token])
+
+    def prompt_sections(self, snapshot: Optional[MemorySnapshot]) -> List[Section]:
+        if snapshot is None:
+            return []
+        return [
+            Section("summary", snapshot.summary, weight=1.0),
+            # при нехватке бюджета сохраняем последние реплики
+            Section("history", snapshot.history_text(), weight=2.0, keep="tail"),
+        ]
@@ -1,5 +1,9 @@
+import os
+
 from jinja2 import Template
 
+from agents_shared.prompt_budget import BuiltPrompt, PromptBuilder, Section, prompt_budget
+
 PROMPTS = {
     'assistant_reply': Template(
         """Ты — профессиональный адвокат-консультант с 20-летним стажем в корпоративном праве.
@@ -44,12 +48,43 @@ PROMPTS = {
 11. ВСЕГДА указывай на необходимость юридической поддержки
 12. НЕ трактуй судебную практику как абсолютно применимую ко всем случаям
 
-
+{% if summary %}
+Краткое содержание предыдущего разговора: {{ summary }}
+{% endif %}{% if history %}
+Последние сообщения разговора:
+{{ history }}
+{% endif %}
 Вот, что написал юзер: {{ snippet }}
 """
-    )
+    ),
+    'summary_update': Template(
+        """Ты ведёшь краткое содержание разговора юриста-консультанта с пользователем.
+
+Дополни текущее краткое содержание новыми сообщениями. Сохрани факты, важные для дальнейших ответов: о чём спрашивал пользователь, какие обстоятельства и документы он упомянул, какие рекомендации уже были даны. Не более 800 символов, без markdown, только текст содержания.
+
+ТЕКУЩЕЕ КРАТКОЕ СОДЕРЖАНИЕ:
+{{ summary }}
+
+НОВЫЕ СООБЩЕНИЯ:
+{{ turns }}"""
+    ),
+}
+
+# верхняя граница промпта по шаблону (в токенах), помимо окна контекста модели
+PROMPT_TOKEN_CAPS = {
+    'assistant_reply': int(os.getenv("ASSISTANT_PROMPT_TOKENS", "3000")),
+    'summary_update': int(os.getenv("SUMMARY_UPDATE_PROMPT_TOKENS", "3000")),
 }
 
 
 def render(prompt_name: str, **kwargs) -> str:
     return PROMPTS[prompt_name].render(**kwargs)
+
+
+_builder = PromptBuilder(render=render)
+
+
+def build(prompt_name: str, sections: list[Section], max_output_tokens: int, **kwargs) -> BuiltPrompt:
+    """Рендерит шаблон, укладывая секции в бюджет токенов с обрезкой по границам предложений."""
+    budget = prompt_budget(max_output_tokens, PROMPT_TOKEN_CAPS.get(prompt_name, 0))
+    return _builder.build(prompt_name, sections, budget, **kwargs)
@@ -0,0 +1,328 @@
+"""Local intent routing in front of the LLM.
+
+Cheap messages (greetings, thanks, "what can you do", menu choices) are answered without
+a GigaChat call. Routing has two stages:
+
+1. a compiled keyword/regex matcher for unambiguous short phrases and explicit menu
+   selections (``payload.meta.menu`` or the menu label typed as text);
+2. a hashing TF-IDF classifier (word and character 3-gram features, nearest centroid by
+   cosine similarity) for paraphrases the regexes miss. It only routes short messages whose
+   nearest intent is close enough and clearly ahead of the runner-up
+   (``ROUTER_MIN_SIMILARITY``, ``ROUTER_MIN_MARGIN``) and whose every word belongs to the
+   vocabulary of that intent, so a question after a greeting or thanks ("спасибо, а как
+   подать иск") is never answered with a template; everything else goes to the LLM.
+
+The classifier is trained on seed examples at startup. A model trained on exported chat
+history is loaded from ``ROUTER_MODEL_PATH`` if present; build it with
+
+    python -m agents.assistant.src.router train history.jsonl router_model.json
+
+where ``history.jsonl`` holds ``{"text": ...}`` lines, e.g. from
+``SELECT text FROM messages WHERE direction = 'user'``. History is labelled by the regex
+matcher; unmatched messages become the ``llm`` class, so the classifier also learns what
+should not be routed.
+
+Decisions are counted in ``assistant_router_decisions_total{route, intent}`` (the
+routed-vs-LLM ratio) and classification time in ``assistant_router_classify_microseconds``.
+"""
+import json
+import logging
+import math
+import os
+import re
+import sys
+import time
+import zlib
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from agents_shared.metrics import counter, histogram
+
+logger = logging.getLogger("assistant.router")
+
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+ROUTER_MODEL_PATH = os.getenv("ROUTER_MODEL_PATH", "agents/assistant/router_model.json")
+# косинусная близость к центроиду интента и отрыв от ближайшего другого класса (включая llm)
+ROUTER_MIN_SIMILARITY = float(os.getenv("ROUTER_MIN_SIMILARITY", "0.3"))
+ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.15"))
+# длинные сообщения почти всегда содержат вопрос по существу — их классификатор не трогает
+ROUTER_MAX_CHARS = int(os.getenv("ROUTER_MAX_CHARS", "80"))
+N_FEATURES = 2 ** 18
+# слова сравниваются по префиксу этой длины: «спасибочки» покрывается словом «спасибо»
+VOCAB_PREFIX = 5
+
+LLM = "llm"
+MENU = "menu"
+
+_decisions = counter("assistant_router_decisions_total", "User messages by routing decision", ["route", "intent"])
+_classify_us = histogram(
+    "assistant_router_classify_microseconds", "Local intent classification latency in microseconds",
+    buckets=(5, 10, 25, 50, 100, 250, 500, 1000, 2500, 10000),
+)
+
+REPLY_TEMPLATES = {
+    "greeting": (
+        "Здравствуйте! Я юридический ассистент. Могу проконсультировать по общим вопросам "
+        "российского права или проанализировать ваш договор — загрузите документ, и я подготовлю разбор рисков."
+    ),
+    "thanks": "Пожалуйста! Если появятся новые вопросы или документы для анализа — пишите.",
+    "goodbye": "Всего доброго! Будут вопросы — возвращайтесь.",
+    "capabilities": (
+        "Я могу:\n"
+        "- ответить на общие вопросы по гражданскому, трудовому, договорному и предпринимательскому праву;\n"
+        "- проанализировать загруженный договор и найти рискованные условия;\n"
+        "- выделить обязательства сторон, сроки и штрафные санкции;\n"
+        "- подготовить сводный отчёт по нескольким документам сессии.\n"
+        "Мои ответы — рекомендации, а не юридическое заключение."
+    ),
+    "no_documents": "Чтобы выполнить это действие, сначала загрузите документ — после анализа я отвечу по нему.",
+}
+
+# пункты меню: id совпадает с ключами MENU_PROMPTS в legal-агенте
+MENU_ITEMS = {
+    "risk_summary": ("риски", "основные риски", "краткий обзор рисков"),
+    "obligations": ("обязательства", "обязательства сторон"),
+    "deadlines": ("сроки", "ключевые сроки"),
+    "penalties": ("штрафы", "неустойки", "штрафные санкции", "ответственность сторон"),
+    "termination": ("расторжение", "условия расторжения"),
+}
+
+_PUNCT = r"[\s!?.,;:)(\-—]*"
+_FILLER = r"((ну|ок|окей|хорошо|понятно|ясно|отлично) )?"
+INTENT_PATTERNS = {
+    "greeting": r"(привет\w*|здравствуй\w*|добр(ый|ое|ого) (день|вечер|утро|утра|дня|вечера)|доброго времени суток|hi|hello|хай|салют)",
+    "thanks": r"(спасибо|благодарю|спс|thanks|thank you)( (большое|огромное|вам|вас|за (помощь|ответ|консультацию)))*",
+    "goodbye": r"(пока|до свидания|до встречи|всего (доброго|хорошего)|bye)",
+    "capabilities": r"(что (ты|вы) (умеешь|умеете|можешь|можете)|чем (ты|вы) (можешь|можете) помочь|помощь|help|что умеешь|\/?start)",
+}
+
+SEED_EXAMPLES = {
+    "greeting": ["привет", "здравствуйте", "добрый день", "доброе утро", "приветствую", "привет, бот", "здравствуй, ассистент"],
+    "thanks": ["спасибо", "спасибо большое", "благодарю за помощь", "спасибо, всё понятно", "огромное спасибо", "ок, спасибо",
+               "спасибо за разъяснение", "спасибо за ответ"],
+    "goodbye": ["пока", "до свидания", "всего доброго", "до встречи, спасибо", "до скорого"],
+    "capabilities": ["что ты умеешь", "чем можешь помочь", "какие у тебя функции", "что ты можешь делать", "расскажи о своих возможностях",
+                     "как тобой пользоваться", "чем ты можешь быть полезен"],
+    LLM: [
+        "можно ли уволить сотрудника на испытательном сроке",
+        "какая неустойка по договору поставки",
+        "как расторгнуть договор аренды досрочно",
+        "нужно ли платить ндс при упрощенке",
+        "что делать если контрагент не платит",
+        "проверь пункт 5.2 договора",
+        "какие риски в этом договоре",
+        "сколько длится срок исковой давности",
+        "привет, подскажи как оформить договор подряда",
+        "спасибо, а что будет если нарушить срок поставки",
+        "спасибо, а как подать иск",
+        "привет, что такое аванс",
+        "что ты можешь сказать про ндфл",
+        "здравствуйте, у меня вопрос по аренде",
+    ],
+}
+
+
+# служебные слова, которые не меняют смысла реплики
+NEUTRAL_WORDS = frozenset((
+    "а", "и", "ну", "ок", "окей", "же", "очень", "еще", "пожалуйста", "ты", "вы", "тебе", "вам", "тебя", "вас",
+    "мне", "меня", "я", "бот", "ассистент", "уважаемый",
+))
+
+
+def _vocab_key(word: str) -> str:
+    return word[:VOCAB_PREFIX]
+
+
+def intent_vocabulary() -> Dict[str, frozenset]:
+    """Word prefixes of the seed examples and rule patterns of every templated intent."""
+    vocab = {}
+    for intent in REPLY_TEMPLATES:
+        words = re.findall(r"[a-zа-я]+", INTENT_PATTERNS.get(intent, ""))
+        for text in SEED_EXAMPLES.get(intent, ()):
+            words += normalize(text).split()
+        vocab[intent] = frozenset(_vocab_key(w) for w in words)
+    return vocab
+
+
+class RouteDecision(NamedTuple):
+    intent: str
+    # шаблонный ответ; None — ответ готовит LLM (ассистента или legal для пунктов меню)
+    reply: Optional[str]
+    menu_item: Optional[str]
+    source: str
+    confidence: float
+
+
+def normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s/]", " ", text.lower().replace("ё", "е")).split())
+
+
+def _features(text: str) -> Counter:
+    """Hashed word unigrams/bigrams and character 3-grams."""
+    words = text.split()
+    grams = [f"w:{w}" for w in words] + [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    padded = f" {text} "
+    grams += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    return Counter(zlib.crc32(g.encode("utf-8")) % N_FEATURES for g in grams)
+
+
+def _normalized(vec: Dict[int, float]) -> Dict[int, float]:
+    norm = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+    return {k: v / norm for k, v in vec.items()}
+
+
+class HashingIntentClassifier:
+    """Nearest-centroid classifier over hashed TF-IDF vectors (no external dependencies)."""
+
+    def __init__(self, idf: Dict[int, float], centroids: Dict[str, Dict[int, float]], default_idf: float):
+        self.idf = idf
+        self.centroids = centroids
+        self.default_idf = default_idf
+
+    @classmethod
+    def train(cls, examples: Iterable[Tuple[str, str]]) -> "HashingIntentClassifier":
+        docs = [(intent, _features(normalize(text))) for text, intent in examples]
+        df = Counter()
+        for _, feats in docs:
+            df.update(feats.keys())
+        n = len(docs)
+        idf = {f: math.log((1 + n) / (1 + c)) + 1.0 for f, c in df.items()}
+        sums: Dict[str, Dict[int, float]] = defaultdict(lambda: defaultdict(float))
+        for intent, feats in docs:
+            for f, v in _normalized({f: (1 + math.log(c)) * idf[f] for f, c in feats.items()}).items():
+                sums[intent][f] += v
+        centroids = {intent: _normalized(vec) for intent, vec in sums.items()}
+        return cls(idf, centroids, math.log(1 + n) + 1.0)
+
+    def predict(self, text: str) -> Tuple[str, float, float]:
+        """Returns (intent, similarity, margin over the runner-up)."""
+        feats = _features(text)
+        vec = _normalized({f: (1 + math.log(c)) * self.idf.get(f, self.default_idf) for f, c in feats.items()})
+        scores = sorted(
+            ((sum(v * centroid.get(f, 0.0) for f, v in vec.items()), intent) for intent, centroid in self.centroids.items()),
+            reverse=True,
+        )
+        if not scores:
+            return LLM, 0.0, 0.0
+        best_score, best = scores[0]
+        runner_up = scores[1][0] if len(scores) > 1 else 0.0
+        return best, best_score, best_score - runner_up
+
+    def to_dict(self) -> dict:
+        return {
+            "n_features": N_FEATURES,
+            "default_idf": self.default_idf,
+            "idf": {str(k): v for k, v in self.idf.items()},
+            "centroids": {i: {str(k): v for k, v in c.items()} for i, c in self.centroids.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HashingIntentClassifier":
+        if data.get("n_features") != N_FEATURES:
+            raise ValueError("Router model was trained with a different feature space")
+        return cls(
+            {int(k): v for k, v in data["idf"].items()},
+            {i: {int(k): v for k, v in c.items()} for i, c in data["centroids"].items()},
+            data["default_idf"],
+        )
+
+
+class IntentRouter:
+    def __init__(self, classifier: Optional[HashingIntentClassifier] = None, min_similarity: float = ROUTER_MIN_SIMILARITY,
+                 min_margin: float = ROUTER_MIN_MARGIN, max_chars: int = ROUTER_MAX_CHARS):
+        self.classifier = classifier or HashingIntentClassifier.train(seed_examples())
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.max_chars = max_chars
+        self._intents = [(intent, re.compile(rf"^{_PUNCT}{_FILLER}{pattern}{_PUNCT}$")) for intent, pattern in INTENT_PATTERNS.items()]
+        self._menu_labels = {normalize(label): item for item, labels in MENU_ITEMS.items() for label in labels}
+        self._vocab = intent_vocabulary()
+
+    @classmethod
+    def load(cls, path: str = ROUTER_MODEL_PATH) -> "IntentRouter":
+        classifier = None
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    classifier = HashingIntentClassifier.from_dict(json.load(f))
+                logger.info("Loaded router model from %s", path)
+            except Exception:
+                logger.exception("Failed to load router model %s; using seed examples", path)
+        return cls(classifier)
+
+    def match_rules(self, text: str) -> Optional[str]:
+        for intent, pattern in self._intents:
+            if pattern.match(text):
+                return intent
+        return None
+
+    def covers(self, intent: str, normalized: str) -> bool:
+        """True if every word of the message belongs to the intent: nothing is left for the LLM to answer."""
+        vocab = self._vocab.get(intent, frozenset())
+        return all(w in NEUTRAL_WORDS or _vocab_key(w) in vocab for w in normalized.split())
+
+    def _classify(self, text: str, meta: Optional[dict]) -> RouteDecision:
+        menu_item = (meta or {}).get("menu")
+        if menu_item in MENU_ITEMS:
+            return RouteDecision(MENU, None, menu_item, "menu", 1.0)
+        normalized = normalize(text)
+        if not normalized:
+            return RouteDecision(LLM, None, None, "empty", 0.0)
+        if normalized in self._menu_labels:
+            return RouteDecision(MENU, None, self._menu_labels[normalized], "menu", 1.0)
+        if len(normalized) > self.max_chars:
+            return RouteDecision(LLM, None, None, "length", 0.0)
+        intent = self.match_rules(normalized)
+        if intent:
+            return RouteDecision(intent, REPLY_TEMPLATES[intent], None, "rules", 1.0)
+        intent, score, margin = self.classifier.predict(normalized)
+        if (intent in REPLY_TEMPLATES and score >= self.min_similarity and margin >= self.min_margin
+                and self.covers(intent, normalized)):
+            return RouteDecision(intent, REPLY_TEMPLATES[intent], None, "classifier", score)
+        return RouteDecision(LLM, None, None, "classifier", score)
+
+    def route(self, text: str, meta: Optional[dict] = None) -> RouteDecision:
+        started = time.perf_counter()
+        decision = self._classify(text or "", meta)
+        _classify_us.observe((time.perf_counter() - started) * 1e6)
+        return decision
+
+    @staticmethod
+    def record(decision: RouteDecision, route: str) -> None:
+        """route: template, menu or llm — the routed-vs-LLM ratio is computed from these counts."""
+        _decisions.inc(route=route, intent=decision.intent)
+
+
+def seed_examples() -> List[Tuple[str, str]]:
+    return [(text, intent) for intent, texts in SEED_EXAMPLES.items() for text in texts]
+
+
+def label_history(texts: Iterable[str], router: IntentRouter) -> List[Tuple[str, str]]:
+    """Weak labels for chat history: regex matches keep their intent, the rest is ``llm``."""
+    labelled = []
+    for text in texts:
+        normalized = normalize(text)
+        if not normalized or normalized in router._menu_labels:
+            continue
+        labelled.append((text, router.match_rules(normalized) or LLM))
+    return labelled
+
+
+def train(history_path: str, output_path: str) -> None:
+    router = IntentRouter()
+    with open(history_path, encoding="utf-8") as f:
+        texts = [json.loads(line).get("text") or "" for line in f if line.strip()]
+    examples = seed_examples() + label_history(texts, router)
+    model = HashingIntentClassifier.train(examples)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(model.to_dict(), f)
+    by_intent = Counter(intent for _, intent in examples)
+    logger.info("Trained router model on %d examples %s -> %s", len(examples), dict(by_intent), output_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    if len(sys.argv) != 4 or sys.argv[1] != "train":
+        print("usage: python -m agents.assistant.src.router train <history.jsonl> <model.json>", file=sys.stderr)
+        sys.exit(2)
+    train(sys.argv[2], sys.argv[3])
@@ -1,26 +1,66 @@
 import os
 import time
+import asyncio
 import logging
 from typing import Optional, Dict, Any
 
+from agents_shared.async_runtime import stage_timer
+from agents_shared.envelope import create_envelope
+from agents_shared.metrics import counter, histogram
+from agents_shared.prompt_budget import Section
+from agents_shared.rate_limiter import PermitUnavailable
 from agents_shared.redis_storage import safe_get_redis_text
 from .storage import AssistantStorage
-from .llm_client import call_llm, LLMResponse
+from .answer_cache import CACHED_NOTICE, AnswerCache, CachedAnswer
+from .memory import ConversationMemory, Turn
+from .router import LLM, MENU, REPLY_TEMPLATES, IntentRouter, RouteDecision
+from .llm_client import acall_llm, astream_llm, call_llm, stream_llm, LLMResponse
 
 logger = logging.getLogger("assistant.service")
 
 MAX_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
 RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "1.5"))
-SNIPPET_LENGTH = int(os.getenv("SNIPPET_LENGTH", "1000"))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "800"))
 PRODUCE_TOPIC = os.getenv("PRODUCE_TOPIC", "assistant.response")
+STREAMING_ENABLED = os.getenv("LLM_STREAMING", "true").lower() in ("1", "true", "yes")
+# чанки идут в тот же топик с тем же ключом, что и финальный ответ, — порядок внутри партиции сохраняется
+CHUNK_EVENT = "assistant.response.chunk"
+# ответы legal на вопросы, которые ассистент делегировал ему (legal.followup.requested)
+FOLLOWUP_COMPLETED_TOPIC = "legal.followup.completed"
+
+_ttft_seconds = histogram("assistant_llm_time_to_first_token_seconds", "Time from LLM request to the first streamed token")
+_generation_seconds = histogram("assistant_llm_generation_seconds", "Full LLM generation time", ["mode"])
+_stream_chunks = counter("assistant_stream_chunks_total", "Streamed chunks published to Kafka")
+_stream_fallbacks = counter("assistant_stream_fallbacks_total", "Streaming calls that fell back to a blocking LLM call")
 
 
 class AssistantService:
-    def __init__(self, redis_client, kafka_client, formatter, prompts_render):
+    def __init__(self, redis_client, kafka_client, formatter, prompts_render, prompts_build, deferrer=None,
+                 memory: Optional[ConversationMemory] = None, async_redis=None, router: Optional[IntentRouter] = None,
+                 answer_cache: Optional[AnswerCache] = None):
         self.r = redis_client
+        # redis.asyncio-клиент для asyncio-режима (AGENT_RUNTIME=async)
+        self.ar = async_redis
         self.kafka = kafka_client
         self.formatter = formatter
         self.render = prompts_render
+        self.build_prompt = prompts_build
+        self.deferrer = deferrer
+        self.memory = memory
+        # локальная маршрутизация: приветствия, благодарности, пункты меню — без вызова LLM
+        self.router = router
+        # ответы на перефразированные общие вопросы берутся из кэша (MinHash/LSH)
+        self.answer_cache = answer_cache
+
+    @staticmethod
+    def _retry_backoff(attempt: int, max_retries: int) -> float:
+        """Pause before the next LLM attempt; raises once the attempts are exhausted."""
+        if attempt >= max_retries:
+            logger.error("LLM failed after %d attempts", attempt)
+            raise RuntimeError("LLM failed after retries")
+        backoff = RETRY_BACKOFF_BASE ** attempt
+        logger.info("Backing off for %.1f seconds before retrying LLM (attempt %d)", backoff, attempt + 1)
+        return backoff
 
     def _call_llm_with_retries(self, payload: Dict[str, Any], max_retries: int = MAX_RETRIES) -> LLMResponse:
         attempt = 0
@@ -30,84 +70,443 @@ class AssistantService:
                 logger.debug("Calling LLM attempt %d payload keys=%s", attempt, list(payload.keys()))
                 resp = call_llm(payload)
                 return resp
+            except PermitUnavailable:
+                # no permit / 429: the message is deferred instead of sleeping here
+                raise
             except Exception as e:
                 logger.exception("LLM call error on attempt %d: %s", attempt, e)
+            time.sleep(self._retry_backoff(attempt, max_retries))
 
-            if attempt >= max_retries:
-                logger.error("LLM failed after %d attempts", attempt)
-                raise RuntimeError("LLM failed after retries")
-            backoff = RETRY_BACKOFF_BASE ** attempt
-            logger.info("Backing off for %.1f seconds before retrying LLM (attempt %d)", backoff, attempt + 1)
-            time.sleep(backoff)
+    def _chunk_envelope(self, raw: Dict[str, Any], correlation_id: str, seq: int, delta: str) -> Dict[str, Any]:
+        return create_envelope(
+            user_id=raw.get("user_id"),
+            session_id=raw.get("session_id"),
+            source="assistant",
+            event=CHUNK_EVENT,
+            payload={"seq": seq, "delta": delta},
+            correlation_id=correlation_id,
+        )
 
-    def handle_analysis_completed(self, raw: Dict[str, Any], correlation_id: str):
-        redis_key = raw.get("analysis_key")
-        text = safe_get_redis_text(self.r, redis_key)
-        if not text:
-            logger.error("No text found for analysis_key=%s; skipping", redis_key)
+    def _produce_chunk(self, raw: Dict[str, Any], correlation_id: str, seq: int, delta: str, started: float) -> None:
+        if seq == 0:
+            ttft = time.monotonic() - started
+            _ttft_seconds.observe(ttft)
+            logger.info("First token after %.3fs correlation_id=%s", ttft, correlation_id)
+        # не ждём подтверждения на каждый чанк — producer отправит их пачкой по linger.ms
+        self.kafka.produce(PRODUCE_TOPIC, self._chunk_envelope(raw, correlation_id, seq, delta), key=correlation_id, flush=False)
+        _stream_chunks.inc()
+
+    @staticmethod
+    def _stream_failed(error: Exception, seq: int, correlation_id: str) -> None:
+        """Decide how a broken stream continues: re-raise, or return to fall back to a blocking call."""
+        if isinstance(error, PermitUnavailable):
+            if seq == 0:
+                raise error
+            logger.warning("LLM throttled mid-stream after %d chunks, correlation_id=%s; falling back", seq, correlation_id)
+        else:
+            logger.error("LLM stream failed after %d chunks, correlation_id=%s; falling back", seq, correlation_id, exc_info=error)
+        _stream_fallbacks.inc()
+
+    @staticmethod
+    def _streamed(payload: Dict[str, Any], parts, started: float) -> LLMResponse:
+        _generation_seconds.observe(time.monotonic() - started, mode="stream")
+        return LLMResponse(text="".join(parts), id=None, metadata={**payload.get("metadata", {}), "chunks": len(parts)})
+
+    def _stream_llm_to_user(self, payload: Dict[str, Any], raw: Dict[str, Any], correlation_id: str) -> LLMResponse:
+        """
+        Стримит ответ LLM чанками в PRODUCE_TOPIC (event=assistant.response.chunk, seq с нуля).
+        Если поток оборвался, дозапрашивает ответ целиком обычным вызовом с ретраями —
+        финальное сообщение всё равно заменит частичный текст на клиенте.
+        """
+        started = time.monotonic()
+        parts = []
+        try:
+            for delta in stream_llm(payload):
+                self._produce_chunk(raw, correlation_id, len(parts), delta, started)
+                parts.append(delta)
+            self.kafka.flush()
+        except Exception as e:
+            self._stream_failed(e, len(parts), correlation_id)
+            return self._call_llm_with_retries(payload)
+        return self._streamed(payload, parts, started)
+
+    def _produce_response(self, raw: Dict[str, Any], correlation_id: str, text: str, analysis_key: Optional[str],
+                          flush: bool = True, **extra):
+        envelope = create_envelope(
+            user_id=raw.get("user_id"),
+            session_id=raw.get("session_id"),
+            source="assistant",
+            event="assistant.response",
+            payload={"text": text, "analysis_key": analysis_key, **extra},
+            correlation_id=correlation_id,
+        )
+        self.kafka.produce(PRODUCE_TOPIC, envelope, key=correlation_id, flush=flush)
+
+    @staticmethod
+    def _followup_answer(raw: Dict[str, Any]) -> Optional[str]:
+        payload = raw.get("payload") if isinstance(raw.get("payload"), dict) else raw
+        return payload.get("answer")
+
+    @staticmethod
+    def _followup_conversation(raw: Dict[str, Any]) -> Optional[str]:
+        # тот же ключ памяти, что у вопроса (см. _parse_user_message)
+        return raw.get("session_id") or raw.get("user_id")
+
+    def handle_followup_completed(self, raw: Dict[str, Any], correlation_id: str):
+        """Legal answered a question delegated to it: deliver the answer as the assistant's reply."""
+        answer = self._followup_answer(raw)
+        if not answer:
+            logger.error("Empty legal followup answer, correlation_id=%s; skipping", correlation_id)
             return
-        formatted = self.formatter.format_analysis(text)
-        output = {
+        self._produce_response(raw, correlation_id, self.formatter.format_analysis(answer), None, delegated="legal")
+        if self.memory is not None:
+            # вопрос попал в память при делегировании, ответ дополняет реплику
+            self.memory.append(self._followup_conversation(raw), Turn("assistant", answer, time.time()))
+
+    def _produce_error(self, raw: Dict[str, Any], correlation_id: str, reason: str, flush: bool = True,
+                       retryable: bool = False):
+        # retryable: сообщение не обработано из-за нехватки мощности (лимиты LLM), его можно повторить позже
+        self.kafka.produce("chat.error", {"user_id": raw.get("user_id"), "reason": reason, "correlation_id": correlation_id,
+                                          "retryable": retryable}, key=correlation_id, flush=flush)
+
+    def _analysis_output(self, raw: Dict[str, Any], correlation_id: str, redis_key: Optional[str], text: str) -> Dict[str, Any]:
+        return {
             "user_id": raw.get("user_id"),
-            "text": formatted,
+            "text": self.formatter.format_analysis(text),
             "source": "assistant",
             "analysis_key": redis_key,
             "correlation_id": correlation_id,
         }
-        self.kafka.produce(PRODUCE_TOPIC, output, key=correlation_id)
+
+    @staticmethod
+    def _analysis_key(raw: Dict[str, Any]) -> Optional[str]:
+        # legal публикует конверт: ключ анализа (документа или сводного отчёта по сессии) лежит в payload
+        payload = raw.get("payload") if isinstance(raw.get("payload"), dict) else raw
+        return payload.get("analysis_key")
+
+    def handle_analysis_completed(self, raw: Dict[str, Any], correlation_id: str):
+        redis_key = self._analysis_key(raw)
+        text = safe_get_redis_text(self.r, redis_key)
+        if not text:
+            logger.error("No text found for analysis_key=%s; skipping", redis_key)
+            return
+        self.kafka.produce(PRODUCE_TOPIC, self._analysis_output(raw, correlation_id, redis_key, text), key=correlation_id)
+
+    @staticmethod
+    def _parse_user_message(raw: Dict[str, Any]):
+        """Returns (user_text, session_id, conversation_id) from a gateway envelope or a legacy message."""
+        # шлюз присылает конверт: текст пользователя лежит в payload
+        message = raw.get("payload") if isinstance(raw.get("payload"), dict) else raw
+        user_text = message.get("text") or ""
+        session_id = raw.get("session_id") or (message.get("meta") or {}).get("session_id")
+        return user_text, session_id, session_id or raw.get("user_id")
+
+    def _route(self, raw: Dict[str, Any], user_text: str) -> Optional[RouteDecision]:
+        if self.router is None:
+            return None
+        message = raw.get("payload") if isinstance(raw.get("payload"), dict) else raw
+        try:
+            return self.router.route(user_text, message.get("meta"))
+        except Exception:
+            logger.exception("Intent routing failed; falling back to LLM")
+            return None
+
+    def _followup_request(self, raw: Dict[str, Any], correlation_id: str, session_id: str, query: str,
+                          query_type: str = "default") -> Dict[str, Any]:
+        # конверт, а не legacy-сообщение: legacy-обёртка legal-агента меняет event и correlation_id
+        return create_envelope(
+            user_id=raw.get("user_id"),
+            session_id=session_id,
+            source="assistant",
+            event="legal.followup.requested",
+            payload={"text": query, "query": query, "query_type": query_type, "session_id": session_id},
+            correlation_id=correlation_id,
+        )
+
+    def _menu_request(self, raw: Dict[str, Any], correlation_id: str, session_id: str, decision: RouteDecision) -> Dict[str, Any]:
+        return self._followup_request(raw, correlation_id, session_id, decision.menu_item, MENU)
+
+    def _reply_payload(self, raw: Dict[str, Any], correlation_id: str, user_text: str, snapshot) -> Dict[str, Any]:
+        # история: скользящее окно последних реплик + накопленное краткое содержание; размер промпта ограничен
+        sections = [Section("snippet", user_text, weight=3.0)]
+        if self.memory is not None:
+            sections += self.memory.prompt_sections(snapshot)
+        built = self.build_prompt("assistant_reply", sections, LLM_MAX_TOKENS)
+        return {
+            "prompt": built.text,
+            "max_tokens": LLM_MAX_TOKENS,
+            "priority": "interactive",
+            "metadata": {
+                "user_id": raw.get("user_id"),
+                "correlation_id": correlation_id,
+                "template": "assistant_reply",
+                "prompt_tokens": built.report.total_tokens,
+            },
+        }
+
+    def _cached_reply(self, raw: Dict[str, Any], correlation_id: str, hit: CachedAnswer, flush: bool = True) -> str:
+        reply = CACHED_NOTICE + hit.answer
+        logger.info("Answer cache hit similarity=%.2f entry=%s correlation_id=%s", hit.similarity, hit.entry_id, correlation_id)
+        self._produce_response(raw, correlation_id, self.formatter.format_analysis(reply), None, flush=flush,
+                               cached=True, similarity=round(hit.similarity, 3))
+        return reply
+
+    def _reply_routed(self, raw: Dict[str, Any], correlation_id: str, session_id: Optional[str],
+                      decision: RouteDecision, has_docs: bool, flush: bool = True) -> Optional[str]:
+        """Answer a locally routed message; returns the reply to remember, None if legal answers it."""
+        reply = decision.reply
+        if decision.intent == MENU:
+            if has_docs:
+                self.kafka.produce("legal.followup.requested", self._menu_request(raw, correlation_id, session_id, decision), key=correlation_id, flush=flush)
+                IntentRouter.record(decision, route="menu")
+                return None
+            reply = REPLY_TEMPLATES["no_documents"]
+        IntentRouter.record(decision, route="template")
+        self._produce_response(raw, correlation_id, reply, None, flush=flush, intent=decision.intent)
+        return reply
+
+    @staticmethod
+    def _turns(user_turn: Turn, reply: Optional[str]):
+        return (user_turn,) if reply is None else (user_turn, Turn("assistant", reply, time.time()))
+
+    def _publish_reply(self, raw: Dict[str, Any], correlation_id: str, text: str, key: Optional[str],
+                       chunks: int, flush: bool = True) -> None:
+        if key is None:
+            # ответ не сохранился в Redis — отправляем укороченный черновик
+            self._produce_response(raw, correlation_id, self.formatter.format_analysis(text[:2000]), None, flush=flush, chunks=chunks)
+            logger.warning("Saved short draft to '%s' because redis save failed.", PRODUCE_TOPIC)
+            return
+        # финальное сообщение несёт число чанков: клиент заменяет им собранный из чанков текст
+        self._produce_response(raw, correlation_id, self.formatter.format_analysis(text), key, flush=flush, chunks=chunks)
 
     def handle_user_message(self, raw: Dict[str, Any], correlation_id: str):
-        user_text = raw.get("text", "")
-        session_id = raw.get("session_id")
+        user_text, session_id, conversation_id = self._parse_user_message(raw)
+        user_turn = Turn("user", user_text, time.time())
+        remember = self.memory is not None and conversation_id
 
         storage = AssistantStorage(self.r)
 
+        decision = self._route(raw, user_text)
+        if decision is not None and decision.intent != LLM:
+            has_docs = decision.intent == MENU and bool(session_id) and storage.session_has_active_docs(session_id)
+            reply = self._reply_routed(raw, correlation_id, session_id, decision, has_docs)
+            if remember:
+                self.memory.append(conversation_id, *self._turns(user_turn, reply))
+            return
+        if decision is not None:
+            IntentRouter.record(decision, route="llm")
+
         # If session has any active documents, delegate to legal agent
         try:
             if session_id and storage.session_has_active_docs(session_id):
                 self.kafka.produce(
                     "legal.followup.requested",
-                    {"text": user_text, "session_id": session_id},
+                    self._followup_request(raw, correlation_id, session_id, user_text),
                     key=correlation_id,
                 )
+                if remember:
+                    self.memory.append(conversation_id, user_turn)
                 return
         except Exception:
             logger.exception("Failed to check Redis session active docs; falling back to local processing")
 
-        snippet = user_text[:SNIPPET_LENGTH]
-        prompt_text = self.render("assistant_reply", snippet=snippet)
+        if self.answer_cache is not None:
+            with stage_timer("assistant", "cache"):
+                hit = self.answer_cache.lookup(user_text)
+            if hit is not None:
+                reply = self._cached_reply(raw, correlation_id, hit)
+                if remember:
+                    self.memory.append(conversation_id, *self._turns(user_turn, reply))
+                return
 
-        payload = {
-            "prompt": prompt_text,
-            "max_tokens": int(os.getenv("LLM_MAX_TOKENS", "800")),
-            "metadata": {"user_id": raw.get("user_id"), "correlation_id": correlation_id},
-        }
+        with stage_timer("assistant", "context"):
+            snapshot = self.memory.load(conversation_id) if remember else None
+        with stage_timer("assistant", "prompt"):
+            payload = self._reply_payload(raw, correlation_id, user_text, snapshot)
 
         try:
-            llm_resp = self._call_llm_with_retries(payload)
+            with stage_timer("assistant", "llm"):
+                if STREAMING_ENABLED:
+                    llm_resp = self._stream_llm_to_user(payload, raw, correlation_id)
+                else:
+                    started = time.monotonic()
+                    llm_resp = self._call_llm_with_retries(payload)
+                    _generation_seconds.observe(time.monotonic() - started, mode="blocking")
+        except PermitUnavailable:
+            raise
         except Exception as e:
             logger.exception("LLM processing failed for user %s, correlation_id=%s", raw.get("user_id"), correlation_id)
-            self.kafka.produce("chat.error", {"user_id": raw.get("user_id"), "reason": str(e), "correlation_id": correlation_id}, key=correlation_id)
+            self._produce_error(raw, correlation_id, str(e))
             return
 
         llm_response = llm_resp.text
+        # в кэш попадают только ответы без истории разговора — они не зависят от контекста
+        if self.answer_cache is not None and not (snapshot and snapshot.turns):
+            self.answer_cache.store(user_text, llm_response)
+        if remember:
+            # краткое содержание при переполнении окна обновляется в фоне, ответ его не ждёт
+            self.memory.append(conversation_id, *self._turns(user_turn, llm_response))
+
+        with stage_timer("assistant", "publish"):
+            try:
+                # save followup result key is handled by storage helper
+                key = storage.save_llm_response(llm_response)
+            except Exception:
+                key = None
+            self._publish_reply(raw, correlation_id, llm_response, key, llm_resp.metadata.get("chunks", 0))
+
+    @staticmethod
+    def _correlation_id(raw: Dict[str, Any], key: Optional[str]) -> str:
+        return raw.get("correlation_id") or key or raw.get("user_id") or "unknown"
+
+    def handle_message(self, topic: str, raw: Dict[str, Any], key: Optional[str] = None):
+        correlation_id = self._correlation_id(raw, key)
+        try:
+            if topic == "analysis.completed":
+                self.handle_analysis_completed(raw, correlation_id)
+            elif topic == FOLLOWUP_COMPLETED_TOPIC:
+                self.handle_followup_completed(raw, correlation_id)
+            elif topic == "user.message":
+                self.handle_user_message(raw, correlation_id)
+            else:
+                logger.warning("Unknown topic: %s", topic)
+        except PermitUnavailable as e:
+            if self.deferrer is None:
+                raise
+            logger.info("No LLM permit (%s), deferring correlation_id=%s", e.reason, correlation_id)
+            if not self.deferrer.defer(topic, raw, key, e.retry_after):
+                self._produce_error(raw, correlation_id, str(e), retryable=True)
+
+    # --- asyncio-режим: те же сценарии на achat/astream и redis.asyncio, без блокировки event loop ---
+    # Kafka-сообщения ставятся в буфер продюсера без flush — его выполняет рантайм при остановке.
+
+    async def _acall_llm_with_retries(self, payload: Dict[str, Any], max_retries: int = MAX_RETRIES) -> LLMResponse:
+        attempt = 0
+        while True:
+            try:
+                attempt += 1
+                return await acall_llm(payload)
+            except PermitUnavailable:
+                raise
+            except Exception as e:
+                logger.exception("LLM call error on attempt %d: %s", attempt, e)
+            await asyncio.sleep(self._retry_backoff(attempt, max_retries))
+
+    async def _astream_llm_to_user(self, payload: Dict[str, Any], raw: Dict[str, Any], correlation_id: str) -> LLMResponse:
+        started = time.monotonic()
+        parts = []
+        try:
+            async for delta in astream_llm(payload):
+                self._produce_chunk(raw, correlation_id, len(parts), delta, started)
+                parts.append(delta)
+        except Exception as e:
+            self._stream_failed(e, len(parts), correlation_id)
+            return await self._acall_llm_with_retries(payload)
+        return self._streamed(payload, parts, started)
+
+    async def ahandle_followup_completed(self, raw: Dict[str, Any], correlation_id: str):
+        answer = self._followup_answer(raw)
+        if not answer:
+            logger.error("Empty legal followup answer, correlation_id=%s; skipping", correlation_id)
+            return
+        self._produce_response(raw, correlation_id, self.formatter.format_analysis(answer), None, flush=False, delegated="legal")
+        if self.memory is not None:
+            await self.memory.aappend(self._followup_conversation(raw), Turn("assistant", answer, time.time()))
+
+    async def ahandle_analysis_completed(self, raw: Dict[str, Any], correlation_id: str):
+        redis_key = self._analysis_key(raw)
+        text = await self.ar.get(redis_key) if redis_key else None
+        if not text:
+            logger.error("No text found for analysis_key=%s; skipping", redis_key)
+            return
+        self.kafka.produce(PRODUCE_TOPIC, self._analysis_output(raw, correlation_id, redis_key, text), key=correlation_id, flush=False)
+
+    async def ahandle_user_message(self, raw: Dict[str, Any], correlation_id: str):
+        user_text, session_id, conversation_id = self._parse_user_message(raw)
+        user_turn = Turn("user", user_text, time.time())
+        remember = self.memory is not None and conversation_id
+        storage = AssistantStorage(self.r, async_redis=self.ar)
+
+        decision = self._route(raw, user_text)
+        if decision is not None and decision.intent != LLM:
+            has_docs = decision.intent == MENU and bool(session_id) and await storage.asession_has_active_docs(session_id)
+            reply = self._reply_routed(raw, correlation_id, session_id, decision, has_docs, flush=False)
+            if remember:
+                await self.memory.aappend(conversation_id, *self._turns(user_turn, reply))
+            return
+        if decision is not None:
+            IntentRouter.record(decision, route="llm")
 
         try:
-            # save followup result key is handled by storage helper
-            key = storage.save_llm_response(llm_response)
+            if session_id and await storage.asession_has_active_docs(session_id):
+                self.kafka.produce(
+                    "legal.followup.requested",
+                    self._followup_request(raw, correlation_id, session_id, user_text),
+                    key=correlation_id,
+                    flush=False,
+                )
+                if remember:
+                    await self.memory.aappend(conversation_id, user_turn)
+                return
         except Exception:
-            short_text = llm_response[:2000]
-            self.kafka.produce(PRODUCE_TOPIC, {"user_id": raw.get("user_id"), "text": self.formatter.format_analysis(short_text), "analysis_key": None, "correlation_id": correlation_id}, key=correlation_id)
-            logger.warning("Saved short draft to '%s' because redis save failed.", PRODUCE_TOPIC)
+            logger.exception("Failed to check Redis session active docs; falling back to local processing")
+
+        if self.answer_cache is not None:
+            with stage_timer("assistant", "cache"):
+                hit = await asyncio.to_thread(self.answer_cache.lookup, user_text)
+            if hit is not None:
+                reply = self._cached_reply(raw, correlation_id, hit, flush=False)
+                if remember:
+                    await self.memory.aappend(conversation_id, *self._turns(user_turn, reply))
+                return
+
+        with stage_timer("assistant", "context"):
+            snapshot = await self.memory.aload(conversation_id) if remember else None
+        with stage_timer("assistant", "prompt"):
+            payload = self._reply_payload(raw, correlation_id, user_text, snapshot)
+
+        try:
+            with stage_timer("assistant", "llm"):
+                if STREAMING_ENABLED:
+                    llm_resp = await self._astream_llm_to_user(payload, raw, correlation_id)
+                else:
+                    started = time.monotonic()
+                    llm_resp = await self._acall_llm_with_retries(payload)
+                    _generation_seconds.observe(time.monotonic() - started, mode="blocking")
+        except PermitUnavailable:
+            raise
+        except Exception as e:
+            logger.exception("LLM processing failed for user %s, correlation_id=%s", raw.get("user_id"), correlation_id)
+            self._produce_error(raw, correlation_id, str(e), flush=False)
             return
 
-        self.kafka.produce(PRODUCE_TOPIC, {"user_id": raw.get("user_id"), "text": self.formatter.format_analysis(llm_response), "analysis_key": key, "correlation_id": correlation_id}, key=correlation_id)
+        llm_response = llm_resp.text
+        if self.answer_cache is not None and not (snapshot and snapshot.turns):
+            await asyncio.to_thread(self.answer_cache.store, user_text, llm_response)
+        if remember:
+            await self.memory.aappend(conversation_id, *self._turns(user_turn, llm_response))
 
-    def handle_message(self, topic: str, raw: Dict[str, Any], key: Optional[str] = None):
-        correlation_id = raw.get("correlation_id") or key or raw.get("user_id") or "unknown"
-        if topic == "analysis.completed":
-            self.handle_analysis_completed(raw, correlation_id)
-        elif topic == "user.message":
-            self.handle_user_message(raw, correlation_id)
-        else:
-            logger.warning("Unknown topic: %s", topic)
+        with stage_timer("assistant", "publish"):
+            try:
+                key = await storage.asave_llm_response(llm_response)
+            except Exception:
+                key = None
+            self._publish_reply(raw, correlation_id, llm_response, key, llm_resp.metadata.get("chunks", 0), flush=False)
+
+    async def ahandle_message(self, topic: str, raw: Dict[str, Any], key: Optional[str] = None):
+        correlation_id = self._correlation_id(raw, key)
+        try:
+            if topic == "analysis.completed":
+                await self.ahandle_analysis_completed(raw, correlation_id)
+            elif topic == FOLLOWUP_COMPLETED_TOPIC:
+                await self.ahandle_followup_completed(raw, correlation_id)
+            elif topic == "user.message":
+                await self.ahandle_user_message(raw, correlation_id)
+            else:
+                logger.warning("Unknown topic: %s", topic)
+        except PermitUnavailable as e:
+            if self.deferrer is None:
+                raise
+            logger.info("No LLM permit (%s), deferring correlation_id=%s", e.reason, correlation_id)
+            if not await asyncio.to_thread(self.deferrer.defer, topic, raw, key, e.retry_after):
+                self._produce_error(raw, correlation_id, str(e), flush=False, retryable=True)
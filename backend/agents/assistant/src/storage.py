@@ -1,13 +1,14 @@
 import logging
 
-from agents_shared.redis_storage import get_active_documents_for_session, save_text
+from agents_shared.redis_storage import EXPIRE_TIME, get_active_documents_for_session, save_text
 
 logger = logging.getLogger("assistant.storage")
 
 
 class AssistantStorage:
-    def __init__(self, redis_client):
+    def __init__(self, redis_client, async_redis=None):
         self.r = redis_client
+        self.ar = async_redis
 
     def session_has_active_docs(self, session_id: str) -> bool:
         try:
@@ -23,3 +24,16 @@ class AssistantStorage:
         if file_id is None:
             file_id = "response"
         return save_text(self.r, session_id, file_id, content, prefix="llm_assistant_response")
+
+    async def asession_has_active_docs(self, session_id: str) -> bool:
+        try:
+            return bool(await self.ar.scard(f"session:{session_id}:active_docs"))
+        except Exception:
+            logger.exception("Error while getting active documents for session %s", session_id)
+            return False
+
+    async def asave_llm_response(self, content: str, session_id: str = "assistant", file_id: str = "response") -> str:
+        # тот же ключ, что и у save_llm_response
+        key = f"llm_assistant_response:{session_id}:{file_id}"
+        await self.ar.set(key, content, ex=EXPIRE_TIME)
+        return key
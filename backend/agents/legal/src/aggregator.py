@@ -0,0 +1,194 @@
+"""Session-level analysis across all documents of a session (main contract plus annexes).
+
+The aggregator fans out one task per active document: a task returns the document's
+analysis as soon as it is in Redis, analyses the parsed text itself if nobody else is
+doing it, or keeps polling while the document is still being parsed/analysed. It waits
+for all tasks up to a deadline; documents that missed it are reported as missing and the
+consolidated report is built from what is available (``partial``).
+
+Reports are keyed by a fingerprint of the per-document analyses they were built from,
+so re-running the aggregation for an unchanged session costs no LLM call. Progress is
+kept in the ``session:{session_id}:analysis`` hash:
+status (running/completed/partial/failed), total, done, failed, report_key.
+"""
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from agents_shared.analysis_store import AnalysisStore, SessionReport, session_report_key
+from agents_shared.metrics import counter, histogram
+from agents_shared.prompt_budget import Section
+from agents_shared.rate_limiter import PermitUnavailable
+from agents_shared.redis_storage import EXPIRE_TIME, get_active_documents_for_session, get_analysis_from_redis, safe_get_redis_text
+from .prompts import build as build_prompt
+
+logger = logging.getLogger("legal.aggregator")
+
+AGGREGATION_DEADLINE = float(os.getenv("SESSION_AGGREGATION_DEADLINE", "180"))
+AGGREGATION_WORKERS = int(os.getenv("SESSION_AGGREGATION_WORKERS", "4"))
+POLL_INTERVAL = float(os.getenv("SESSION_AGGREGATION_POLL_INTERVAL", "1.0"))
+SESSION_REPORT_MAX_TOKENS = int(os.getenv("SESSION_REPORT_MAX_TOKENS", "1500"))
+REPORT_DEADLINE_SECONDS = float(os.getenv("REVIEW_LLM_DEADLINE", "60"))
+
+_runs = counter("legal_session_aggregations_total", "Session aggregations by outcome", ["status"])
+_run_seconds = histogram("legal_session_aggregation_seconds", "Time to build a session report")
+_documents = counter("legal_session_documents_total", "Documents considered by session aggregation", ["status"])
+
+
+class AggregationResult(NamedTuple):
+    report_key: Optional[str]
+    file_ids: List[str]
+    missing: List[str]
+    partial: bool
+
+
+def progress_key(session_id: str) -> str:
+    return f"session:{session_id}:analysis"
+
+
+def _fingerprint(analyses: Dict[str, str]) -> str:
+    h = hashlib.sha256()
+    for file_id in sorted(analyses):
+        h.update(file_id.encode("utf-8"))
+        h.update(hashlib.sha256(analyses[file_id].encode("utf-8")).digest())
+    return h.hexdigest()
+
+
+class SessionAggregator:
+    def __init__(self, redis_client, store: AnalysisStore, analyze: Callable[..., Optional[str]],
+                 call_llm: Callable[[dict], object], workers: int = AGGREGATION_WORKERS):
+        """
+        analyze(session_id, file_id, text, correlation_id) returns the analysis text, or None
+        when another worker is already analysing that document.
+        """
+        self.r = redis_client
+        self.store = store
+        self.analyze = analyze
+        self.call_llm = call_llm
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="session-agg")
+
+    def _progress(self, session_id: str, **fields) -> None:
+        key = progress_key(session_id)
+        try:
+            pipe = self.r.pipeline(transaction=False)
+            pipe.hset(key, mapping={k: str(v) for k, v in fields.items()})
+            pipe.expire(key, EXPIRE_TIME)
+            pipe.execute()
+        except Exception:
+            logger.exception(f"Failed to update analysis progress for session_id={session_id}")
+
+    def _bump(self, session_id: str, field: str) -> None:
+        try:
+            self.r.hincrby(progress_key(session_id), field, 1)
+        except Exception:
+            logger.exception(f"Failed to update analysis progress for session_id={session_id}")
+
+    def _await_document(self, session_id: str, file_id: str, correlation_id: Optional[str], deadline_at: float) -> Optional[str]:
+        while True:
+            analysis = get_analysis_from_redis(self.r, session_id, file_id)
+            if analysis:
+                self._bump(session_id, "done")
+                return analysis
+            text = safe_get_redis_text(self.r, f"doc:text:{session_id}:{file_id}")
+            delay = POLL_INTERVAL
+            if text:
+                try:
+                    analysis = self.analyze(session_id, file_id, text, correlation_id)
+                except PermitUnavailable as e:
+                    delay = max(delay, e.retry_after)
+                except Exception:
+                    self._bump(session_id, "failed")
+                    raise
+                if analysis:
+                    self._bump(session_id, "done")
+                    return analysis
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(delay, remaining))
+
+    def run(self, session_id: str, correlation_id: Optional[str] = None,
+            deadline: float = AGGREGATION_DEADLINE) -> Optional[AggregationResult]:
+        file_ids = sorted(get_active_documents_for_session(self.r, session_id))
+        if not file_ids:
+            return None
+        started = time.monotonic()
+        self._progress(session_id, status="running", total=len(file_ids), done=0, failed=0,
+                       started_at=time.time(), correlation_id=correlation_id or "", report_key="")
+
+        futures = {
+            self._pool.submit(self._await_document, session_id, file_id, correlation_id, started + deadline): file_id
+            for file_id in file_ids
+        }
+        done, pending = wait(futures, timeout=deadline)
+        analyses: Dict[str, str] = {}
+        for future in done:
+            file_id = futures[future]
+            try:
+                analysis = future.result()
+            except Exception:
+                logger.exception(f"Analysis of file_id={file_id} failed during session aggregation")
+                _documents.inc(status="failed")
+                continue
+            if analysis:
+                analyses[file_id] = analysis
+                _documents.inc(status="done")
+            else:
+                _documents.inc(status="timeout")
+        for future in pending:
+            # уже идущий анализ доработает в фоне и попадёт в следующий отчёт
+            future.cancel()
+            _documents.inc(status="timeout")
+
+        missing = [f for f in file_ids if f not in analyses]
+        partial = bool(missing)
+        if not analyses:
+            self._progress(session_id, status="failed", finished_at=time.time())
+            _runs.inc(status="failed")
+            return AggregationResult(None, [], missing, True)
+
+        fingerprint = _fingerprint(analyses)
+        report = self.store.get_session_report(session_id, fingerprint)
+        if report is None:
+            report = SessionReport(
+                session_id, fingerprint, sorted(analyses), partial,
+                self._consolidate(analyses, missing, correlation_id),
+            )
+            report_key = self.store.save_session_report(report)
+        else:
+            report_key = session_report_key(session_id)
+            logger.info(f"Reusing session report fingerprint={fingerprint[:12]} session_id={session_id}")
+
+        status = "partial" if partial else "completed"
+        self._progress(session_id, status=status, report_key=report_key, finished_at=time.time())
+        _runs.inc(status=status)
+        _run_seconds.observe(time.monotonic() - started)
+        logger.info(f"Session report for session_id={session_id}: {len(analyses)}/{len(file_ids)} documents, missing={missing}")
+        return AggregationResult(report_key, sorted(analyses), missing, partial)
+
+    def _consolidate(self, analyses: Dict[str, str], missing: List[str], correlation_id: Optional[str]) -> str:
+        if len(analyses) == 1 and not missing:
+            # один документ — сводный отчёт совпадает с его анализом
+            return next(iter(analyses.values()))
+        documents = "\n\n".join(f"Документ {file_id}:\n{text}" for file_id, text in sorted(analyses.items()))
+        built = build_prompt(
+            "session_report",
+            [Section("documents", documents)],
+            SESSION_REPORT_MAX_TOKENS,
+            missing=", ".join(missing),
+        )
+        resp = self.call_llm({
+            "prompt": built.text,
+            "max_tokens": SESSION_REPORT_MAX_TOKENS,
+            "priority": "batch",
+            "deadline": REPORT_DEADLINE_SECONDS,
+            "metadata": {
+                "correlation_id": correlation_id,
+                "template": "session_report",
+                "prompt_tokens": built.report.total_tokens,
+            },
+        })
+        return resp.text
@@ -0,0 +1,193 @@
+"""Incremental legal review of a document.
+
+1. Exactly the same text was analysed before (any session) -> reuse that analysis, no LLM call.
+2. Otherwise the document is split into clauses; findings for clause hashes already in the
+   store are carried over and only new/changed clauses are sent to the LLM, packed into
+   as few ``clause_review`` prompts as the token budget allows.
+3. The short summary shown to the user is regenerated (``analysis_summary``) only when
+   the set of flagged findings differs from the previous version of the contract.
+
+A clause the LLM left out of its answer is not assumed to be risk-free: it is sent
+again in a smaller prompt, and if it is still missing the review fails with
+:class:`IncompleteReview` (findings obtained so far stay cached for the next attempt).
+"""
+import hashlib
+import logging
+import os
+import re
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from agents_shared.analysis_store import AnalysisStore, StoredAnalysis
+from agents_shared.metrics import counter
+from agents_shared.prompt_budget import Section, get_token_counter, prompt_budget, trim_to_tokens
+from .clauses import Clause, content_hash, split_clauses
+from .prompts import PROMPT_TOKEN_CAPS, build as build_prompt, render
+
+logger = logging.getLogger("legal.analyzer")
+
+CLAUSE_MAX_TOKENS = int(os.getenv("CLAUSE_REVIEW_MAX_TOKENS", "1500"))
+SUMMARY_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "1500"))
+# ответ — одна строка на пункт; ограничиваем число пунктов, чтобы вывод уместился в max_tokens
+CLAUSES_PER_BATCH = int(os.getenv("CLAUSES_PER_BATCH", "15"))
+REVIEW_DEADLINE_SECONDS = float(os.getenv("REVIEW_LLM_DEADLINE", "60"))
+# сколько раз переспрашивать пункты, по которым в ответе нет вывода
+REVIEW_MISSING_RETRIES = int(os.getenv("CLAUSE_REVIEW_MISSING_RETRIES", "1"))
+
+_FINDING_RE = re.compile(r"^\s*\[(\d+)\]\s*(.+?)\s*$", re.MULTILINE)
+_GREEN_MARKERS = ("ЗЕЛЕН", "ЗЕЛЁН", "🟢")
+
+_clauses = counter("legal_review_clauses_total", "Clauses seen by the incremental review", ["source"])
+_documents = counter("legal_review_documents_total", "Documents reviewed, by how much was reused", ["result"])
+
+
+class IncompleteReview(RuntimeError):
+    """The LLM returned no finding for some clauses even after they were asked again."""
+
+    def __init__(self, file_id: str, missing: List[Clause]):
+        super().__init__(f"No findings for {len(missing)} clauses of {file_id}: {', '.join(c.label for c in missing[:10])}")
+        self.missing = missing
+
+
+class AnalysisResult(NamedTuple):
+    analysis_key: str
+    analysis_text: str
+    reused_clauses: int
+    analysed_clauses: int
+    llm_calls: int
+
+
+def _is_flagged(finding: str) -> bool:
+    upper = finding.upper()
+    return not any(marker in upper for marker in _GREEN_MARKERS)
+
+
+def _findings_hash(flagged: List[str]) -> str:
+    return hashlib.sha256("\n".join(flagged).encode("utf-8")).hexdigest()
+
+
+class IncrementalAnalyzer:
+    def __init__(self, store: AnalysisStore, call_llm: Callable[[dict], object]):
+        self.store = store
+        self.call_llm = call_llm
+        self.counter = get_token_counter()
+
+    def analyze(self, session_id: str, file_id: str, text: str, correlation_id: Optional[str] = None) -> AnalysisResult:
+        doc_hash = content_hash(text)
+        existing = self.store.get_by_content_hash(doc_hash)
+        if existing is not None:
+            key = self.store.save_analysis(existing._replace(session_id=session_id, file_id=file_id))
+            _documents.inc(result="identical")
+            logger.info(f"Reusing analysis of identical document content_hash={doc_hash[:12]} file_id={file_id}")
+            return AnalysisResult(key, existing.analysis_text, len(existing.clause_hashes), 0, 0)
+
+        clauses = split_clauses(text)
+        hashes = [c.hash for c in clauses]
+        findings = self.store.get_clause_findings(hashes)
+        changed = [c for c in clauses if c.hash not in findings]
+        # один и тот же пункт может повторяться в документе — анализируем его один раз
+        changed = list({c.hash: c for c in changed}.values())
+        _clauses.inc(len(clauses) - len(changed), source="reused")
+        _clauses.inc(len(changed), source="analysed")
+
+        llm_calls = 0
+        pending = changed
+        for _ in range(REVIEW_MISSING_RETRIES + 1):
+            missing: List[Clause] = []
+            for batch in self._batches(pending):
+                reviewed = self._review_batch(batch, file_id, correlation_id)
+                findings.update(reviewed)
+                missing += [c for c in batch if c.hash not in reviewed]
+                llm_calls += 1
+            if not missing:
+                break
+            pending = missing
+        else:
+            _clauses.inc(len(missing), source="unknown")
+            raise IncompleteReview(file_id, missing)
+
+        flagged = [c for c in clauses if c.hash in findings and _is_flagged(findings[c.hash])]
+        # номера пунктов в хеш не входят: перенумерация не требует нового резюме
+        findings_hash = _findings_hash([findings[c.hash] for c in flagged])
+        previous = self.store.find_previous_version(session_id, hashes)
+        if previous is not None and previous.findings_hash == findings_hash:
+            summary = previous.analysis_text
+        else:
+            summary = self._summarize(text, clauses, [f"{c.label} {findings[c.hash]}" for c in flagged], file_id, correlation_id)
+            llm_calls += 1
+
+        key = self.store.save_analysis(StoredAnalysis(session_id, file_id, doc_hash, findings_hash, hashes, summary))
+        _documents.inc(result="incremental" if len(changed) < len(clauses) else "full")
+        logger.info(
+            f"Reviewed file_id={file_id}: {len(clauses)} clauses, {len(changed)} analysed, "
+            f"{llm_calls} LLM calls (previous version: {previous.file_id if previous else None})"
+        )
+        return AnalysisResult(key, summary, len(clauses) - len(changed), len(changed), llm_calls)
+
+    def _batches(self, clauses: List[Clause]) -> List[List[Clause]]:
+        """Pack clauses greedily into prompts that fit the clause_review budget."""
+        budget = prompt_budget(CLAUSE_MAX_TOKENS, PROMPT_TOKEN_CAPS.get("clause_review", 0))
+        available = budget - self.counter.count(render("clause_review", clauses=""))
+        batches: List[List[Clause]] = []
+        current: List[Clause] = []
+        used = 0
+        for clause in clauses:
+            cost = self.counter.count(clause.text) + 4
+            if cost > available:
+                clause = clause._replace(text=trim_to_tokens(clause.text, available - 4, self.counter))
+                cost = available
+            if current and (used + cost > available or len(current) >= CLAUSES_PER_BATCH):
+                batches.append(current)
+                current, used = [], 0
+            current.append(clause)
+            used += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    def _review_batch(self, batch: List[Clause], file_id: str, correlation_id: Optional[str]) -> Dict[str, str]:
+        numbered = "\n\n".join(f"[{i}] {c.text}" for i, c in enumerate(batch, 1))
+        built = build_prompt("clause_review", [Section("clauses", numbered, required=True)], CLAUSE_MAX_TOKENS)
+        resp = self.call_llm({
+            "prompt": built.text,
+            "max_tokens": CLAUSE_MAX_TOKENS,
+            "priority": "batch",
+            "deadline": REVIEW_DEADLINE_SECONDS,
+            "metadata": {
+                "file_id": file_id,
+                "correlation_id": correlation_id,
+                "template": "clause_review",
+                "prompt_tokens": built.report.total_tokens,
+            },
+        })
+        parsed = {int(n): finding for n, finding in _FINDING_RE.findall(resp.text or "")}
+        findings = {c.hash: parsed[i] for i, c in enumerate(batch, 1) if i in parsed}
+        if len(findings) < len(batch):
+            # неразобранные пункты не сохраняем — analyze() переспросит их отдельно
+            logger.warning(f"clause_review returned {len(findings)}/{len(batch)} findings for file_id={file_id}")
+        self.store.save_clause_findings(findings)
+        return findings
+
+    def _summarize(self, text: str, clauses: List[Clause], flagged: List[str], file_id: str,
+                   correlation_id: Optional[str]) -> str:
+        built = build_prompt(
+            "analysis_summary",
+            [
+                Section("findings", "\n".join(flagged) or "Рисков по пунктам не выявлено.", weight=3.0),
+                Section("snippet", text, weight=1.0),
+            ],
+            SUMMARY_MAX_TOKENS,
+            clause_count=len(clauses),
+        )
+        resp = self.call_llm({
+            "prompt": built.text,
+            "max_tokens": SUMMARY_MAX_TOKENS,
+            "priority": "batch",
+            "deadline": REVIEW_DEADLINE_SECONDS,
+            "metadata": {
+                "file_id": file_id,
+                "correlation_id": correlation_id,
+                "template": "analysis_summary",
+                "prompt_tokens": built.report.total_tokens,
+            },
+        })
+        return resp.text
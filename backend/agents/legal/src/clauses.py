@@ -0,0 +1,80 @@
+"""Splitting contracts into clauses and hashing them for incremental re-analysis.
+
+A clause starts at a numbered heading ("5.", "5.2.", "Статья 7", "Раздел III") at the
+beginning of a line; documents without numbering fall back to paragraphs. The hash is
+taken over the normalised clause body (numbering, case and whitespace removed), so a
+revision that only renumbers or re-wraps a clause keeps its hash and its finding.
+"""
+import hashlib
+import re
+from typing import List, NamedTuple
+
+# бамп версии инвалидирует все сохранённые выводы по пунктам (например, при смене промпта)
+ANALYSIS_VERSION = "1"
+
+MAX_CLAUSE_CHARS = 4000
+MIN_CLAUSE_CHARS = 40
+
+_HEADING_RE = re.compile(
+    r"^[ \t]*(?:(?:статья|раздел|глава|пункт|article|section)\s+[\dIVXLC]+\.?|\d+(?:\.\d+)*\.(?=\s)|\d+(?:\.\d+)+(?=\s))",
+    re.IGNORECASE | re.MULTILINE,
+)
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_WS_RE = re.compile(r"\s+")
+
+
+class Clause(NamedTuple):
+    label: str
+    text: str
+    hash: str
+
+
+def normalize_text(text: str) -> str:
+    return _WS_RE.sub(" ", text or "").strip().lower()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(f"{ANALYSIS_VERSION}:{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+def _clause_hash(body: str) -> str:
+    body = _HEADING_RE.sub("", body, count=1)
+    return content_hash(body)
+
+
+def _segments(text: str) -> List[str]:
+    starts = [m.start() for m in _HEADING_RE.finditer(text)]
+    if len(starts) < 2:
+        return [p for p in _PARAGRAPH_RE.split(text) if p.strip()]
+    segments = []
+    if text[:starts[0]].strip():
+        # преамбула: стороны, дата, место заключения
+        segments.append(text[:starts[0]])
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        segments.append(text[start:end])
+    return segments
+
+
+def split_clauses(text: str) -> List[Clause]:
+    """Clauses in document order; tiny fragments are merged into the previous clause, huge ones split."""
+    merged: List[str] = []
+    for segment in _segments(text or ""):
+        segment = segment.strip()
+        if merged and len(segment) < MIN_CLAUSE_CHARS:
+            merged[-1] = f"{merged[-1]}\n{segment}"
+            continue
+        while len(segment) > MAX_CLAUSE_CHARS:
+            cut = segment.rfind("\n", 0, MAX_CLAUSE_CHARS)
+            if cut <= 0:
+                cut = MAX_CLAUSE_CHARS
+            merged.append(segment[:cut].strip())
+            segment = segment[cut:].strip()
+        if segment:
+            merged.append(segment)
+
+    clauses = []
+    for body in merged:
+        heading = _HEADING_RE.match(body)
+        label = heading.group(0).strip() if heading else body.split(None, 1)[0][:20]
+        clauses.append(Clause(label, body, _clause_hash(body)))
+    return clauses
@@ -1,14 +1,20 @@
 import os
+import asyncio
 import logging
 import time
 from typing import NamedTuple, Optional, Dict, Any
 from gigachat import GigaChat
 from requests.exceptions import RequestException
 
+from agents_shared.hedging import CancelToken, DeadlineExceeded, DEADLINE_SECONDS, get_hedger
+from agents_shared.prompt_budget import record_llm_usage
+from agents_shared.rate_limiter import PERMIT_MAX_WAIT, PermitUnavailable, get_async_rate_limiter, get_rate_limiter
+
 logger = logging.getLogger(__name__)
 
 GIGA_CREDENTIALS = os.getenv("GIGA_CHAT_CREDENTIALS")
 VERIFY_SSL = os.getenv("GIGA_CHAT_VERIFY_SSL", "false").lower() == "true"
+GIGA_MODEL = os.getenv("GIGA_CHAT_MODEL", "GigaChat")
 MAX_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
 RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "1.5"))
 
@@ -19,27 +25,81 @@ class LLMResponse(NamedTuple):
     metadata: dict
 
 
+def _chat_once(payload: dict, cancel: CancelToken, hedge: bool) -> LLMResponse:
+    # хедж не ждёт разрешение лимитера: нет свободного слота — значит, не дублируем запрос
+    max_wait = 0 if hedge else PERMIT_MAX_WAIT
+    with get_rate_limiter().permit(GIGA_MODEL, payload.get("priority", "interactive"), max_wait=max_wait):
+        try:
+            timeout = payload.get("deadline", DEADLINE_SECONDS)
+            with GigaChat(credentials=GIGA_CREDENTIALS, verify_ssl_certs=VERIFY_SSL, model=GIGA_MODEL, timeout=timeout) as giga:
+                cancel.bind(giga)
+                started = time.monotonic()
+                response = giga.chat(payload["prompt"])
+                content = response.choices[0].message.content
+                return LLMResponse(
+                    text=content,
+                    id=getattr(response, "id", None),
+                    metadata=record_llm_usage(payload.get("metadata", {}), response, time.monotonic() - started)
+                )
+        except Exception as e:
+            if cancel.cancelled:
+                raise RequestException("GigaChat call cancelled: another request answered first") from e
+            logger.exception("GigaChat API call failed")
+            raise RequestException(f"GigaChat API call failed: {e}") from e
+
+
+async def _achat_once(payload: dict, hedge: bool) -> LLMResponse:
+    max_wait = 0 if hedge else PERMIT_MAX_WAIT
+    async with get_async_rate_limiter().permit(GIGA_MODEL, payload.get("priority", "interactive"), max_wait=max_wait):
+        try:
+            timeout = payload.get("deadline", DEADLINE_SECONDS)
+            async with GigaChat(credentials=GIGA_CREDENTIALS, verify_ssl_certs=VERIFY_SSL, model=GIGA_MODEL, timeout=timeout) as giga:
+                started = time.monotonic()
+                response = await giga.achat(payload["prompt"])
+                content = response.choices[0].message.content
+                return LLMResponse(
+                    text=content,
+                    id=getattr(response, "id", None),
+                    metadata=record_llm_usage(payload.get("metadata", {}), response, time.monotonic() - started)
+                )
+        except asyncio.CancelledError:
+            # проигравший хедж или остановка агента — HTTP-запрос закрывается вместе с клиентом
+            raise
+        except Exception as e:
+            logger.exception("GigaChat API call failed")
+            raise RequestException(f"GigaChat API call failed: {e}") from e
+
+
 def call_llm(payload: dict) -> LLMResponse:
     """
     Адаптация call_llm для GigaChat API с возвратом NamedTuple.
-    payload должен содержать ключ 'prompt'.
+    payload должен содержать ключ 'prompt'; опционально 'deadline' (секунды) и 'priority'.
+    Медленный запрос может быть продублирован (хеджирование) — побеждает первый ответ.
     """
     prompt = payload.get("prompt")
     if not prompt:
         raise ValueError("Payload must contain 'prompt' key")
 
+    template = payload.get("metadata", {}).get("template", "unknown")
+    try:
+        # PermitUnavailable общего лимитера пробрасывается вызывающему
+        return get_hedger().call(_chat_once, payload, template=template, deadline=payload.get("deadline", DEADLINE_SECONDS))
+    except DeadlineExceeded as e:
+        logger.warning("GigaChat call exceeded deadline: %s", e)
+        raise RequestException(str(e)) from e
+
+
+async def acall_llm(payload: dict) -> LLMResponse:
+    """Асинхронный вариант call_llm для asyncio-режима агента (GigaChat achat, тот же лимитер и дедлайны)."""
+    if not payload.get("prompt"):
+        raise ValueError("Payload must contain 'prompt' key")
+
+    template = payload.get("metadata", {}).get("template", "unknown")
     try:
-        with GigaChat(credentials=GIGA_CREDENTIALS, verify_ssl_certs=VERIFY_SSL) as giga:
-            response = giga.chat(prompt)
-            content = response.choices[0].message.content
-            return LLMResponse(
-                text=content,
-                id=getattr(response, "id", None),
-                metadata=payload.get("metadata", {})
-            )
-    except Exception as e:
-        logger.exception("GigaChat API call failed")
-        raise RequestException(f"GigaChat API call failed: {e}") from e
+        return await get_hedger().acall(_achat_once, payload, template=template, deadline=payload.get("deadline", DEADLINE_SECONDS))
+    except DeadlineExceeded as e:
+        logger.warning("GigaChat call exceeded deadline: %s", e)
+        raise RequestException(str(e)) from e
 
 
 def call_llm_with_retries(payload: Dict[str, Any], max_retries: Optional[int] = None) -> LLMResponse:
@@ -51,6 +111,9 @@ def call_llm_with_retries(payload: Dict[str, Any], max_retries: Optional[int] =
             attempt += 1
             logger.debug("Calling LLM attempt %d payload keys=%s", attempt, list(payload.keys()))
             return call_llm(payload)
+        except PermitUnavailable:
+            # no permit / 429: the caller defers the whole message instead of sleeping here
+            raise
         except RequestException as e:
             logger.warning("LLM request exception on attempt %d: %s", attempt, e)
         except Exception as e:
@@ -62,3 +125,26 @@ def call_llm_with_retries(payload: Dict[str, Any], max_retries: Optional[int] =
         backoff = RETRY_BACKOFF_BASE ** attempt
         logger.info("Backing off for %.1f seconds before retrying LLM (attempt %d)", backoff, attempt + 1)
         time.sleep(backoff)
+
+
+async def acall_llm_with_retries(payload: Dict[str, Any], max_retries: Optional[int] = None) -> LLMResponse:
+    if max_retries is None:
+        max_retries = MAX_RETRIES
+    attempt = 0
+    while True:
+        try:
+            attempt += 1
+            return await acall_llm(payload)
+        except PermitUnavailable:
+            raise
+        except RequestException as e:
+            logger.warning("LLM request exception on attempt %d: %s", attempt, e)
+        except Exception as e:
+            logger.exception("LLM call error on attempt %d: %s", attempt, e)
+
+        if attempt >= max_retries:
+            logger.error("LLM failed after %d attempts", attempt)
+            raise RuntimeError("LLM failed after retries")
+        backoff = RETRY_BACKOFF_BASE ** attempt
+        logger.info("Backing off for %.1f seconds before retrying LLM (attempt %d)", backoff, attempt + 1)
+        await asyncio.sleep(backoff)
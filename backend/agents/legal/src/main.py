@@ -1,19 +1,30 @@
 import os
 import time
 import signal
+import asyncio
 import logging
 from typing import Dict, Any, Optional
 
 import redis
+import redis.asyncio as aioredis
 
+from agents_shared.analysis_store import AnalysisStore
+from agents_shared.async_runtime import AsyncAgentRuntime
+from agents_shared.deferral import DeferredQueue
 from agents_shared.kafka_client import KafkaClient
+from agents_shared.metrics import start_metrics_server
+from agents_shared.embeddings import get_embedder
+from agents_shared.vector_index import DocumentIndex
 from .service import LegalService
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 KAFKA_GROUP_ID = os.getenv("KAFKA_GROUP_ID", "legal-group")
-CONSUME_TOPICS = os.getenv("CONSUME_TOPICS", "docs.parsed,legal.followup.requested").split(",")
+CONSUME_TOPICS = os.getenv("CONSUME_TOPICS", "docs.parsed,legal.followup.requested,legal.session.requested").split(",")
 PRODUCE_TOPIC = os.getenv("PRODUCE_TOPIC", "analysis.completed")
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "true").lower() in ("1", "true", "yes")
+# sync — по одному сообщению за раз; async — asyncio-рантайм с AGENT_MAX_IN_FLIGHT сообщениями в работе
+AGENT_RUNTIME = os.getenv("AGENT_RUNTIME", "sync").lower()
 
 logging.basicConfig(
     level=LOG_LEVEL,
@@ -22,6 +33,7 @@ logging.basicConfig(
 logger = logging.getLogger("legal")
 
 r = redis.from_url(REDIS_URL, decode_responses=True)
+ar = aioredis.from_url(REDIS_URL, decode_responses=True) if AGENT_RUNTIME == "async" else None
 
 kafka_client = KafkaClient(
     group_id=KAFKA_GROUP_ID,
@@ -29,7 +41,13 @@ kafka_client = KafkaClient(
     client_id="legal"
 )
 
-service = LegalService(redis_client=r, kafka_client=kafka_client)
+index = DocumentIndex(get_embedder()) if RETRIEVAL_ENABLED else None
+
+deferrer = DeferredQueue("legal", kafka_client, redis_client=r)
+
+store = AnalysisStore(redis_client=r)
+
+service = LegalService(redis_client=r, kafka_client=kafka_client, index=index, deferrer=deferrer, store=store, async_redis=ar)
 
 _should_stop = False
 
@@ -45,12 +63,17 @@ signal.signal(signal.SIGTERM, _signal_handler)
 
 
 def main_loop():
-    logger.info("Legal agent started. Subscribed to topics: %s", CONSUME_TOPICS)
+    logger.info("Legal agent started (%s runtime). Subscribed to topics: %s", AGENT_RUNTIME, CONSUME_TOPICS)
 
     kafka_client.on_message = service.handle_message
+    start_metrics_server()
+    deferrer.start()
 
     try:
-        kafka_client.listen_forever(poll_timeout=1.0)
+        if AGENT_RUNTIME == "async":
+            asyncio.run(AsyncAgentRuntime("legal", kafka_client, service.ahandle_message).run())
+        else:
+            kafka_client.listen_forever(poll_timeout=1.0, should_stop=lambda: _should_stop)
     except KeyboardInterrupt:
         logger.info("Legal interrupted by user")
     except Exception as e:
@@ -1,5 +1,9 @@
+import os
+
 from jinja2 import Template
 
+from agents_shared.prompt_budget import BuiltPrompt, PromptBuilder, Section, prompt_budget
+
 
 PROMPTS = {
     'legal_review': Template(
@@ -64,9 +68,90 @@ PROMPTS = {
 ---
 
 ТЕКСТЫ АНАЛИЗА ДОКУМЕНТОВ:
- {{ snippet }}''')
+ {{ snippet }}'''),
+    'clause_review': Template(
+        """Ты — опытный юрист-аналитик. Проверь каждый пункт договора ниже на соответствие действующему Гражданскому кодексу РФ и на риски для стороны.
+
+ФОРМАТ ОТВЕТА:
+Для КАЖДОГО пункта выведи ровно одну строку: [номер] ФЛАГ: краткий вывод (не длиннее 200 символов)
+ФЛАГ — одно из: ЗЕЛЕНЫЙ (соответствует законодательству), ОРАНЖЕВЫЙ (отклонения без критических рисков), КРАСНЫЙ (критический риск).
+
+ЖЕСТКИЕ ПРАВИЛА:
+1. Номера строк ответа совпадают с номерами пунктов в квадратных скобках
+2. НЕ пропускай пункты и НЕ добавляй ничего, кроме строк ответа
+3. НЕ используй markdown форматирование
+
+ПУНКТЫ ДОГОВОРА:
+{{ clauses }}"""
+    ),
+    'analysis_summary': Template(
+        """Ты — опытный юрист-аналитик, специализирующийся на быстром анализе документов и выявлении ключевых рисков.
+
+ТВОЯ РОЛЬ:
+По выводам, уже сделанным по каждому пункту документа, дать первичную классификацию: определить тип документа и обобщить риски.
+
+ВЫДАЧА ПЕРВИЧНОЙ КЛАССИФИКАЦИИ в формате: 'Я проанализировал документ. Это [ТИП]. Вижу [N] [ЦВЕТ] флаг(ов)...'
+
+КЛАССИФИКАЦИЯ РИСКОВ:
+🟢 ЗЕЛЕНЫЙ ФЛАГ: Документ соответствует законодательству
+🟠 ОРАНЖЕВЫЙ ФЛАГ: Отклонения без критических рисков
+🔴 КРАСНЫЙ ФЛАГ: Критические риски для стороны
+
+ЖЕСТКИЕ ПРАВИЛА:
+1. НЕ перегружай первый анализ подробностями (максимум 600 символов)
+2. ВСЕГДА выводи результат коротко и ясно
+3. НЕ используй markdown форматирование
+4. ПОМНИ: это анализ для рекомендации, не для действия
+5. ВСЕГДА предлагай загрузить дополнительные документы если нужны
+
+Всего пунктов в документе: {{ clause_count }}. Пункты с оранжевыми и красными флагами:
+{{ findings }}
+
+Начало документа (для определения типа):
+{{ snippet }}"""
+    ),
+    'session_report': Template(
+        """Ты — опытный юрист-аналитик. Пользователь загрузил комплект документов (например, основной договор и приложения к нему). Ниже — выводы первичного анализа по каждому документу.
+
+ТВОЯ ЗАДАЧА:
+1. Определить, как документы связаны между собой (основной договор, приложения, дополнительные соглашения, переписка)
+2. Найти противоречия между документами (сроки, суммы, стороны, ответственность)
+3. Дать сводную оценку рисков по комплекту в целом с флагами 🟢 / 🟠 / 🔴
+
+ЖЕСТКИЕ ПРАВИЛА:
+1. Максимум 1200 символов
+2. НЕ используй markdown форматирование
+3. ПОМНИ: это анализ для рекомендации, не для действия
+{% if missing %}4. Анализ документов {{ missing }} ещё не готов — прямо скажи, что отчёт неполный
+{% endif %}
+ВЫВОДЫ ПО ДОКУМЕНТАМ:
+{{ documents }}"""
+    ),
+    'followup': Template(
+        """Followup: {{ query }}
+Document: {{ document }}
+Previous analysis: {{ previous_analysis }}"""
+    ),
+}
+
+# верхняя граница промпта по шаблону (в токенах), помимо окна контекста модели
+PROMPT_TOKEN_CAPS = {
+    'legal_review': int(os.getenv("LEGAL_REVIEW_PROMPT_TOKENS", "4000")),
+    'followup': int(os.getenv("FOLLOWUP_PROMPT_TOKENS", "6000")),
+    'clause_review': int(os.getenv("CLAUSE_REVIEW_PROMPT_TOKENS", "4000")),
+    'analysis_summary': int(os.getenv("ANALYSIS_SUMMARY_PROMPT_TOKENS", "3000")),
+    'session_report': int(os.getenv("SESSION_REPORT_PROMPT_TOKENS", "6000")),
 }
 
 
 def render(prompt_name: str, **kwargs) -> str:
     return PROMPTS[prompt_name].render(**kwargs)
+
+
+_builder = PromptBuilder(render=render)
+
+
+def build(prompt_name: str, sections: list[Section], max_output_tokens: int, **kwargs) -> BuiltPrompt:
+    """Рендерит шаблон, укладывая секции в бюджет токенов с обрезкой по границам предложений."""
+    budget = prompt_budget(max_output_tokens, PROMPT_TOKEN_CAPS.get(prompt_name, 0))
+    return _builder.build(prompt_name, sections, budget, **kwargs)
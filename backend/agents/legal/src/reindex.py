@@ -0,0 +1,62 @@
+"""Bulk (re)indexing of parsed documents into the pgvector chunk index.
+
+Scans parsed texts in Redis (``doc:text:{session_id}:{file_id}``) and ingests them
+in batches with a single COPY per batch:
+
+    python -m agents.legal.src.reindex [--session SESSION_ID] [--batch 50]
+"""
+import argparse
+import logging
+import os
+
+import redis
+
+from agents_shared.embeddings import get_embedder
+from agents_shared.redis_storage import safe_get_redis_text
+from agents_shared.vector_index import DocumentIndex
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+TEXT_PREFIX = "doc:text"
+
+logger = logging.getLogger("legal.reindex")
+
+
+def _iter_documents(r, session_id=None):
+    pattern = f"{TEXT_PREFIX}:{session_id}:*" if session_id else f"{TEXT_PREFIX}:*"
+    for key in r.scan_iter(match=pattern, count=500):
+        parts = key.split(":", 3)
+        if len(parts) != 4:
+            continue
+        text = safe_get_redis_text(r, key)
+        if text:
+            yield parts[2], parts[3], text
+
+
+def reindex(r, index: DocumentIndex, session_id=None, batch_size: int = 50) -> int:
+    total = 0
+    batch = []
+    for doc in _iter_documents(r, session_id):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            total += index.ingest_many(batch)
+            batch = []
+    if batch:
+        total += index.ingest_many(batch)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--session", help="reindex a single session only")
+    parser.add_argument("--batch", type=int, default=50, help="documents per COPY batch")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    r = redis.from_url(REDIS_URL, decode_responses=True)
+    index = DocumentIndex(get_embedder())
+    total = reindex(r, index, session_id=args.session, batch_size=args.batch)
+    logger.info("Reindex finished: %d chunks written", total)
+
+
+if __name__ == "__main__":
+    main()
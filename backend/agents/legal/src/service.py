@@ -1,28 +1,173 @@
 import os
+import time
+import uuid
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, Optional
 import hashlib
 import redis
+from agents_shared.async_runtime import stage_timer
 from agents_shared.kafka_client import KafkaClient
 from agents_shared.storage import safe_get_redis_text
 from agents_shared.envelope import create_envelope, validate_envelope, unwrap_payload_or_legacy
-from .prompts import render
-from .llm_client import call_llm_with_retries
+from agents_shared.vector_index import DocumentIndex, format_context
+from agents_shared.analysis_store import AnalysisStore, session_report_key
+from agents_shared.redis_storage import get_active_documents_for_session, get_analysis_from_redis
+from agents_shared.prompt_budget import Section
+from agents_shared.rate_limiter import PermitUnavailable
+from .prompts import build as build_prompt
+from .llm_client import acall_llm_with_retries, call_llm_with_retries
+from .analyzer import IncrementalAnalyzer, REVIEW_DEADLINE_SECONDS
+from .aggregator import AGGREGATION_DEADLINE, SessionAggregator
 
 logger = logging.getLogger("legal.service")
 
 EXPIRE_TIME = int(os.getenv("EXPIRE_TIME", 7 * 24 * 3600))
-SNIPPET_LENGTH = int(os.getenv("SNIPPET_LENGTH", "1000"))
+FOLLOWUP_MAX_TOKENS = int(os.getenv("FOLLOWUP_MAX_TOKENS", "1200"))
+SESSION_TOPIC = "legal.session.requested"
+# документы, загруженные пачкой, собираются в один запуск агрегации:
+# он начинается через DEBOUNCE секунд после последнего разобранного документа
+SESSION_AGGREGATION_DEBOUNCE = int(os.getenv("SESSION_AGGREGATION_DEBOUNCE", "10"))
+# агрегация ждёт документы до AGGREGATION_DEADLINE — выполняется вне потока консьюмера
+SESSION_AGGREGATION_RUNNERS = int(os.getenv("SESSION_AGGREGATION_RUNNERS", "2"))
+ANALYSIS_LOCK_TTL = int(REVIEW_DEADLINE_SECONDS * 5)
 
+# KEYS[1]=lock; ARGV[1]=token — release only a lock we still own
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# пункты меню ассистента (query_type="menu"): id -> вопрос, который задаётся по документам сессии
 MENU_PROMPTS = {
-    # example: 'risk_summary': 'legal_review'
+    'risk_summary': 'Кратко перечисли основные юридические риски для нашей стороны в загруженных документах.',
+    'obligations': 'Перечисли ключевые обязательства каждой из сторон по загруженным документам.',
+    'deadlines': 'Перечисли все сроки, даты и периоды, установленные в загруженных документах, с указанием пунктов.',
+    'penalties': 'Перечисли штрафы, неустойки и иные меры ответственности сторон, предусмотренные документами.',
+    'termination': 'Опиши основания и порядок расторжения договора, предусмотренные документами.',
 }
 
 
+class DocumentBusy(PermitUnavailable):
+    """The document is being analysed by another worker; the message is deferred like a missing LLM permit."""
+
+    def __init__(self, file_id: str, retry_after: float):
+        super().__init__("document", "document_busy", retry_after)
+        self.file_id = file_id
+
+    def __str__(self) -> str:
+        return f"Document {self.file_id} is being analysed by another worker (retry after {self.retry_after:.1f}s)"
+
+
 class LegalService:
-    def __init__(self, redis_client: redis.Redis, kafka_client: KafkaClient):
+    def __init__(self, redis_client: redis.Redis, kafka_client: KafkaClient, index: Optional[DocumentIndex] = None, deferrer=None,
+                 store: Optional[AnalysisStore] = None, async_redis=None):
         self.r = redis_client
+        # redis.asyncio-клиент для asyncio-режима (AGENT_RUNTIME=async)
+        self.ar = async_redis
         self.kafka = kafka_client
+        self.index = index
+        self.deferrer = deferrer
+        self.store = store or AnalysisStore(redis_client)
+        self.analyzer = IncrementalAnalyzer(self.store, call_llm_with_retries)
+        self.aggregator = SessionAggregator(redis_client, self.store, self._analyze_if_free, call_llm_with_retries)
+        self._release = redis_client.register_script(_RELEASE_LUA)
+        self._sessions = ThreadPoolExecutor(max_workers=SESSION_AGGREGATION_RUNNERS, thread_name_prefix="session-report")
+
+    def _defer(self, topic: str, raw: Dict[str, Any], key: Optional[str], delay: float,
+               envelope: Dict[str, Any], correlation_id: str, reason: str) -> None:
+        """Park the message for a retry; when the deferrer gives up, tell the user as the assistant does."""
+        if not self.deferrer.defer(topic, raw, key, delay):
+            self.kafka.produce(
+                "chat.error",
+                {"user_id": envelope.get("user_id"), "reason": reason, "correlation_id": correlation_id, "retryable": True},
+                key=correlation_id,
+            )
+
+    def _acquire(self, key: str, ttl: int) -> Optional[str]:
+        token = uuid.uuid4().hex
+        return token if self.r.set(key, token, nx=True, ex=ttl) else None
+
+    def _analyze_if_free(self, session_id: str, file_id: str, text: str, correlation_id: Optional[str]) -> Optional[str]:
+        """Analyse the document unless another worker already holds its analysis lock."""
+        lock = f"legal:analyzing:{session_id}:{file_id}"
+        token = self._acquire(lock, ANALYSIS_LOCK_TTL)
+        if token is None:
+            return None
+        try:
+            return self.analyzer.analyze(session_id, file_id, text, correlation_id).analysis_text
+        finally:
+            self._release(keys=[lock], args=[token])
+
+    def _analyze_document(self, session_id: Optional[str], file_id: str, text: str, correlation_id: Optional[str]) -> str:
+        """Analyse the document; if a session aggregation is already doing it, defer instead of blocking the consumer."""
+        analysis_key = f"analysis:{session_id}:{file_id}"
+        if self._analyze_if_free(session_id, file_id, text, correlation_id) is not None:
+            return analysis_key
+        if get_analysis_from_redis(self.r, session_id, file_id):
+            return analysis_key
+        raise DocumentBusy(file_id, retry_after=5.0)
+
+    @staticmethod
+    def _session_keys(session_id: str):
+        base = f"session:{session_id}:analysis"
+        return f"{base}:scheduled", f"{base}:due"
+
+    def _schedule_session_analysis(self, session_id: Optional[str], user_id: Optional[str], correlation_id: str) -> None:
+        """
+        Trailing-edge debounce: every parsed document moves the start of the session analysis
+        to DEBOUNCE seconds from now; only the first one publishes the request, which waits
+        in the deferral queue until the start time stops moving.
+        """
+        if not session_id:
+            return
+        scheduled_key, due_key = self._session_keys(session_id)
+        ttl = int(SESSION_AGGREGATION_DEBOUNCE + AGGREGATION_DEADLINE * 2)
+        try:
+            if len(get_active_documents_for_session(self.r, session_id)) < 2:
+                return
+            pipe = self.r.pipeline(transaction=False)
+            pipe.set(due_key, time.time() + SESSION_AGGREGATION_DEBOUNCE, ex=ttl)
+            pipe.set(scheduled_key, correlation_id, nx=True, ex=ttl)
+            if not pipe.execute()[1]:
+                # запрос уже ждёт — он увидит сдвинутое время старта
+                return
+        except Exception:
+            logger.exception(f"Failed to schedule session analysis for session_id={session_id}")
+            return
+        env = create_envelope(
+            user_id=user_id,
+            session_id=session_id,
+            source="legal",
+            event=SESSION_TOPIC,
+            payload={"session_id": session_id},
+            correlation_id=correlation_id
+        )
+        self.kafka.produce(SESSION_TOPIC, env, key=session_id)
+
+    def _index_document(self, session_id: Optional[str], file_id: str, text: str) -> None:
+        if self.index is None or not session_id:
+            return
+        try:
+            self.index.ingest(session_id, file_id, text)
+        except Exception:
+            # retrieval is an optimisation — followups fall back to the raw text
+            logger.exception(f"Failed to index document file_id={file_id} session_id={session_id}")
+
+    def _retrieve_context(self, session_id: Optional[str], document_id: Optional[str], query: Optional[str]) -> Optional[str]:
+        if self.index is None or not session_id or not query:
+            return None
+        try:
+            chunks = self.index.search(session_id, query, file_id=document_id)
+        except Exception:
+            logger.exception(f"Retrieval failed for session_id={session_id}")
+            return None
+        if not chunks:
+            return None
+        return format_context(chunks)
 
     def handle_docs_parsed(self, envelope: Dict[str, Any]):
         payload = envelope["payload"]
@@ -39,15 +184,12 @@ class LegalService:
         if not text:
             logger.error(f"No text found for redis_key={redis_key}; skipping file_id={file_id}")
             return
-        snippet = text[:SNIPPET_LENGTH]
-        prompt_text = render("legal_review", snippet=snippet)
-        llm_payload = {
-            "prompt": prompt_text,
-            "max_tokens": int(os.getenv("LLM_MAX_TOKENS", "1500")),
-            "metadata": {"file_id": file_id, "correlation_id": correlation_id}
-        }
+        self._index_document(session_id, file_id, text)
         try:
-            llm_resp = call_llm_with_retries(llm_payload)
+            # повторно анализируются только изменённые пункты; выводы по остальным берутся из хранилища
+            analysis_key = self._analyze_document(session_id, file_id, text, correlation_id)
+        except PermitUnavailable:
+            raise
         except Exception as e:
             logger.exception(f"LLM processing failed for file {file_id}, correlation_id={correlation_id}")
             error_env = create_envelope(
@@ -64,9 +206,6 @@ class LegalService:
             )
             self.kafka.produce("analysis.failed", error_env, key=correlation_id)
             return
-        analysis_text = llm_resp.text
-        # Save analysis to redis omitted for brevity
-        analysis_key = f"analysis:{session_id}:{file_id}"  # Example key
         response_env = create_envelope(
             user_id=user_id,
             session_id=session_id,
@@ -74,38 +213,119 @@ class LegalService:
             event="analysis.completed",
             payload={
                 "file_id": file_id,
-                "analysis_key": analysis_key
+                "analysis_key": analysis_key,
             },
             correlation_id=correlation_id
         )
         self.kafka.produce("analysis.completed", response_env, key=correlation_id)
         logger.info(f"Published analysis.completed for file {file_id} (analysis_key={analysis_key})")
+        self._schedule_session_analysis(session_id, user_id, correlation_id)
 
-    def handle_followup_request(self, envelope: Dict[str, Any]):
+    def handle_session_analysis(self, envelope: Dict[str, Any], topic: str, raw: Dict[str, Any], key: Optional[str]):
+        session_id = envelope.get("session_id") or envelope["payload"].get("session_id")
+        correlation_id = envelope["correlation_id"]
+        if not session_id:
+            logger.error(f"Session analysis request without session_id. Ignoring. envelope={envelope}")
+            return
+        scheduled_key, due_key = self._session_keys(session_id)
+        if self.deferrer is not None:
+            due = self.r.get(due_key)
+            wait = float(due) - time.time() if due else 0.0
+            if wait > 0:
+                # документы ещё догружаются — откладываем запуск до тишины
+                self._defer(topic, raw, key, wait, envelope, correlation_id,
+                            f"Session analysis for {session_id} could not be scheduled")
+                return
+        # следующий документ запланирует новый запуск; этот уже учтёт всё, что разобрано к этому моменту
+        self.r.delete(scheduled_key)
+        # ожидание документов занимает до AGGREGATION_DEADLINE — не держим на нём поток консьюмера
+        self._sessions.submit(self._run_session_analysis, envelope, session_id, correlation_id, topic, raw, key)
+
+    def _run_session_analysis(self, envelope: Dict[str, Any], session_id: str, correlation_id: str,
+                              topic: str, raw: Dict[str, Any], key: Optional[str]) -> None:
+        try:
+            self._aggregate_session(envelope, session_id, correlation_id, topic, raw, key)
+        except Exception:
+            logger.exception(f"Session analysis failed for session_id={session_id}")
+
+    def _aggregate_session(self, envelope: Dict[str, Any], session_id: str, correlation_id: str,
+                           topic: str, raw: Dict[str, Any], key: Optional[str]) -> None:
+        lock = f"session:{session_id}:analysis:lock"
+        token = self._acquire(lock, int(AGGREGATION_DEADLINE * 2))
+        if token is None:
+            # агрегация по сессии уже идёт — повторим после неё, чтобы учесть новые документы
+            if self.deferrer is not None:
+                self._defer(topic, raw, key, AGGREGATION_DEADLINE / 4, envelope, correlation_id,
+                            f"Session analysis for {session_id} is still running")
+            return
+        try:
+            result = self.aggregator.run(session_id, correlation_id)
+        finally:
+            self._release(keys=[lock], args=[token])
+        if result is None or result.report_key is None:
+            logger.warning(f"No session report built for session_id={session_id}")
+            return
+        env = create_envelope(
+            user_id=envelope.get("user_id"),
+            session_id=session_id,
+            source="legal",
+            event="analysis.session.completed",
+            payload={
+                "analysis_key": result.report_key,
+                "file_ids": result.file_ids,
+                "missing": result.missing,
+                "partial": result.partial,
+            },
+            correlation_id=correlation_id
+        )
+        self.kafka.produce("analysis.completed", env, key=correlation_id)
+        logger.info(f"Published session report for session_id={session_id} (partial={result.partial})")
+
+    @staticmethod
+    def _previous_analysis_keys(payload: Dict[str, Any], session_id: Optional[str], document_id: Optional[str]):
+        """Ключи предыдущего анализа по приоритету: явно переданный, сводный отчёт по сессии, анализ документа."""
+        yield payload.get("redis_key_previous_analysis", "")
+        if session_id:
+            yield session_report_key(session_id)
+            if document_id:
+                yield f"analysis:{session_id}:{document_id}"
+
+    @staticmethod
+    def _followup_question(payload: Dict[str, Any]) -> Optional[str]:
+        # ассистент пересылает вопрос пользователя в поле text; для пункта меню — его id
+        query = payload.get("query") or payload.get("text")
+        if payload.get("query_type") == "menu":
+            return MENU_PROMPTS.get(query, query)
+        return query
+
+    def _followup_llm_payload(self, envelope: Dict[str, Any], doc_context: str, prev_analysis: Optional[str]) -> Dict[str, Any]:
+        payload = envelope["payload"]
+        query_type = payload.get("query_type", "default")
+        # 3. Формируем промпт; контекст укладывается в бюджет токенов
+        built = build_prompt(
+            "followup",
+            [
+                Section("query", self._followup_question(payload) or "", required=True),
+                Section("document", doc_context, weight=2.0),
+                Section("previous_analysis", prev_analysis or "", weight=1.0),
+            ],
+            FOLLOWUP_MAX_TOKENS,
+        )
+        metadata = {
+            "correlation_id": envelope["correlation_id"],
+            "template": "menu" if query_type == "menu" else "followup",
+            "prompt_tokens": built.report.total_tokens,
+        }
+        return {"prompt": built.text, "max_tokens": FOLLOWUP_MAX_TOKENS, "priority": "interactive", "metadata": metadata}
+
+    def _publish_followup(self, envelope: Dict[str, Any], result: str, flush: bool = True) -> None:
         payload = envelope["payload"]
         correlation_id = envelope["correlation_id"]
-        user_id = envelope.get("user_id")
-        session_id = envelope.get("session_id")
         document_id = payload.get("document_id")
-        redis_key_text = payload.get("redis_key_text")
-        query = payload.get("query")
-        query_type = payload.get("query_type", "default")
-        # 1. Получаем текст документа из Redis
-        doc_text = safe_get_redis_text(self.r, redis_key_text)
-        # 2. Получаем предыдущий анализ (если есть)
-        prev_analysis = safe_get_redis_text(self.r, payload.get("redis_key_previous_analysis", ""))
-        # 3. Формируем промпт в зависимости от типа запроса
-        if query_type == "menu":
-            prompt = MENU_PROMPTS.get(query, "")
-        else:
-            prompt = f"Followup: {query}\nDocument: {doc_text}\nPrevious analysis: {prev_analysis}"
-        # 4. Отправляем в LLM
-        llm_resp = call_llm_with_retries({"prompt": prompt, "max_tokens": 1200})
-        result = llm_resp.text
-        # 5. Публикуем результат
+        query = payload.get("query") or payload.get("text")
         followup_env = create_envelope(
-            user_id=user_id,
-            session_id=session_id,
+            user_id=envelope.get("user_id"),
+            session_id=envelope.get("session_id"),
             source="legal",
             event="legal.followup.completed",
             payload={
@@ -116,14 +336,85 @@ class LegalService:
             },
             correlation_id=correlation_id
         )
-        self.kafka.produce("legal.followup.completed", followup_env, key=correlation_id)
+        self.kafka.produce("legal.followup.completed", followup_env, key=correlation_id, flush=flush)
+
+    def handle_followup_request(self, envelope: Dict[str, Any]):
+        payload = envelope["payload"]
+        session_id = envelope.get("session_id")
+        document_id = payload.get("document_id")
+        query = self._followup_question(payload)
+        # 1. Берём только релевантные вопросу фрагменты документов сессии из pgvector;
+        #    полный текст из Redis — только если индекс недоступен
+        doc_context = self._retrieve_context(session_id, document_id, query)
+        if doc_context is None:
+            doc_context = safe_get_redis_text(self.r, payload.get("redis_key_text")) or ""
+        # 2. Получаем предыдущий анализ (если есть): явно переданный, сводный отчёт по сессии или анализ документа
+        prev_analysis = None
+        for key in self._previous_analysis_keys(payload, session_id, document_id):
+            prev_analysis = safe_get_redis_text(self.r, key)
+            if prev_analysis:
+                break
+        # 4. Отправляем в LLM
+        llm_resp = call_llm_with_retries(self._followup_llm_payload(envelope, doc_context, prev_analysis))
+        # 5. Публикуем результат
+        self._publish_followup(envelope, llm_resp.text)
+
+    async def ahandle_followup_request(self, envelope: Dict[str, Any]):
+        """asyncio-вариант handle_followup_request: Redis и LLM без блокировки event loop, поиск по pgvector — в потоке."""
+        payload = envelope["payload"]
+        session_id = envelope.get("session_id")
+        document_id = payload.get("document_id")
+        query = self._followup_question(payload)
+        with stage_timer("legal", "context"):
+            doc_context = await asyncio.to_thread(self._retrieve_context, session_id, document_id, query)
+            if doc_context is None:
+                key_text = payload.get("redis_key_text")
+                doc_context = (await self.ar.get(key_text) if key_text else None) or ""
+            prev_analysis = None
+            for key in self._previous_analysis_keys(payload, session_id, document_id):
+                prev_analysis = await self.ar.get(key) if key else None
+                if prev_analysis:
+                    break
+        with stage_timer("legal", "prompt"):
+            llm_payload = self._followup_llm_payload(envelope, doc_context, prev_analysis)
+        with stage_timer("legal", "llm"):
+            llm_resp = await acall_llm_with_retries(llm_payload)
+        with stage_timer("legal", "publish"):
+            self._publish_followup(envelope, llm_resp.text, flush=False)
 
     def handle_message(self, topic: str, raw: Dict[str, Any], key: Optional[str] = None):
         envelope, correlation_id = unwrap_payload_or_legacy(raw)
         event = envelope["event"]
-        if event == "docs.parsed":
-            self.handle_docs_parsed(envelope)
-        elif event == "legal.followup.requested":
-            self.handle_followup_request(envelope)
-        else:
-            logger.warning(f"Unknown event: {event}")
+        try:
+            if event == "docs.parsed":
+                self.handle_docs_parsed(envelope)
+            elif event == "legal.followup.requested":
+                self.handle_followup_request(envelope)
+            elif event == SESSION_TOPIC:
+                self.handle_session_analysis(envelope, topic, raw, key)
+            else:
+                logger.warning(f"Unknown event: {event}")
+        except PermitUnavailable as e:
+            if self.deferrer is None:
+                raise
+            logger.info(f"No LLM permit ({e.reason}), deferring {event} correlation_id={correlation_id}")
+            self._defer(topic, raw, key, e.retry_after, envelope, correlation_id, str(e))
+
+    async def ahandle_message(self, topic: str, raw: Dict[str, Any], key: Optional[str] = None):
+        """
+        Точка входа asyncio-рантайма. Вопросы пользователя обрабатываются на event loop;
+        анализ документов и сводные отчёты — пакетные сценарии с блокировками и пулом потоков,
+        они выполняются как раньше, в рабочем потоке.
+        """
+        envelope, correlation_id = unwrap_payload_or_legacy(raw)
+        event = envelope["event"]
+        if event != "legal.followup.requested":
+            await asyncio.to_thread(self.handle_message, topic, raw, key)
+            return
+        try:
+            await self.ahandle_followup_request(envelope)
+        except PermitUnavailable as e:
+            if self.deferrer is None:
+                raise
+            logger.info(f"No LLM permit ({e.reason}), deferring {event} correlation_id={correlation_id}")
+            await asyncio.to_thread(self._defer, topic, raw, key, e.retry_after, envelope, correlation_id, str(e))
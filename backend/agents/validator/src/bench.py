@@ -0,0 +1,123 @@
+"""Validator engine benchmark.
+
+    python -m agents.validator.src.bench [--patterns 10000] [--drafts 500] [--baseline 20]
+
+Generates a synthetic rule set (``patterns`` entries, 5% of them regexes), writes it as
+rule packs into a temporary directory and loads it through :class:`RuleRegistry`, then
+validates ``drafts`` synthetic drafts of ~2 KB with ``DraftChecker.check_batch``. For
+comparison the previous approach — one ``re.search`` per pattern per draft — is timed
+on ``baseline`` drafts.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+
+from .checker import DraftChecker
+from .rules import RuleRegistry
+
+_SYLLABLES = ("ка", "ро", "ми", "ла", "то", "не", "ри", "за", "по", "ве", "ст", "ны", "ко", "ду", "пра", "вен", "тор", "лик")
+_ENDINGS = ("", "а", "ы", "ом", "ами", "ой", "ый", "ие")
+# обычный текст черновика — лексика, не пересекающаяся с синтетическими терминами
+_DRAFT_WORDS = (
+    "договор", "сторона", "арендатор", "арендодатель", "обязуется", "оплатить", "в", "течение", "рабочих", "дней",
+    "с", "момента", "подписания", "настоящего", "соглашения", "ответственность", "за", "нарушение", "сроков",
+    "поставки", "товара", "покупатель", "вправе", "требовать", "уплаты", "неустойки", "размере", "процента",
+    "от", "суммы", "рекомендуем", "проверить", "условия", "расторжения", "и", "порядок", "урегулирования", "споров",
+)
+
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def _write_packs(directory: str, patterns: int, rng: random.Random):
+    regex_count = patterns // 20
+    terms = sorted({" ".join(_word(rng) for _ in range(rng.choice((1, 1, 1, 2, 3)))) for _ in range(patterns * 2)})
+    terms = terms[:patterns - regex_count]
+    with open(os.path.join(directory, "compliance.txt"), "w", encoding="utf-8") as f:
+        f.write("# synthetic compliance list\n")
+        f.write("\n".join(terms))
+    regexes = [
+        {"id": f"re-{i}", "regex": rf"\b{_word(rng)}\d{{{rng.randint(2, 4)}}}\b", "severity": rng.choice(("block", "warn"))}
+        for i in range(regex_count)
+    ]
+    with open(os.path.join(directory, "patterns.json"), "w", encoding="utf-8") as f:
+        json.dump({"name": "patterns", "rules": regexes}, f, ensure_ascii=False)
+    return terms, [r["regex"] for r in regexes]
+
+
+def _drafts(count: int, terms, rng: random.Random):
+    drafts = []
+    for _ in range(count):
+        words = [rng.choice(_DRAFT_WORDS) for _ in range(rng.randint(250, 320))]
+        if rng.random() < 0.3:
+            # часть черновиков содержит запрещённый термин в другой словоформе
+            words.insert(rng.randrange(len(words)), rng.choice(terms) + rng.choice(_ENDINGS))
+        drafts.append(" ".join(words) + ".")
+    return drafts
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    # сообщения об отклонённых черновиках не нужны в выводе бенчмарка
+    logging.getLogger("validator").setLevel(logging.ERROR)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patterns", type=int, default=10_000)
+    parser.add_argument("--drafts", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--baseline", type=int, default=20, help="drafts for the per-pattern re.search baseline (0 to skip)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as rules_dir:
+        terms, regexes = _write_packs(rules_dir, args.patterns, rng)
+        started = time.perf_counter()
+        registry = RuleRegistry(rules_dir, reload_interval=3600)
+        compile_s = time.perf_counter() - started
+        compiled = registry.current()
+        DraftChecker._registry = registry
+
+        drafts = _drafts(args.drafts, terms, rng)
+        per_draft = []
+        rejected = 0
+        started = time.perf_counter()
+        for i in range(0, len(drafts), args.batch):
+            batch = drafts[i:i + args.batch]
+            t0 = time.perf_counter()
+            results = DraftChecker.check_batch(batch)
+            per_draft.extend([(time.perf_counter() - t0) / len(batch)] * len(batch))
+            rejected += sum(1 for r in results if not r.approved)
+        total_s = time.perf_counter() - started
+
+    print(f"rules:      {compiled.term_count} terms, {compiled.regex_count} regexes, "
+          f"{len(compiled.automaton)} automaton states, normalisation={registry.normalizer.method}")
+    print(f"compile:    {compile_s * 1000:.0f} ms")
+    print(f"drafts:     {len(drafts)} x ~{statistics.mean(len(d) for d in drafts) / 1024:.1f} KB, rejected {rejected}")
+    print(f"engine:     {len(drafts) / total_s:.0f} drafts/s, per draft p50 {_percentile(per_draft, 0.5) * 1000:.2f} ms, "
+          f"p95 {_percentile(per_draft, 0.95) * 1000:.2f} ms")
+
+    if args.baseline:
+        patterns = [re.compile(rf"\b{re.escape(t)}\b", re.IGNORECASE) for t in terms] + [re.compile(r, re.IGNORECASE) for r in regexes]
+        sample = drafts[:args.baseline]
+        started = time.perf_counter()
+        for text in sample:
+            for pattern in patterns:
+                pattern.search(text)
+        baseline = (time.perf_counter() - started) / len(sample)
+        engine = total_s / len(drafts)
+        print(f"baseline:   per-pattern re.search {baseline * 1000:.2f} ms per draft ({baseline / engine:.0f}x slower)")
+
+
+if __name__ == "__main__":
+    main()
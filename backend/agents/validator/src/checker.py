@@ -1,38 +1,71 @@
-import re
 import logging
+import time
+from typing import List, Optional, Sequence
+
+from agents_shared.metrics import counter, histogram
+from .engine import BLOCK, CheckResult
+from .rules import RuleRegistry
 
 logger = logging.getLogger("validator")
 
+MIN_LENGTH = 10
+
+_drafts = counter("validator_drafts_total", "Validated drafts", ["status"])
+_violations = counter("validator_violations_total", "Rule violations found in drafts", ["pack", "severity"])
+_batch_seconds = histogram("validator_batch_seconds", "Time to validate a batch of drafts")
+
 
 class DraftChecker:
     """
     Проверяет сгенерированные тексты на ошибки, галлюцинации и запрещенные темы.
+    Правила берутся из пакетов правил (см. rules.py) и компилируются в один автомат.
     """
 
-    forbidden_patterns = [
-        r"\bнелегально\b",
-        r"\bсекрет\b",
-        r"\bпароль\b",
-    ]
+    _registry: Optional[RuleRegistry] = None
 
     @classmethod
-    def check_text(cls, text: str) -> bool:
-        """
-        Возвращает True, если текст можно публиковать.
-        False — текст не прошёл проверку.
-        """
+    def registry(cls) -> RuleRegistry:
+        if cls._registry is None:
+            cls._registry = RuleRegistry()
+        return cls._registry
+
+    @classmethod
+    def check(cls, text: str, compiled=None) -> CheckResult:
         if not text or not text.strip():
             logger.warning("Draft is empty")
-            return False
+            return CheckResult(False, [], "empty")
 
-        for pattern in cls.forbidden_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                logger.warning("Draft contains forbidden pattern: %s", pattern)
-                return False
+        compiled = compiled or cls.registry().current()
+        violations = compiled.match(text)
+        for v in violations:
+            _violations.inc(pack=v.pack, severity=v.severity)
+        blocking = [v for v in violations if v.severity == BLOCK]
+        if blocking:
+            logger.warning("Draft contains forbidden terms: %s", ", ".join(sorted({f"{v.pack}/{v.rule_id}" for v in blocking})))
+            return CheckResult(False, violations, "forbidden")
 
         # Дополнительно: проверка на слишком короткий текст
-        if len(text.strip()) < 10:
+        if len(text.strip()) < MIN_LENGTH:
             logger.warning("Draft too short")
-            return False
+            return CheckResult(False, violations, "too_short")
 
-        return True
+        return CheckResult(True, violations)
+
+    @classmethod
+    def check_batch(cls, texts: Sequence[str]) -> List[CheckResult]:
+        """Проверяет пачку черновиков одной версией правил."""
+        started = time.monotonic()
+        compiled = cls.registry().current()
+        results = [cls.check(text, compiled) for text in texts]
+        _batch_seconds.observe(time.monotonic() - started)
+        for result in results:
+            _drafts.inc(status="approved" if result.approved else "rejected")
+        return results
+
+    @classmethod
+    def check_text(cls, text: str) -> bool:
+        """
+        Возвращает True, если текст можно публиковать.
+        False — текст не прошёл проверку.
+        """
+        return cls.check(text).approved
@@ -0,0 +1,247 @@
+"""Compiled multi-pattern matcher for validator rule packs.
+
+Literal terms (single words or phrases) are normalised with :class:`Normalizer` and put
+into one Aho-Corasick automaton over *tokens*, so a draft is scanned once regardless of
+how many terms are loaded and word boundaries come for free.
+
+Regex rules run over the raw text. A long alternation is slow in ``re`` (every branch is
+tried at every position), so each regex is reduced to its longest required literal
+("anchor") and only runs when the anchor occurs in the draft; regexes without a usable
+anchor are merged into one alternation with a named group per rule.
+"""
+import re
+try:
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .morphology import Normalizer
+
+BLOCK = "block"
+WARN = "warn"
+MIN_ANCHOR = 3
+# потоковая проверка: регулярные выражения перепроверяют столько символов перед новым чанком
+REGEX_OVERLAP = 256
+
+_TRAILING_WORD_RE = re.compile(r"[0-9a-zа-яё]+$", re.IGNORECASE)
+
+
+class Rule(NamedTuple):
+    id: str
+    pack: str
+    severity: str
+    terms: Tuple[str, ...] = ()
+    regex: Optional[str] = None
+
+
+class Violation(NamedTuple):
+    rule_id: str
+    pack: str
+    severity: str
+    start: int
+    end: int
+    text: str
+
+
+class CheckResult(NamedTuple):
+    approved: bool
+    violations: List[Violation]
+    reason: Optional[str] = None
+
+
+class AhoCorasick:
+    """Aho-Corasick automaton whose alphabet is normalised tokens."""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # (длина шаблона в токенах, индекс правила)
+        self._out: List[List[Tuple[int, int]]] = [[]]
+
+    def add(self, tokens: Sequence[str], value: int) -> None:
+        node = 0
+        for token in tokens:
+            nxt = self._goto[node].get(token)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][token] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(tokens), value))
+
+    def build(self) -> "AhoCorasick":
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(token, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+        return self
+
+    def iter(self, tokens: Sequence[str]):
+        """Yields (first_token_index, last_token_index, value) for every occurrence."""
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for i, token in enumerate(tokens):
+            while node and token not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(token, 0)
+            for length, value in out[node]:
+                yield i - length + 1, i, value
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+
+def literal_anchor(pattern: str) -> Optional[str]:
+    """Longest run of literal characters every match must contain (lower case), or None."""
+    try:
+        parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    except Exception:
+        return None
+    best, run = "", []
+    for op, arg in list(parsed) + [(None, None)]:
+        if op is sre_parse.LITERAL:
+            run.append(chr(arg))
+            continue
+        if op is sre_parse.AT and not run:
+            # \b, ^ в начале не прерывают литерал
+            continue
+        if len(run) > len(best):
+            best = "".join(run)
+        run = []
+    return best.lower() if len(best) >= MIN_ANCHOR else None
+
+
+class CompiledRules:
+    def __init__(self, rules: Sequence[Rule], normalizer: Normalizer, version: str = ""):
+        self.rules = list(rules)
+        self.normalizer = normalizer
+        self.version = version
+        self.automaton = AhoCorasick()
+        self.term_count = 0
+        self.max_term_tokens = 0
+        groups = []
+        self._group_rule: Dict[str, int] = {}
+        self._anchored: List[Tuple[str, int, "re.Pattern"]] = []
+        for idx, rule in enumerate(self.rules):
+            for term in rule.terms:
+                tokens = normalizer.terms(term)
+                if tokens:
+                    self.automaton.add(tokens, idx)
+                    self.term_count += 1
+                    self.max_term_tokens = max(self.max_term_tokens, len(tokens))
+            if rule.regex:
+                anchor = literal_anchor(rule.regex)
+                if anchor:
+                    self._anchored.append((anchor, idx, re.compile(rule.regex, re.IGNORECASE | re.UNICODE)))
+                else:
+                    name = f"r{idx}"
+                    groups.append(f"(?P<{name}>{rule.regex})")
+                    self._group_rule[name] = idx
+        self.automaton.build()
+        self.regex_count = len(groups) + len(self._anchored)
+        self._regex = re.compile("|".join(groups), re.IGNORECASE | re.UNICODE) if groups else None
+
+    def match(self, text: str) -> List[Violation]:
+        violations = []
+        tokens = self.normalizer.tokens(text)
+        seen = set()
+        for first, last, idx in self.automaton.iter([t.norm for t in tokens]):
+            if (idx, first) in seen:
+                continue
+            seen.add((idx, first))
+            rule = self.rules[idx]
+            start, end = tokens[first].start, tokens[last].end
+            violations.append(Violation(rule.id, rule.pack, rule.severity, start, end, text[start:end]))
+        violations.extend(self.match_regex(text))
+        violations.sort(key=lambda v: v.start)
+        return violations
+
+    def match_regex(self, text: str, offset: int = 0) -> List[Violation]:
+        """Regex rule matches in text; spans are shifted by offset."""
+        violations = []
+        if self._anchored:
+            lowered = text.lower()
+            for anchor, idx, pattern in self._anchored:
+                if anchor not in lowered:
+                    continue
+                rule = self.rules[idx]
+                for m in pattern.finditer(text):
+                    violations.append(Violation(rule.id, rule.pack, rule.severity, offset + m.start(), offset + m.end(), m.group()))
+        if self._regex is not None:
+            for m in self._regex.finditer(text):
+                rule = self.rules[self._group_rule[m.lastgroup]]
+                violations.append(Violation(rule.id, rule.pack, rule.severity, offset + m.start(), offset + m.end(), m.group()))
+        return violations
+
+    def stream(self) -> "StreamMatcher":
+        return StreamMatcher(self)
+
+
+class StreamMatcher:
+    """Incremental matching over a text that arrives in chunks.
+
+    The automaton state carries over between chunks, so a phrase split across chunks
+    is still found. A word cut at the end of a chunk is held back until the next chunk
+    (or :meth:`finish`) completes it. Regex rules are re-run over the new text plus the
+    last ``REGEX_OVERLAP`` characters; matches seen before are not reported again.
+    """
+
+    def __init__(self, compiled: CompiledRules):
+        self.compiled = compiled
+        self.text = ""
+        # всё до этой позиции уже проверено
+        self._done = 0
+        self._node = 0
+        # смещения последних токенов — для спана совпадений из нескольких слов
+        self._recent = deque(maxlen=max(1, compiled.max_term_tokens))
+        self._seen_regex = set()
+
+    def feed(self, chunk: str) -> List[Violation]:
+        self.text += chunk
+        trailing = _TRAILING_WORD_RE.search(self.text, self._done)
+        return self._scan(trailing.start() if trailing else len(self.text))
+
+    def finish(self) -> List[Violation]:
+        return self._scan(len(self.text))
+
+    def _scan(self, upto: int) -> List[Violation]:
+        if upto <= self._done:
+            return []
+        c = self.compiled
+        goto, fail, out = c.automaton._goto, c.automaton._fail, c.automaton._out
+        violations = []
+        segment = self.text[self._done:upto]
+        for token in c.normalizer.tokens(segment):
+            start, end = self._done + token.start, self._done + token.end
+            self._recent.append(start)
+            node = self._node
+            while node and token.norm not in goto[node]:
+                node = fail[node]
+            node = self._node = goto[node].get(token.norm, 0)
+            seen = set()
+            for length, idx in out[node]:
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                rule = c.rules[idx]
+                first = self._recent[-length]
+                violations.append(Violation(rule.id, rule.pack, rule.severity, first, end, self.text[first:end]))
+
+        window_start = max(0, self._done - REGEX_OVERLAP)
+        for v in c.match_regex(self.text[window_start:upto], offset=window_start):
+            if v.end > self._done and (v.rule_id, v.start) not in self._seen_regex:
+                self._seen_regex.add((v.rule_id, v.start))
+                violations.append(v)
+        self._done = upto
+        violations.sort(key=lambda v: v.start)
+        return violations
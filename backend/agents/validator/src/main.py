@@ -1,14 +1,18 @@
 import os
 import signal
 import logging
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
 
 from agents_shared.kafka_client import KafkaClient
+from agents_shared.metrics import start_metrics_server
 from .checker import DraftChecker
+from .stream import DraftStreams
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
-CONSUME_TOPICS = os.getenv("CONSUME_TOPICS", "draft.created").split(",")
+CONSUME_TOPICS = os.getenv("CONSUME_TOPICS", "draft.created,draft.chunk").split(",")
 PRODUCE_TOPIC = os.getenv("PRODUCE_TOPIC", "draft.approved")
+CHUNK_TOPIC = os.getenv("CHUNK_TOPIC", "draft.chunk")
+BATCH_SIZE = int(os.getenv("VALIDATOR_BATCH_SIZE", "64"))
 
 logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s %(message)s")
 logger = logging.getLogger("validator")
@@ -30,21 +34,55 @@ signal.signal(signal.SIGINT, _signal_handler)
 signal.signal(signal.SIGTERM, _signal_handler)
 
 
-def handle_message(topic: str, raw: Dict, key: Optional[str] = None):
-    """
-    Проверяет драфт и решает, публиковать ли.
-    """
+def _publish(raw: Dict, key: Optional[str], result):
     text = raw.get("draft", "")
     user_id = raw.get("user_id")
+    violations = [v._asdict() for v in result.violations]
 
-    if DraftChecker.check_text(text):
+    if result.approved:
         logger.info("Draft approved for user_id=%s", user_id)
-        output = {"user_id": user_id, "draft": text, "status": "approved"}
-        kafka_client.produce(PRODUCE_TOPIC, output, key=key)
+        output = {"user_id": user_id, "draft": text, "status": "approved", "violations": violations}
+        kafka_client.produce(PRODUCE_TOPIC, output, key=key, flush=False)
     else:
-        logger.info("Draft rejected for user_id=%s", user_id)
-        output = {"user_id": user_id, "draft": text, "status": "rejected"}
-        kafka_client.produce("draft.rejected", output, key=key)
+        logger.info("Draft rejected for user_id=%s reason=%s", user_id, result.reason)
+        output = {"user_id": user_id, "draft": text, "status": "rejected", "reason": result.reason, "violations": violations}
+        kafka_client.produce("draft.rejected", output, key=key, flush=False)
+
+
+def handle_message(topic: str, raw: Dict, key: Optional[str] = None):
+    """
+    Проверяет драфт и решает, публиковать ли.
+    """
+    handle_batch([(topic, raw, key)])
+
+
+_streams: Optional[DraftStreams] = None
+
+
+def _draft_streams() -> DraftStreams:
+    global _streams
+    if _streams is None:
+        _streams = DraftStreams(DraftChecker.registry())
+    return _streams
+
+
+def handle_batch(messages: List[Tuple[str, Dict, Optional[str]]]):
+    """Проверяет пачку драфтов одной версией правил; решения публикуются одним flush."""
+    drafts = [(raw, key) for topic, raw, key in messages if topic != CHUNK_TOPIC]
+    if drafts:
+        results = DraftChecker.check_batch([raw.get("draft", "") for raw, _ in drafts])
+        for (raw, key), result in zip(drafts, results):
+            _publish(raw, key, result)
+
+    streams = _draft_streams()
+    for topic, raw, key in messages:
+        if topic != CHUNK_TOPIC:
+            continue
+        for out_topic, output in streams.feed(raw, key):
+            # досрочный отказ позволяет остановить генерацию — не ждём конца пачки
+            kafka_client.produce(out_topic, output, key=output["draft_id"], flush=output.get("early", False))
+    streams.expire()
+    kafka_client.flush()
 
 
 kafka_client.on_message = handle_message
@@ -52,8 +90,11 @@ kafka_client.on_message = handle_message
 
 def main_loop():
     logger.info("Validator agent started. Listening topics: %s", CONSUME_TOPICS)
+    start_metrics_server()
+    # правила компилируются при старте, а не на первом сообщении
+    DraftChecker.registry()
     try:
-        kafka_client.listen_forever(poll_timeout=1.0)
+        kafka_client.listen_batches(handle_batch, batch_size=BATCH_SIZE, poll_timeout=1.0, should_stop=lambda: _should_stop)
     except Exception as e:
         logger.exception("Unexpected validator main loop error: %s", e)
     finally:
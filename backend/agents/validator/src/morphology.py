@@ -0,0 +1,156 @@
+"""Russian-aware text normalisation for rule matching.
+
+Rule terms and drafts go through the same normaliser, so "секрет", "секрета" and
+"секретом" match one term. Words are lemmatised with pymorphy3 when it is installed and
+stemmed with the Snowball Russian algorithm otherwise; both sides of a match always use
+the same method because the engine is compiled with the normaliser it later applies.
+"""
+import logging
+import re
+from functools import lru_cache
+from typing import List, NamedTuple, Optional
+
+logger = logging.getLogger("validator.morphology")
+
+_WORD_RE = re.compile(r"[0-9a-zа-яё]+", re.IGNORECASE)
+_VOWELS = set("аеиоуыэюя")
+
+
+def _by_length(*suffixes):
+    # длинные окончания проверяются первыми
+    return tuple(sorted(suffixes, key=len, reverse=True))
+
+
+_PERFECTIVE_GERUND = (_by_length("в", "вши", "вшись"), _by_length("ив", "ивши", "ившись", "ыв", "ывши", "ывшись"))
+_ADJECTIVE = _by_length("ее", "ие", "ые", "ое", "ими", "ыми", "ей", "ий", "ый", "ой", "ем", "им", "ым", "ом",
+                        "его", "ого", "ему", "ому", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею")
+_PARTICIPLE = (_by_length("ем", "нн", "вш", "ющ", "щ"), _by_length("ивш", "ывш", "ующ"))
+_REFLEXIVE = _by_length("ся", "сь")
+_VERB = (
+    _by_length("ла", "на", "ете", "йте", "ли", "й", "л", "ем", "н", "ло", "но", "ет", "ют", "ны", "ть", "ешь", "нно"),
+    _by_length("ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ей", "уй", "ил", "ыл", "им", "ым", "ен",
+               "ило", "ыло", "ено", "ят", "ует", "уют", "ит", "ыт", "ены", "ить", "ыть", "ишь", "ую", "ю"),
+)
+_NOUN = _by_length("а", "ев", "ов", "ие", "ье", "е", "иями", "ями", "ами", "еи", "ии", "и", "ией", "ей", "ой", "ий", "й",
+                   "иям", "ям", "ием", "ем", "ам", "ом", "о", "у", "ах", "иях", "ях", "ы", "ь", "ию", "ью", "ю", "ия", "ья", "я")
+_SUPERLATIVE = _by_length("ейше", "ейш")
+_DERIVATIONAL = _by_length("ость", "ост")
+
+
+class Token(NamedTuple):
+    norm: str
+    start: int
+    end: int
+
+
+def _longest(word: str, suffixes, start: int, preceded: bool = False) -> Optional[str]:
+    """Longest suffix (suffixes are sorted by length) within word[start:]; preceded=True requires 'а' or 'я' before it."""
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= start:
+            if preceded:
+                pos = len(word) - len(suffix) - 1
+                if pos < start or word[pos] not in "ая":
+                    continue
+            return suffix
+    return None
+
+
+def _strip(word: str, groups, start: int) -> Optional[str]:
+    """Try group 1 (after а/я) and group 2 endings; returns the shortened word or None."""
+    first, second = groups
+    for suffix in (_longest(word, first, start, preceded=True), _longest(word, second, start)):
+        if suffix:
+            return word[:-len(suffix)]
+    return None
+
+
+def _regions(word: str):
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in _VOWELS), len(word))
+
+    def r(after: int) -> int:
+        for i in range(after + 1, len(word)):
+            if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = r(0)
+    return rv, r(r1)
+
+
+@lru_cache(maxsize=100_000)
+def stem(word: str) -> str:
+    """Snowball Russian stemmer."""
+    word = word.lower().replace("ё", "е")
+    if len(word) < 3 or not any(ch in _VOWELS for ch in word):
+        return word
+    rv, r2 = _regions(word)
+
+    # step 1
+    stripped = _strip(word, _PERFECTIVE_GERUND, rv)
+    if stripped is not None:
+        word = stripped
+    else:
+        suffix = _longest(word, _REFLEXIVE, rv)
+        if suffix:
+            word = word[:-len(suffix)]
+        suffix = _longest(word, _ADJECTIVE, rv)
+        if suffix:
+            word = word[:-len(suffix)]
+            stripped = _strip(word, _PARTICIPLE, rv)
+            if stripped is not None:
+                word = stripped
+        else:
+            stripped = _strip(word, _VERB, rv)
+            if stripped is not None:
+                word = stripped
+            else:
+                suffix = _longest(word, _NOUN, rv)
+                if suffix:
+                    word = word[:-len(suffix)]
+
+    # step 2
+    if word.endswith("и") and len(word) - 1 >= rv:
+        word = word[:-1]
+    # step 3
+    suffix = _longest(word, _DERIVATIONAL, r2)
+    if suffix:
+        word = word[:-len(suffix)]
+    # step 4
+    if word.endswith("нн") and len(word) - 1 >= rv:
+        return word[:-1]
+    suffix = _longest(word, _SUPERLATIVE, rv)
+    if suffix:
+        word = word[:-len(suffix)]
+        if word.endswith("нн"):
+            word = word[:-1]
+        return word
+    if word.endswith("ь") and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+
+class Normalizer:
+    """Maps words to lemmas (pymorphy3) or Snowball stems; used for rule terms and drafts alike."""
+
+    def __init__(self, use_lemmatizer: bool = True):
+        self._morph = None
+        if use_lemmatizer:
+            try:
+                import pymorphy3
+                self._morph = pymorphy3.MorphAnalyzer()
+            except ImportError:
+                logger.info("pymorphy3 is not installed; using the Snowball stemmer")
+        self.method = "lemma" if self._morph is not None else "stem"
+        self._word = lru_cache(maxsize=200_000)(self._normalize_word)
+
+    def _normalize_word(self, word: str) -> str:
+        word = word.lower().replace("ё", "е")
+        if self._morph is not None:
+            return self._morph.parse(word)[0].normal_form.replace("ё", "е")
+        return stem(word)
+
+    def tokens(self, text: str) -> List[Token]:
+        return [Token(self._word(m.group()), m.start(), m.end()) for m in _WORD_RE.finditer(text or "")]
+
+    def terms(self, phrase: str) -> List[str]:
+        return [t.norm for t in self.tokens(phrase)]
@@ -0,0 +1,180 @@
+"""Rule packs for the validator and their hot reload.
+
+A pack is a file in ``VALIDATOR_RULES_DIR``:
+
+* ``*.json`` — ``{"name": ..., "rules": [{"id", "terms": [...] | "regex": ..., "severity"}]}``;
+* ``*.txt``  — one term or phrase per line (large compliance lists), ``#`` starts a comment;
+  a ``# severity: warn`` line switches the severity of the whole file (default ``block``).
+
+:class:`RuleRegistry` compiles all packs into one :class:`CompiledRules`. It re-checks
+file modification times at most every ``VALIDATOR_RULES_RELOAD_INTERVAL`` seconds and
+recompiles when something changed; a pack that fails to load keeps the previously
+compiled rules in service.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from agents_shared.metrics import counter, gauge, histogram
+from .engine import BLOCK, WARN, CompiledRules, Rule
+from .morphology import Normalizer
+
+logger = logging.getLogger("validator.rules")
+
+RULES_DIR = os.getenv("VALIDATOR_RULES_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "rules"))
+RELOAD_INTERVAL = float(os.getenv("VALIDATOR_RULES_RELOAD_INTERVAL", "10"))
+
+_reloads = counter("validator_rules_reloads_total", "Rule pack reloads", ["status"])
+_compile_seconds = histogram("validator_rules_compile_seconds", "Time to compile all rule packs")
+_rule_count = gauge("validator_rules_loaded", "Loaded rule patterns", ["kind"])
+
+
+# встроенный минимум на случай, если ни один пакет правил не загрузился
+DEFAULT_RULES = [
+    Rule("illegal", "builtin", BLOCK, ("нелегально",)),
+    Rule("secret", "builtin", BLOCK, ("секрет",)),
+    Rule("password", "builtin", BLOCK, ("пароль",)),
+]
+
+
+class RulePackError(ValueError):
+    pass
+
+
+def _check_regex(pack: str, rule_id: str, pattern: str) -> str:
+    if "(?P<" in pattern:
+        raise RulePackError(f"{pack}/{rule_id}: named groups are not allowed in rule regexes")
+    try:
+        # правило встраивается в общую альтернативу — проверяем его в том же виде
+        re.compile(f"(?:{pattern})", re.IGNORECASE)
+    except re.error as e:
+        raise RulePackError(f"{pack}/{rule_id}: invalid regex: {e}") from e
+    return pattern
+
+
+def load_pack(path: str) -> List[Rule]:
+    name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".txt"):
+            severity = BLOCK
+            terms = []
+            for line in f:
+                line = line.strip()
+                if line.startswith("#"):
+                    m = re.match(r"#\s*severity:\s*(\w+)", line)
+                    if m:
+                        severity = m.group(1).lower()
+                    continue
+                if line:
+                    terms.append(line)
+            if severity not in (BLOCK, WARN):
+                raise RulePackError(f"{name}: unknown severity {severity!r}")
+            return [Rule(name, name, severity, tuple(terms))]
+
+        data = json.load(f)
+    name = data.get("name", name)
+    rules = []
+    for i, spec in enumerate(data.get("rules", [])):
+        rule_id = spec.get("id") or f"{name}-{i}"
+        severity = spec.get("severity", BLOCK)
+        if severity not in (BLOCK, WARN):
+            raise RulePackError(f"{name}/{rule_id}: unknown severity {severity!r}")
+        regex = spec.get("regex")
+        terms = tuple(spec.get("terms", ()))
+        if not terms and not regex:
+            raise RulePackError(f"{name}/{rule_id}: rule needs terms or regex")
+        rules.append(Rule(rule_id, name, severity, terms, _check_regex(name, rule_id, regex) if regex else None))
+    return rules
+
+
+def _pack_files(rules_dir: str) -> List[str]:
+    if not os.path.isdir(rules_dir):
+        return []
+    return sorted(
+        os.path.join(rules_dir, f) for f in os.listdir(rules_dir)
+        if f.endswith((".json", ".txt")) and not f.startswith(".")
+    )
+
+
+def _signature(files: List[str]) -> Tuple:
+    sig = []
+    for path in files:
+        try:
+            st = os.stat(path)
+            sig.append((path, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            continue
+    return tuple(sig)
+
+
+def compile_packs(files: List[str], normalizer: Normalizer) -> CompiledRules:
+    if not files:
+        logger.warning("No rule packs found; using the built-in rules")
+        return CompiledRules(DEFAULT_RULES, normalizer, version="builtin")
+    rules = []
+    digest = hashlib.sha256()
+    for path in files:
+        rules.extend(load_pack(path))
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return CompiledRules(rules, normalizer, version=digest.hexdigest()[:12])
+
+
+class RuleRegistry:
+    def __init__(self, rules_dir: str = RULES_DIR, reload_interval: float = RELOAD_INTERVAL,
+                 normalizer: Optional[Normalizer] = None):
+        self.rules_dir = rules_dir
+        self.reload_interval = reload_interval
+        self.normalizer = normalizer or Normalizer()
+        self._lock = threading.Lock()
+        self._signature: Tuple = ()
+        self._checked_at = 0.0
+        self._compiled: Optional[CompiledRules] = None
+        self.reload(force=True)
+
+    def current(self) -> CompiledRules:
+        if time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload()
+        return self._compiled
+
+    def reload(self, force: bool = False) -> bool:
+        """Recompile if any pack changed; returns True when new rules were put in service."""
+        # перекомпиляцию выполняет один поток, остальные продолжают работать со старыми правилами
+        if not self._lock.acquire(blocking=force):
+            return False
+        try:
+            self._checked_at = time.monotonic()
+            files = _pack_files(self.rules_dir)
+            signature = _signature(files)
+            if not force and signature == self._signature:
+                return False
+            started = time.monotonic()
+            try:
+                compiled = compile_packs(files, self.normalizer)
+            except (OSError, ValueError) as e:
+                # повторная попытка — после следующего изменения файлов
+                self._signature = signature
+                _reloads.inc(status="failed")
+                logger.error("Failed to load rule packs from %s: %s; keeping the previous rules", self.rules_dir, e)
+                if self._compiled is None:
+                    self._compiled = CompiledRules(DEFAULT_RULES, self.normalizer, version="builtin")
+                return False
+            self._compiled = compiled
+            self._signature = signature
+            _compile_seconds.observe(time.monotonic() - started)
+            _rule_count.set(compiled.term_count, kind="term")
+            _rule_count.set(compiled.regex_count, kind="regex")
+            _reloads.inc(status="ok")
+            logger.info(
+                "Loaded %d rule packs (%d terms, %d regexes, %s normalisation) version=%s in %.3fs",
+                len(files), compiled.term_count, compiled.regex_count, self.normalizer.method,
+                compiled.version, time.monotonic() - started,
+            )
+            return True
+        finally:
+            self._lock.release()
@@ -0,0 +1,186 @@
+"""Incremental validation of drafts that arrive as a stream of chunks.
+
+A generator publishes ``draft.chunk`` messages keyed by ``draft_id``::
+
+    {"draft_id": ..., "user_id": ..., "seq": 0, "delta": "...", "final": false}
+
+Chunks of one draft are checked as they arrive with a :class:`StreamMatcher`, so a term or
+a regex match split between two chunks is still found. The first blocking violation is
+published to ``draft.rejected`` immediately with ``"early": true`` — the producer can stop
+generating the rest of the draft. A draft that reaches ``final`` without blocking
+violations goes through the same final checks as a whole draft and is published to
+``draft.approved`` with the assembled text.
+
+Per-draft state lives in this process: Kafka keys keep all chunks of a draft in one
+partition. Chunks that arrive out of order wait for the missing ``seq``; when the gap
+cannot be filled (state lost on restart or rebalance) the available chunks are checked
+and the verdict is marked ``"partial": true``.
+"""
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from agents_shared.metrics import counter, histogram
+from .checker import MIN_LENGTH, _violations
+from .engine import BLOCK, StreamMatcher, Violation
+
+logger = logging.getLogger("validator.stream")
+
+STREAM_IDLE_TTL = float(os.getenv("VALIDATOR_STREAM_IDLE_TTL", "300"))
+# сколько чанков «из будущего» держим, ожидая пропущенный seq
+STREAM_MAX_PENDING = int(os.getenv("VALIDATOR_STREAM_MAX_PENDING", "64"))
+
+_verdicts = counter("validator_stream_verdicts_total", "Verdicts on streamed drafts", ["verdict"])
+_verdict_seconds = histogram("validator_stream_verdict_seconds", "Time from the first chunk to the verdict", ["verdict"])
+_chunks_to_verdict = histogram(
+    "validator_stream_chunks_to_verdict", "Chunks received before the verdict", ["verdict"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+_dropped = counter("validator_stream_chunks_dropped_total", "Chunks ignored by the stream validator", ["reason"])
+
+# (topic, payload) — решение, которое нужно опубликовать с ключом draft_id
+Decision = Tuple[str, Dict]
+
+
+class _DraftState:
+    __slots__ = ("draft_id", "user_id", "matcher", "next_seq", "pending", "violations",
+                 "started", "touched", "chunks", "partial", "done")
+
+    def __init__(self, draft_id: str, user_id, matcher: StreamMatcher):
+        self.draft_id = draft_id
+        self.user_id = user_id
+        self.matcher = matcher
+        self.next_seq = 0
+        self.pending: Dict[int, Dict] = {}
+        self.violations: List[Violation] = []
+        self.started = self.touched = time.monotonic()
+        self.chunks = 0
+        self.partial = False
+        self.done = False
+
+
+class DraftStreams:
+    """Per-draft stream state; feed() returns the decisions to publish."""
+
+    def __init__(self, registry, idle_ttl: float = STREAM_IDLE_TTL, max_pending: int = STREAM_MAX_PENDING):
+        self.registry = registry
+        self.idle_ttl = idle_ttl
+        self.max_pending = max_pending
+        self._drafts: Dict[str, _DraftState] = {}
+        self._expired_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._drafts)
+
+    def feed(self, raw: Dict, key: Optional[str] = None) -> List[Decision]:
+        draft_id = raw.get("draft_id") or key
+        try:
+            seq = int(raw.get("seq", 0))
+        except (TypeError, ValueError):
+            seq = -1
+        if not draft_id or seq < 0:
+            _dropped.inc(reason="invalid")
+            logger.warning("Ignoring malformed draft chunk: draft_id=%s seq=%s", draft_id, raw.get("seq"))
+            return []
+
+        state = self._drafts.get(draft_id)
+        if state is None:
+            # версия правил фиксируется на весь черновик
+            state = _DraftState(draft_id, raw.get("user_id"), self.registry.current().stream())
+            self._drafts[draft_id] = state
+        state.touched = time.monotonic()
+        if state.done:
+            # черновик уже отклонён — остаток потока не проверяем
+            _dropped.inc(reason="decided")
+            return []
+        if seq < state.next_seq or seq in state.pending:
+            _dropped.inc(reason="duplicate")
+            return []
+        state.pending[seq] = raw
+        if state.next_seq not in state.pending and (
+            len(state.pending) > self.max_pending or any(c.get("final") for c in state.pending.values())
+        ):
+            # пропущенные чанки уже не придут (потерянное состояние, перебалансировка):
+            # проверяем то, что есть, и помечаем вердикт как частичный
+            logger.warning("Draft_id=%s: chunks %d..%d are missing; verdict will be partial",
+                           draft_id, state.next_seq, min(state.pending) - 1)
+            _dropped.inc(reason="gap")
+            state.next_seq = min(state.pending)
+            state.partial = True
+
+        decisions = []
+        while state.next_seq in state.pending and not state.done:
+            chunk = state.pending.pop(state.next_seq)
+            state.next_seq += 1
+            decision = self._apply(state, chunk)
+            if decision:
+                decisions.append(decision)
+        if state.done:
+            state.pending.clear()
+            state.matcher = None
+            # после досрочного отказа генератор ещё может прислать чанки — состояние
+            # остаётся маркером до истечения idle_ttl, чтобы их отбросить
+            if not decisions[-1][1]["early"]:
+                del self._drafts[draft_id]
+        return decisions
+
+    def _apply(self, state: _DraftState, chunk: Dict) -> Optional[Decision]:
+        state.chunks += 1
+        final = bool(chunk.get("final"))
+        new = state.matcher.feed(chunk.get("delta") or "")
+        if final:
+            new += state.matcher.finish()
+        for v in new:
+            _violations.inc(pack=v.pack, severity=v.severity)
+        state.violations.extend(new)
+
+        if any(v.severity == BLOCK for v in new):
+            logger.warning("Streamed draft_id=%s rejected at seq=%d", state.draft_id, state.next_seq - 1)
+            return self._verdict(state, "draft.rejected", "rejected", "forbidden", early=not final)
+        if not final:
+            return None
+        text = state.matcher.text
+        if not text.strip():
+            return self._verdict(state, "draft.rejected", "rejected", "empty")
+        if len(text.strip()) < MIN_LENGTH and not state.partial:
+            return self._verdict(state, "draft.rejected", "rejected", "too_short")
+        return self._verdict(state, "draft.approved", "approved")
+
+    def _verdict(self, state: _DraftState, topic: str, status: str, reason: Optional[str] = None,
+                 early: bool = False) -> Decision:
+        state.done = True
+        verdict = "early_rejected" if early else status
+        _verdicts.inc(verdict=verdict)
+        _verdict_seconds.observe(time.monotonic() - state.started, verdict=verdict)
+        _chunks_to_verdict.observe(state.chunks, verdict=verdict)
+        output = {
+            "draft_id": state.draft_id,
+            "user_id": state.user_id,
+            "status": status,
+            "seq": state.next_seq - 1,
+            "early": early,
+            "partial": state.partial,
+            "violations": [v._asdict() for v in state.violations],
+        }
+        if reason:
+            output["reason"] = reason
+        if status == "approved" or not early:
+            output["draft"] = state.matcher.text
+        return topic, output
+
+    def expire(self) -> int:
+        """Drops drafts idle longer than idle_ttl (finished streams and abandoned ones)."""
+        now = time.monotonic()
+        # полный обход не чаще раза в 1/10 idle_ttl
+        if now - self._expired_at < self.idle_ttl / 10:
+            return 0
+        self._expired_at = now
+        deadline = now - self.idle_ttl
+        stale = [draft_id for draft_id, state in self._drafts.items() if state.touched < deadline]
+        for draft_id in stale:
+            state = self._drafts.pop(draft_id)
+            if not state.done:
+                _dropped.inc(reason="abandoned")
+                logger.info("Dropping abandoned draft stream draft_id=%s after %d chunks", draft_id, state.chunks)
+        return len(stale)
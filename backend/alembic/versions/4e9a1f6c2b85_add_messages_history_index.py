@@ -0,0 +1,49 @@
+"""add messages (user_id, created_at, id) index
+
+Revision ID: 4e9a1f6c2b85
+Revises: c51e7a90d3f2
+Create Date: 2026-10-19 16:40:27.913054
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4e9a1f6c2b85'
+down_revision: Union[str, Sequence[str], None] = 'c51e7a90d3f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # messages used to be created only by init_db(); create it here on fresh databases
+    if not sa.inspect(op.get_bind()).has_table('messages'):
+        op.create_table('messages',
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('user_id', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('correlation_id', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column('direction', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('text', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column('payload', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_messages_user_id'), 'messages', ['user_id'], unique=False)
+        op.create_index(op.f('ix_messages_correlation_id'), 'messages', ['correlation_id'], unique=False)
+    # CONCURRENTLY: the table can be large and is written on every chat message
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_user_created_id', 'messages', ['user_id', 'created_at', 'id'],
+            unique=False, postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_messages_user_created_id', table_name='messages', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,51 @@
+"""add clause_findings and document_analyses
+
+Revision ID: 8d4f2a6b1c07
+Revises: 3b7e1c2d9a41
+Create Date: 2026-10-19 12:40:51.902113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d4f2a6b1c07'
+down_revision: Union[str, Sequence[str], None] = '3b7e1c2d9a41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('clause_findings',
+    sa.Column('clause_hash', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('finding', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('clause_hash')
+    )
+    op.create_table('document_analyses',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('file_id', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('content_hash', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('findings_hash', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('clause_hashes', sa.JSON(), nullable=False),
+    sa.Column('analysis_text', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('session_id', 'file_id', 'content_hash', name='uq_document_analyses_version')
+    )
+    op.create_index(op.f('ix_document_analyses_session_id'), 'document_analyses', ['session_id'], unique=False)
+    op.create_index(op.f('ix_document_analyses_content_hash'), 'document_analyses', ['content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_document_analyses_content_hash'), table_name='document_analyses')
+    op.drop_index(op.f('ix_document_analyses_session_id'), table_name='document_analyses')
+    op.drop_table('document_analyses')
+    op.drop_table('clause_findings')
@@ -0,0 +1,41 @@
+"""add session_reports
+
+Revision ID: c51e7a90d3f2
+Revises: 8d4f2a6b1c07
+Create Date: 2026-10-19 13:58:12.440517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c51e7a90d3f2'
+down_revision: Union[str, Sequence[str], None] = '8d4f2a6b1c07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('session_reports',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('fingerprint', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('file_ids', sa.JSON(), nullable=False),
+    sa.Column('partial', sa.Boolean(), server_default=sa.false(), nullable=False),
+    sa.Column('report_text', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('session_id', 'fingerprint', name='uq_session_reports_fingerprint')
+    )
+    op.create_index(op.f('ix_session_reports_session_id'), 'session_reports', ['session_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_session_reports_session_id'), table_name='session_reports')
+    op.drop_table('session_reports')
@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Any, Dict, List
+
+from agents_shared.metrics import counter, gauge
+
+logger = logging.getLogger("ws_buffers")
+
+# where undelivered messages of offline users are kept: "redis" (shared by all gateway replicas) or "memory"
+WS_BUFFER_BACKEND = os.getenv("WS_BUFFER_BACKEND", "redis")
+WS_BUFFER_MAX_MESSAGES = int(os.getenv("WS_BUFFER_MAX_MESSAGES", "200"))
+WS_BUFFER_TTL = int(os.getenv("WS_BUFFER_TTL", str(7 * 24 * 3600)))
+# memory backend: total size of buffered frames across all users
+WS_BUFFER_MAX_BYTES = int(os.getenv("WS_BUFFER_MAX_BYTES", str(64 * 1024 * 1024)))
+
+_users = gauge("api_ws_buffer_users", "Users with buffered frames in this process")
+_bytes = gauge("api_ws_buffer_bytes", "Bytes of buffered frames held in this process")
+_evictions = counter("api_ws_buffer_evicted_frames_total", "Buffered frames dropped before delivery", ["reason"])
+_evicted_users = counter("api_ws_buffer_evicted_users_total", "Whole user buffers dropped", ["reason"])
+
+
+class BufferStore(ABC):
+    """Per-user queue of frames waiting for the user to connect."""
+
+    @abstractmethod
+    def append(self, user_id: str, frame: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def pop_all(self, user_id: str) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def requeue(self, user_id: str, frames: List[Dict[str, Any]]) -> None:
+        """Put frames that could not be sent back in front of the queue, keeping their order."""
+
+
+class _UserBuffer:
+    __slots__ = ("frames", "nbytes", "touched")
+
+    def __init__(self):
+        self.frames: deque = deque()
+        self.nbytes = 0
+        self.touched = time.monotonic()
+
+
+class LocalBufferStore(BufferStore):
+    """
+    In-process buffers under a global memory budget.
+
+    Frames are kept pre-serialized (UTF-8 JSON bytes). Users are ordered by last
+    activity: a buffer untouched for ``ttl`` seconds expires, and when the total size
+    exceeds ``max_bytes`` the least recently active users are evicted first. A single
+    user is further capped at ``max_messages`` frames.
+    """
+
+    def __init__(self, max_messages: int = WS_BUFFER_MAX_MESSAGES, max_bytes: int = WS_BUFFER_MAX_BYTES,
+                 ttl: float = WS_BUFFER_TTL):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._buffers: "OrderedDict[str, _UserBuffer]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._swept_at = time.monotonic()
+
+    @staticmethod
+    def _encode(frame: Dict[str, Any]) -> bytes:
+        return json.dumps(frame, ensure_ascii=False, default=str, separators=(",", ":")).encode()
+
+    def append(self, user_id, frame):
+        data = self._encode(frame)
+        if len(data) > self.max_bytes:
+            _evictions.inc(reason="oversize")
+            logger.warning("Frame of %d bytes for user %s exceeds the buffer budget; dropped", len(data), user_id)
+            return
+        with self._lock:
+            buf = self._touch(user_id)
+            buf.frames.append(data)
+            buf.nbytes += len(data)
+            self._bytes += len(data)
+            # trim if buffer grows too large
+            while len(buf.frames) > self.max_messages:
+                self._drop_oldest(buf, "cap")
+            self._enforce(user_id)
+
+    def pop_all(self, user_id):
+        with self._lock:
+            buf = self._buffers.pop(user_id, None)
+            if buf is None:
+                return []
+            self._bytes -= buf.nbytes
+            self._report()
+        return [json.loads(data) for data in buf.frames]
+
+    def requeue(self, user_id, frames):
+        if not frames:
+            return
+        encoded = [self._encode(f) for f in frames]
+        with self._lock:
+            buf = self._touch(user_id)
+            buf.frames.extendleft(reversed(encoded))
+            size = sum(len(d) for d in encoded)
+            buf.nbytes += size
+            self._bytes += size
+            while len(buf.frames) > self.max_messages:
+                self._drop_oldest(buf, "cap")
+            self._enforce(user_id)
+
+    def _touch(self, user_id: str) -> _UserBuffer:
+        buf = self._buffers.get(user_id)
+        if buf is None:
+            buf = self._buffers[user_id] = _UserBuffer()
+        else:
+            self._buffers.move_to_end(user_id)
+        buf.touched = time.monotonic()
+        return buf
+
+    def _drop_oldest(self, buf: _UserBuffer, reason: str) -> None:
+        data = buf.frames.popleft()
+        buf.nbytes -= len(data)
+        self._bytes -= len(data)
+        _evictions.inc(reason=reason)
+
+    def _enforce(self, current: str) -> None:
+        # порядок OrderedDict — от давно неактивных к недавним, поэтому и TTL, и LRU смотрят с начала
+        now = time.monotonic()
+        if now - self._swept_at >= min(self.ttl, 60):
+            self._swept_at = now
+            deadline = now - self.ttl
+            while self._buffers:
+                user_id, buf = next(iter(self._buffers.items()))
+                if buf.touched >= deadline:
+                    break
+                self._evict(user_id, "ttl")
+        while self._bytes > self.max_bytes:
+            user_id = next(iter(self._buffers))
+            if user_id == current and len(self._buffers) == 1:
+                # остался только текущий пользователь — вытесняем его старые кадры
+                self._drop_oldest(self._buffers[current], "lru")
+                continue
+            if user_id == current:
+                self._buffers.move_to_end(current)
+                continue
+            self._evict(user_id, "lru")
+        self._report()
+
+    def _evict(self, user_id: str, reason: str) -> None:
+        buf = self._buffers.pop(user_id)
+        self._bytes -= buf.nbytes
+        _evictions.inc(len(buf.frames), reason=reason)
+        _evicted_users.inc(reason=reason)
+
+    def _report(self) -> None:
+        _users.set(len(self._buffers))
+        _bytes.set(self._bytes)
+
+
+class RedisBufferStore(BufferStore):
+    """Buffers in Redis lists ``ws:buffer:{user_id}``, so a user may reconnect to any replica."""
+
+    def __init__(self, redis_client, max_messages: int = WS_BUFFER_MAX_MESSAGES, ttl: int = WS_BUFFER_TTL):
+        self.r = redis_client
+        self.max_messages = max_messages
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"ws:buffer:{user_id}"
+
+    def append(self, user_id, frame):
+        key = self._key(user_id)
+        pipe = self.r.pipeline(transaction=True)
+        pipe.rpush(key, json.dumps(frame, ensure_ascii=False, default=str))
+        # самые старые сообщения вытесняются
+        pipe.ltrim(key, -self.max_messages, -1)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def pop_all(self, user_id):
+        key = self._key(user_id)
+        # LRANGE + DEL в одной транзакции: две реплики не отправят один буфер дважды
+        pipe = self.r.pipeline(transaction=True)
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        raw, _ = pipe.execute()
+        return [json.loads(item) for item in raw]
+
+    def requeue(self, user_id, frames):
+        if not frames:
+            return
+        key = self._key(user_id)
+        pipe = self.r.pipeline(transaction=True)
+        pipe.lpush(key, *(json.dumps(f, ensure_ascii=False, default=str) for f in reversed(frames)))
+        pipe.ltrim(key, -self.max_messages, -1)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+
+def create_buffer_store(redis_client) -> BufferStore:
+    if WS_BUFFER_BACKEND == "memory":
+        return LocalBufferStore()
+    return RedisBufferStore(redis_client)
@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from agents_shared.metrics import counter, gauge
+
+logger = logging.getLogger("ws_cluster")
+
+# unique per gateway replica; the default is unique per process
+NODE_ID = os.getenv("GATEWAY_NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+NODE_HEARTBEAT_INTERVAL = float(os.getenv("GATEWAY_HEARTBEAT_INTERVAL", "10"))
+# a node that missed heartbeats for this long is considered gone
+NODE_TTL = float(os.getenv("GATEWAY_NODE_TTL", "30"))
+
+_NODES_KEY = "ws:nodes"
+
+_routed = counter("api_ws_routed_total", "Messages routed by the gateway cluster layer", ["target"])
+_alive_nodes = gauge("api_ws_cluster_nodes", "Gateway replicas with a recent heartbeat")
+
+
+def node_channel(node_id: str) -> str:
+    return f"ws:deliver:{node_id}"
+
+
+class ConnectionRegistry:
+    """
+    Which gateway replicas hold WebSocket connections of a user.
+
+    ``ws:user:{user_id}`` is a hash node -> number of open connections on that node.
+    Replicas heartbeat into the ``ws:nodes`` sorted set; entries of nodes that stopped
+    heartbeating (crash, kill -9) are ignored and removed lazily.
+    """
+
+    def __init__(self, redis_client, node_id: str = NODE_ID, node_ttl: float = NODE_TTL):
+        self.r = redis_client
+        self.node_id = node_id
+        self.node_ttl = node_ttl
+        self._alive: set = {node_id}
+        self._alive_at = 0.0
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"ws:user:{user_id}"
+
+    def register(self, user_id: str) -> None:
+        self.r.hincrby(self._key(user_id), self.node_id, 1)
+
+    def unregister(self, user_id: str) -> None:
+        key = self._key(user_id)
+        if self.r.hincrby(key, self.node_id, -1) <= 0:
+            self.r.hdel(key, self.node_id)
+
+    def unregister_all(self, user_ids: List[str]) -> None:
+        """Drop this node from the registry (shutdown)."""
+        pipe = self.r.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hdel(self._key(user_id), self.node_id)
+        pipe.zrem(_NODES_KEY, self.node_id)
+        pipe.execute()
+
+    def heartbeat(self) -> None:
+        now = time.time()
+        pipe = self.r.pipeline(transaction=False)
+        pipe.zadd(_NODES_KEY, {self.node_id: now})
+        pipe.zremrangebyscore(_NODES_KEY, "-inf", now - 10 * self.node_ttl)
+        pipe.zrangebyscore(_NODES_KEY, now - self.node_ttl, "+inf")
+        alive = pipe.execute()[-1]
+        self._alive = set(alive) | {self.node_id}
+        self._alive_at = time.monotonic()
+        _alive_nodes.set(len(self._alive))
+
+    def alive_nodes(self) -> set:
+        # список живых узлов обновляется heartbeat'ом; без него — по запросу
+        if time.monotonic() - self._alive_at > NODE_HEARTBEAT_INTERVAL * 2:
+            self.heartbeat()
+        return self._alive
+
+    def nodes_for(self, user_id: str) -> List[str]:
+        key = self._key(user_id)
+        entries = self.r.hgetall(key)
+        if not entries:
+            return []
+        alive = self.alive_nodes()
+        nodes, dead = [], []
+        for node, count in entries.items():
+            if node not in alive:
+                dead.append(node)
+            elif int(count) > 0:
+                nodes.append(node)
+        if dead:
+            self.r.hdel(key, *dead)
+        return nodes
+
+
+class NodeChannel:
+    """Redis pub/sub channel of this replica: other replicas publish frames for our connections here."""
+
+    def __init__(self, redis_client, registry: ConnectionRegistry,
+                 handler: Callable[[Dict[str, Any]], None], heartbeat_interval: float = NODE_HEARTBEAT_INTERVAL):
+        self.r = redis_client
+        self.registry = registry
+        self.handler = handler
+        self.heartbeat_interval = heartbeat_interval
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def publish(self, node_id: str, message: Dict[str, Any]) -> bool:
+        """Returns False if nobody listens on the node's channel (the node is gone)."""
+        receivers = self.r.publish(node_channel(node_id), json.dumps(message, ensure_ascii=False, default=str))
+        _routed.inc(target="remote" if receivers else "lost")
+        return bool(receivers)
+
+    def start(self) -> None:
+        self._stop.clear()
+        for target, name in ((self._listen, "ws-node-channel"), (self._heartbeat, "ws-node-heartbeat")):
+            t = threading.Thread(target=target, name=name, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self) -> None:
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=5)
+        self._threads.clear()
+
+    def _heartbeat(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.registry.heartbeat()
+            except Exception:
+                logger.exception("Gateway heartbeat failed")
+            self._stop.wait(self.heartbeat_interval)
+
+    def _listen(self) -> None:
+        channel = node_channel(self.registry.node_id)
+        while not self._stop.is_set():
+            pubsub: Optional[Any] = None
+            try:
+                pubsub = self.r.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(channel)
+                logger.info("Listening for routed messages on %s", channel)
+                while not self._stop.is_set():
+                    msg = pubsub.get_message(timeout=1.0)
+                    if msg is None:
+                        continue
+                    try:
+                        self.handler(json.loads(msg["data"]))
+                    except Exception:
+                        logger.exception("Failed to handle routed message")
+            except Exception:
+                logger.exception("Node channel subscription failed; resubscribing")
+                self._stop.wait(1.0)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
@@ -1,26 +1,163 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Tuple
+
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 
+from agents_shared.metrics import counter, gauge, histogram
+
+from api.delivery_log import DEFAULT_DEVICE
+from api.wire import LEGACY, WireProtocol
+
 app = FastAPI()
 
-# Активные соединения: user_id -> list[WebSocket]
-_active: dict[str, list[WebSocket]] = {}
+logger = logging.getLogger("connections")
+
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# a send that takes longer than this marks the client as stuck and closes the socket
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+# what to do when a client's send queue is full: "drop" the oldest frame or "disconnect" the client
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "disconnect")
+
+_queued = gauge("api_ws_send_queue_depth", "Frames waiting in per-connection send queues (all connections)")
+_send_seconds = histogram(
+    "api_ws_send_seconds", "Time to write one frame to a WebSocket",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 10.0),
+)
+_dropped = counter("api_ws_frames_dropped_total", "Frames not delivered to a connection", ["reason"])
+_slow_disconnects = counter("api_ws_slow_consumer_disconnects_total", "Connections closed because the client could not keep up")
+_open_connections = gauge("api_ws_connections", "Open WebSocket connections on this node")
+
+# (кадр, можно ли вернуть его в буфер пользователя при недоставке)
+QueuedFrame = Tuple[Dict[str, Any], bool]
+
+
+class ClientConnection:
+    """
+    One WebSocket with its own bounded send queue and writer task.
+
+    send() never waits: it puts the frame into the queue and returns. The writer task
+    sends frames one by one, so a slow client delays only itself, not the other
+    connections of the same user. When the queue is full the slow-consumer policy
+    applies: ``drop`` discards the oldest frame, ``disconnect`` closes the socket.
+    Frames are encoded by the negotiated wire protocol, which may batch the frames
+    queued within its window into one. Must be used from the event loop thread.
+    """
+
+    def __init__(self, user_id: str, ws: WebSocket, queue_size: int = WS_SEND_QUEUE_SIZE,
+                 policy: str = WS_SLOW_CONSUMER_POLICY, send_timeout: float = WS_SEND_TIMEOUT,
+                 protocol: WireProtocol = LEGACY, device_id: str = DEFAULT_DEVICE):
+        self.user_id = user_id
+        self.ws = ws
+        # acks of the delivery log are kept per device
+        self.device_id = device_id
+        self.protocol = protocol
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.closed = False
+        self._queue: "asyncio.Queue[QueuedFrame]" = asyncio.Queue(maxsize=queue_size)
+        self._undelivered: List[QueuedFrame] = []
+        self._writer = asyncio.get_running_loop().create_task(self._write_loop())
+
+    def send(self, frame: Dict[str, Any], buffer: bool = True) -> bool:
+        """Queue a frame; False means this connection will not deliver it."""
+        if self.closed:
+            return False
+        if self._queue.full():
+            if self.policy == "drop":
+                self._queue.get_nowait()
+                _queued.dec()
+                _dropped.inc(reason="slow_consumer")
+            else:
+                _slow_disconnects.inc()
+                logger.warning("Send queue of user %s is full, closing slow connection", self.user_id)
+                self._fail()
+                return False
+        self._queue.put_nowait((frame, buffer))
+        _queued.inc()
+        return True
+
+    async def _write_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            _queued.dec()
+            if self.protocol.batch_max > 1:
+                await self._collect(batch)
+            started = time.monotonic()
+            try:
+                kind, data = self.protocol.encode([frame for frame, _ in batch])
+                await asyncio.wait_for(self.ws.send({"type": "websocket.send", kind: data}), self.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.debug("Send to user %s failed, closing connection", self.user_id, exc_info=True)
+                self._undelivered.extend(batch)
+                self._fail()
+                return
+            _send_seconds.observe(time.monotonic() - started)
+
+    async def _collect(self, batch: List[QueuedFrame]):
+        """Add the frames that arrive within the batch window to `batch`."""
+        if self._queue.empty() and self.protocol.batch_window > 0:
+            await asyncio.sleep(self.protocol.batch_window)
+        while len(batch) < self.protocol.batch_max and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+            _queued.dec()
 
+    def _fail(self):
+        """Close the socket after a failed or stuck send."""
+        if self.closed:
+            return
+        asyncio.get_running_loop().create_task(self._close_socket())
+        drop_connection(self.user_id, self.ws)
 
-def save_connection(user_id: str, ws: WebSocket):
+    async def _close_socket(self):
+        try:
+            # 1013: try again later
+            await self.ws.close(code=1013)
+        except Exception:
+            pass
+
+    def close(self) -> List[Dict[str, Any]]:
+        """Stop the writer; returns bufferable frames that were not delivered."""
+        if self.closed:
+            return []
+        self.closed = True
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        while not self._queue.empty():
+            self._undelivered.append(self._queue.get_nowait())
+            _queued.dec()
+        frames = [frame for frame, buffer in self._undelivered if buffer]
+        self._undelivered = []
+        return frames
+
+
+# Активные соединения: user_id -> list[ClientConnection]
+_active: dict[str, list[ClientConnection]] = {}
+
+
+def save_connection(user_id: str, ws: WebSocket, last_seen_seq: int | None = None,
+                    protocol: WireProtocol = LEGACY, device_id: str = DEFAULT_DEVICE) -> ClientConnection:
+    conn = ClientConnection(user_id, ws, protocol=protocol, device_id=device_id)
     conns = _active.get(user_id)
     if conns is None:
         conns = []
         _active[user_id] = conns
-    conns.append(ws)
+    conns.append(conn)
+    _open_connections.inc()
     # import bridge lazily to avoid circular imports at module load time
     try:
         from api.kafka_ws_bridge import bridge
 
-        # ask bridge to flush any buffered messages for this user
-        bridge.flush_user(user_id)
+        # register the connection in the cluster and replay/flush messages the user missed
+        bridge.on_connect(user_id, conn, last_seen_seq)
     except Exception:
         # if bridge isn't ready or import fails, just ignore — bridge will flush later
         pass
+    return conn
 
 
 def drop_connection(user_id: str, ws: WebSocket | None = None):
@@ -29,24 +166,43 @@ def drop_connection(user_id: str, ws: WebSocket | None = None):
         return
     if ws is None:
         # drop all
-        _active.pop(user_id, None)
-        return
+        dropped = _active.pop(user_id, None) or []
+    else:
+        dropped = [c for c in conns if c.ws is ws]
+        conns[:] = [c for c in conns if c.ws is not ws]
+        if not conns:
+            _active.pop(user_id, None)
+    leftovers = []
+    for conn in dropped:
+        leftovers.extend(conn.close())
+        _open_connections.dec()
     try:
-        conns.remove(ws)
-    except ValueError:
-        pass
-    if not conns:
-        _active.pop(user_id, None)
+        from api.kafka_ws_bridge import bridge
+
+        if leftovers and get_connections(user_id):
+            # другие соединения пользователя получили эти кадры
+            _dropped.inc(len(leftovers), reason="closed")
+        elif leftovers:
+            # недоставленные кадры возвращаются в буфер пользователя
+            bridge.rebuffer(user_id, leftovers)
+        for _ in dropped:
+            bridge.on_disconnect(user_id)
+    except Exception:
+        logger.exception("Failed to hand over closed connection of user %s", user_id)
+
+
+def get_connections(user_id: str) -> list[ClientConnection]:
+    return [c for c in _active.get(user_id) or [] if not c.closed]
 
 
-def get_connections(user_id: str) -> list[WebSocket]:
-    return list(_active.get(user_id) or [])
+def connected_users() -> list[str]:
+    return list(_active)
 
 
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
     await websocket.accept()
-    save_connection(user_id, websocket)
+    conn = save_connection(user_id, websocket)
 
     try:
         while True:
@@ -55,7 +211,7 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             print(f"Received message: {data}")
             # пока эхо
             response = {"text": f"Echo: {data.get('text')}"}
-            await websocket.send_json(response)
+            conn.send(response, buffer=False)
     except WebSocketDisconnect:
         drop_connection(user_id, websocket)
         print(f"User {user_id} disconnected")
@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from agents_shared.metrics import counter, histogram
+
+logger = logging.getLogger("ws_delivery_log")
+
+# durable per-user delivery with sequence numbers; when disabled the gateway falls back to BufferStore
+WS_DELIVERY_LOG_ENABLED = os.getenv("WS_DELIVERY_LOG_ENABLED", "true").lower() in ("1", "true", "yes")
+WS_DELIVERY_LOG_MAX_MESSAGES = int(os.getenv("WS_DELIVERY_LOG_MAX_MESSAGES", "1000"))
+WS_DELIVERY_LOG_TTL = int(os.getenv("WS_DELIVERY_LOG_TTL", str(7 * 24 * 3600)))
+# upper bound for one replay after reconnect
+WS_REPLAY_LIMIT = int(os.getenv("WS_REPLAY_LIMIT", "500"))
+
+_appends = counter("api_ws_log_appends_total", "Frames appended to per-user delivery logs")
+_acks = counter("api_ws_log_acks_total", "Client acknowledgements applied to delivery logs")
+_replay_size = histogram(
+    "api_ws_replay_frames", "Frames replayed to a reconnecting client",
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+
+# INCR + XADD в одном скрипте: номер сообщения и id записи в потоке совпадают.
+# Счётчик без TTL: после истечения лога номера не должны начинаться заново
+_APPEND_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], seq .. '-0', 'f', ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return seq
+"""
+
+
+# HSET подтверждения устройства (только вперёд), затем обрезка потока до минимального
+# подтверждения среди устройств; устройства без подтверждений дольше TTL забываются
+_ACK_SCRIPT = """
+local now = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+local prev = redis.call('HGET', KEYS[1], ARGV[1])
+local seq = tonumber(ARGV[2])
+if prev and tonumber(string.match(prev, '^(%d+)')) > seq then
+  seq = tonumber(string.match(prev, '^(%d+)'))
+end
+redis.call('HSET', KEYS[1], ARGV[1], seq .. ':' .. now)
+redis.call('EXPIRE', KEYS[1], ttl)
+local low = nil
+local all = redis.call('HGETALL', KEYS[1])
+for i = 1, #all, 2 do
+  local acked, ts = string.match(all[i + 1], '^(%d+):(%d+)')
+  if tonumber(ts) < now - ttl then
+    redis.call('HDEL', KEYS[1], all[i])
+  elseif low == nil or tonumber(acked) < low then
+    low = tonumber(acked)
+  end
+end
+redis.call('XTRIM', KEYS[2], 'MINID', (low + 1) .. '-0')
+return low
+"""
+
+DEFAULT_DEVICE = "default"
+
+
+class DeliveryLog:
+    """
+    Per-user Redis stream ``ws:log:{user_id}`` of frames with sequence numbers.
+
+    Every final response is appended before it is sent and carries ``msg_seq``. A client
+    reconnects with ``last_seen_seq`` and receives exactly the frames after it. The stream
+    entry id is ``{seq}-0``, so a replay is a single XRANGE.
+
+    ``{"ack": seq}`` messages are kept per device in ``ws:acks:{user_id}``; the stream is
+    trimmed only up to the lowest acknowledged seq, so a phone that was offline still gets
+    what a laptop has already acknowledged. A device is registered there when it first
+    connects (:meth:`attach`), and one that reconnects without ``last_seen_seq`` resumes
+    after its own last ack. Devices silent for longer than the
+    log TTL stop holding the stream back; until then the stream is bounded by ``max_messages``.
+
+    A ``last_seen_seq`` or ack above the current :meth:`head` comes from before a reset of
+    the seq counter and is ignored; the client learns the head from the ``resume`` frame
+    sent ahead of every replay and drops its own stale seq.
+    """
+
+    def __init__(self, redis_client, max_messages: int = WS_DELIVERY_LOG_MAX_MESSAGES,
+                 ttl: int = WS_DELIVERY_LOG_TTL, replay_limit: int = WS_REPLAY_LIMIT):
+        self.r = redis_client
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.replay_limit = replay_limit
+        self._append = self.r.register_script(_APPEND_SCRIPT)
+        self._ack = self.r.register_script(_ACK_SCRIPT)
+
+    @staticmethod
+    def _keys(user_id: str):
+        return [f"ws:seq:{user_id}", f"ws:log:{user_id}"]
+
+    @staticmethod
+    def _acks_key(user_id: str) -> str:
+        return f"ws:acks:{user_id}"
+
+    def append(self, user_id: str, frame: Dict[str, Any]) -> int:
+        data = json.dumps(frame, ensure_ascii=False, default=str)
+        seq = int(self._append(keys=self._keys(user_id), args=[data, self.max_messages, self.ttl]))
+        _appends.inc()
+        return seq
+
+    def since(self, user_id: str, last_seen_seq: Optional[int]) -> List[Dict[str, Any]]:
+        """Frames with msg_seq > last_seen_seq (all retained frames when it is None), oldest first."""
+        start = f"{last_seen_seq + 1}-0" if last_seen_seq is not None else "-"
+        entries = self.r.xrange(self._keys(user_id)[1], min=start, max="+", count=self.replay_limit)
+        frames = []
+        for entry_id, fields in entries:
+            frame = json.loads(fields["f"])
+            frame["msg_seq"] = int(entry_id.split("-", 1)[0])
+            frames.append(frame)
+        _replay_size.observe(len(frames))
+        return frames
+
+    def ack(self, user_id: str, seq: int, device_id: str = DEFAULT_DEVICE) -> None:
+        """The device received everything up to and including seq; trim what every device has."""
+        self._ack(keys=[self._acks_key(user_id), self._keys(user_id)[1]],
+                  args=[device_id, int(seq), int(time.time()), self.ttl])
+        _acks.inc()
+
+    def head(self, user_id: str) -> int:
+        """Seq of the newest frame appended for the user (0 before the first one)."""
+        return int(self.r.get(self._keys(user_id)[0]) or 0)
+
+    def attach(self, user_id: str, device_id: str = DEFAULT_DEVICE, last_seen_seq: Optional[int] = None) -> Optional[int]:
+        """Keep the stream for a connecting device; returns the seq to replay after (None — everything retained)."""
+        head = self.head(user_id)
+        # номера выше счётчика остались от лога до сброса Redis (flush, вытеснение) — не верим им
+        if last_seen_seq is not None and last_seen_seq > head:
+            last_seen_seq = None
+        acked = self.acked(user_id, device_id)
+        stale = acked is not None and acked > head
+        if stale:
+            acked = None
+        if last_seen_seq is None:
+            last_seen_seq = acked
+        if acked is None:
+            # новое устройство держит поток с того места, откуда начинается его replay
+            if last_seen_seq is not None:
+                hold = last_seen_seq
+            else:
+                first = self.r.xrange(self._keys(user_id)[1], count=1)
+                hold = int(first[0][0].split("-", 1)[0]) - 1 if first else head
+            key = self._acks_key(user_id)
+            pipe = self.r.pipeline(transaction=False)
+            if stale:
+                pipe.hset(key, device_id, f"{hold}:{int(time.time())}")
+            else:
+                pipe.hsetnx(key, device_id, f"{hold}:{int(time.time())}")
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+        return last_seen_seq
+
+    def acked(self, user_id: str, device_id: str = DEFAULT_DEVICE) -> Optional[int]:
+        """Last seq acknowledged by the device, None if it never acknowledged anything."""
+        value = self.r.hget(self._acks_key(user_id), device_id)
+        return int(value.split(":", 1)[0]) if value else None
@@ -1,8 +1,11 @@
 import os
 import redis
+import redis.asyncio as aioredis
 from agents_shared.kafka_client import KafkaClient
 from minio import Minio
 
+from api.services.history_cache import HistoryCache
+
 MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "minio:9000")
 MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
 MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
@@ -10,6 +13,7 @@ MINIO_SECURE = os.getenv("MINIO_SECURE", "false").lower() in ("1","true","yes")
 MINIO_BUCKET = os.getenv("MINIO_BUCKETS", "documents")
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+HISTORY_CACHE_ENABLED = os.getenv("HISTORY_CACHE_ENABLED", "true").lower() in ("1","true","yes")
 
 KAFKA_GROUP_ID = os.getenv("KAFKA_GROUP_ID", "api-group")
 KAFKA_PRODUCE_TOPIC = os.getenv("PRODUCE_TOPIC", "docs.uploaded")
@@ -22,6 +26,11 @@ minio_client = Minio(
 )
 
 redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+# for request handlers running on the event loop
+async_redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
+
+# last messages of each user, shared by the history endpoint and the message persister
+history_cache = HistoryCache(redis_client, async_redis_client) if HISTORY_CACHE_ENABLED else None
 
 kafka_client = KafkaClient(
     group_id=KAFKA_GROUP_ID,
@@ -1,38 +1,67 @@
 import asyncio
 import logging
 import threading
-from collections import deque
-from typing import Dict, Any
+from typing import Dict, Any, List
 from agents_shared.kafka_client import KafkaClient
 from agents_shared.envelope import unwrap_payload_or_legacy
 # use new get_connections to support multiple ws per user
-from .connections import get_connections
+from .connections import get_connections, connected_users
+from .buffers import BufferStore, create_buffer_store
+from .cluster import ConnectionRegistry, NodeChannel
+from .delivery_log import DEFAULT_DEVICE, DeliveryLog, WS_DELIVERY_LOG_ENABLED
+from .waiters import waiters
+from .deps import redis_client
 
-# DB imports
-from sqlmodel import Session
-from db import engine
-from models.message import Message
+# bot replies are stored write-behind, off the delivery path
+from .persistence import persister
 
 logger = logging.getLogger("kafka_ws_bridge")
 
 RESPONSE_TOPIC = "assistant.response"
+# failures the agents report to the user: {"user_id", "correlation_id", "reason", "retryable"}
+ERROR_TOPIC = "chat.error"
 GROUP = "ws-bridge-group"
+# incremental LLM output published by the assistant into RESPONSE_TOPIC
+CHUNK_EVENT = "assistant.response.chunk"
 
 
 class KafkaWSBridge:
-    def __init__(self, bootstrap=None):
+    """
+    Delivers assistant responses from Kafka to WebSocket connections of any gateway replica.
+
+    All replicas consume RESPONSE_TOPIC in one consumer group, so a response arrives at
+    an arbitrary replica. It looks the user up in the :class:`ConnectionRegistry` and
+    either sends to its own connections or publishes the frame to the channel of the
+    replica that holds them.
+
+    Final responses are first appended to the user's :class:`DeliveryLog` and carry a
+    ``msg_seq``; a reconnecting client gets the frames after its ``last_seen_seq``.
+    With the log disabled, responses for users without connections go to the shared
+    :class:`BufferStore` and are flushed when the user connects to any replica.
+
+    HTTP chat requests waiting for a response register their user like a connection
+    (see :meth:`hold`), so the frames reach the replica that holds the request.
+    Failures published to ERROR_TOPIC reach them the same way as ``error`` frames.
+    """
+
+    def __init__(self, bootstrap=None, redis_conn=None, buffers: BufferStore | None = None,
+                 registry: ConnectionRegistry | None = None, log: DeliveryLog | None = None):
         # kafka client runs in its own (threaded) consumer
-        self.client = KafkaClient(group_id=GROUP, topics=[RESPONSE_TOPIC], client_id="ws-bridge")
+        self.client = KafkaClient(group_id=GROUP, topics=[RESPONSE_TOPIC, ERROR_TOPIC], client_id="ws-bridge")
         # message handler will be invoked from the consumer thread
         self.client.on_message = self.on_kafka_message
 
         # will be set to the asyncio event loop used by FastAPI at startup
         self.loop: asyncio.AbstractEventLoop | None = None
 
-        # per-user buffers for messages that arrive before WS is connected
-        self._buffers: Dict[str, deque] = {}
-        self._buffers_lock = threading.Lock()
-        self.max_buffer_messages = 200
+        redis_conn = redis_conn if redis_conn is not None else redis_client
+        # undelivered messages of users that are not connected anywhere
+        self.buffers = buffers if buffers is not None else create_buffer_store(redis_conn)
+        self.registry = registry if registry is not None else ConnectionRegistry(redis_conn)
+        self.channel = NodeChannel(redis_conn, self.registry, self._on_routed)
+        if log is None and WS_DELIVERY_LOG_ENABLED:
+            log = DeliveryLog(redis_conn)
+        self.log = log
 
     def start_in_background(self):
         """
@@ -41,10 +70,94 @@ class KafkaWSBridge:
         """
         # get_running_loop will raise if there is no running loop which helps catch misuses
         self.loop = asyncio.get_running_loop()
+        # routed frames from other replicas + heartbeat
+        self.channel.start()
         # run the blocking kafka consumer in a dedicated daemon thread
         t = threading.Thread(target=self.client.listen_forever, daemon=True)
         t.start()
 
+    def stop(self):
+        """Leave the cluster: stop listening and remove this node's connections from the registry."""
+        self.channel.stop()
+        try:
+            self.registry.unregister_all(connected_users() + waiters.users())
+        except Exception:
+            logger.exception("Failed to unregister connections of node %s", self.registry.node_id)
+
+    def _off_loop(self, fn, *args) -> None:
+        # registry calls go to Redis: never run them on the event loop thread
+        if self.loop is not None:
+            self.loop.run_in_executor(None, fn, *args)
+        else:
+            fn(*args)
+
+    def on_connect(self, user_id: str, conn=None, last_seen_seq: int | None = None) -> None:
+        """Called after a WebSocket of `user_id` was accepted on this node."""
+        self._off_loop(self._register, user_id, conn, last_seen_seq)
+
+    def on_disconnect(self, user_id: str) -> None:
+        self._off_loop(self._unregister, user_id)
+
+    def on_ack(self, user_id: str, seq: int, device_id: str = DEFAULT_DEVICE) -> None:
+        if self.log is not None:
+            self._off_loop(self._ack, user_id, seq, device_id)
+
+    def hold(self, user_id: str) -> None:
+        """An HTTP request on this node waits for a response to `user_id`: route the user's frames here too."""
+        try:
+            self.registry.register(user_id)
+        except Exception:
+            logger.exception("Failed to register waiting request of user %s", user_id)
+
+    def release(self, user_id: str) -> None:
+        self._unregister(user_id)
+
+    def _ack(self, user_id: str, seq: int, device_id: str = DEFAULT_DEVICE) -> None:
+        try:
+            self.log.ack(user_id, seq, device_id)
+        except Exception:
+            logger.exception("Failed to apply ack %s for user %s", seq, user_id)
+
+    def _register(self, user_id: str, conn=None, last_seen_seq: int | None = None) -> None:
+        try:
+            self.registry.register(user_id)
+        except Exception:
+            logger.exception("Failed to register connection of user %s", user_id)
+        # replay/flush after registration so that nothing new is buffered behind it;
+        # a frame may then arrive both live and in the replay — clients skip msg_seq they have seen
+        if self.log is not None and conn is not None:
+            self._replay(user_id, conn, last_seen_seq)
+        else:
+            self.flush_user(user_id)
+
+    def _replay(self, user_id: str, conn, last_seen_seq: int | None) -> None:
+        try:
+            head = self.log.head(user_id)
+            # без last_seen_seq продолжаем с последнего ack этого устройства; сами ничего не подтверждаем
+            last_seen_seq = self.log.attach(user_id, conn.device_id, last_seen_seq)
+            frames = self.log.since(user_id, last_seen_seq)
+        except Exception:
+            logger.exception("Failed to read delivery log of user %s", user_id)
+            return
+        # head_seq идёт первым даже без пропущенных кадров: клиент с номером выше него
+        # пережил сброс счётчика и иначе отбрасывал бы все новые ответы как уже виденные
+        frames.insert(0, {"type": "resume", "head_seq": head})
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._send_replay, conn, frames)
+
+    @staticmethod
+    def _send_replay(conn, frames: List[Dict[str, Any]]) -> None:
+        # only the reconnecting connection needs the missed frames
+        for frame in frames:
+            if not conn.send(frame, buffer=False):
+                break
+
+    def _unregister(self, user_id: str) -> None:
+        try:
+            self.registry.unregister(user_id)
+        except Exception:
+            logger.exception("Failed to unregister connection of user %s", user_id)
+
     def _schedule_create_task(self, coro):
         """Helper to create a task on the event loop thread; used with call_soon_threadsafe(callback, coro)."""
         asyncio.create_task(coro)
@@ -58,16 +171,89 @@ class KafkaWSBridge:
             "reply": payload.get("reply"),
         }
 
+    def _prepare_chunk(self, envelope: Dict[str, Any]) -> Dict[str, Any]:
+        # chunk frames carry no text/reply keys so clients unaware of streaming simply ignore them
+        payload = envelope.get("payload", {}) or {}
+        return {
+            "type": "chunk",
+            "correlation_id": envelope.get("correlation_id"),
+            "seq": payload.get("seq"),
+            "delta": payload.get("delta") or "",
+        }
+
+    def _route(self, user_id: str, frame: Dict[str, Any], buffer: bool = True) -> None:
+        """
+        Send `frame` to every replica holding connections of `user_id`.
+        With buffer=False (streamed chunks) the frame is dropped when the user is offline.
+        """
+        try:
+            nodes = self.registry.nodes_for(user_id)
+        except Exception:
+            # реестр недоступен — доставляем хотя бы локальным соединениям
+            logger.exception("Connection registry lookup failed for user %s", user_id)
+            nodes = [self.registry.node_id]
+
+        delivered = False
+        for node in nodes:
+            if node == self.registry.node_id:
+                self._deliver_local(user_id, frame, buffer)
+                delivered = True
+            else:
+                try:
+                    delivered = self.channel.publish(node, {"user_id": user_id, "frame": frame, "buffer": buffer}) or delivered
+                except Exception:
+                    logger.exception("Failed to route message for user %s to node %s", user_id, node)
+        if not delivered and buffer:
+            logger.debug("No active WS for user %s, buffering", user_id)
+            self._buffer_message(user_id, frame)
+
+    def _on_routed(self, message: Dict[str, Any]) -> None:
+        # frame published to this node by another replica
+        self._deliver_local(message["user_id"], message["frame"], message.get("buffer", True))
+
+    def _deliver_local(self, user_id: str, frame: Dict[str, Any], buffer: bool = True) -> None:
+        # Ensure we have the loop reference
+        if not self.loop:
+            # not started yet - buffer the message
+            logger.debug("Loop not ready, buffering message for user %s", user_id)
+            if buffer:
+                self._buffer_message(user_id, frame)
+            return
+
+        # connections and their send queues belong to the loop thread
+        try:
+            self.loop.call_soon_threadsafe(self._fan_out, user_id, frame, buffer)
+        except Exception:
+            logger.exception("Failed to schedule send for user %s", user_id)
+            if buffer:
+                self._buffer_message(user_id, frame)
+
+    def _fan_out(self, user_id: str, frame: Dict[str, Any], buffer: bool) -> None:
+        """Runs on the loop: put the frame into the send queue of every connection of the user."""
+        accepted = waiters.deliver(frame)
+        for conn in get_connections(user_id):
+            accepted += conn.send(frame, buffer)
+        if not accepted and buffer:
+            # the connection closed after the registry lookup
+            self.loop.run_in_executor(None, self._buffer_message, user_id, frame)
+
     def _buffer_message(self, user_id: str, msg: Dict[str, Any]):
-        with self._buffers_lock:
-            q = self._buffers.get(user_id)
-            if q is None:
-                q = deque()
-                self._buffers[user_id] = q
-            q.append(msg)
-            # trim if buffer grows too large
-            while len(q) > self.max_buffer_messages:
-                q.popleft()
+        try:
+            self.buffers.append(user_id, msg)
+        except Exception:
+            logger.exception("Failed to buffer message for user %s", user_id)
+
+    def rebuffer(self, user_id: str, frames: List[Dict[str, Any]]) -> None:
+        """Frames queued on a connection that closed before sending them go back in front of the buffer."""
+        # with the delivery log they are replayed on reconnect
+        if self.log is None:
+            self._off_loop(self._requeue, user_id, frames)
+
+    def _requeue(self, user_id: str, frames: List[Dict[str, Any]]) -> None:
+        try:
+            self.buffers.requeue(user_id, frames)
+        except Exception:
+            logger.exception("Failed to re-buffer %d messages for user %s", len(frames), user_id)
 
     def flush_user(self, user_id: str) -> None:
         """
@@ -83,47 +269,35 @@ class KafkaWSBridge:
         self.loop.call_soon_threadsafe(self._schedule_create_task, self._flush_user_async(user_id))
 
     async def _flush_user_async(self, user_id: str):
-        # pop buffer under lock
-        with self._buffers_lock:
-            q = self._buffers.pop(user_id, None)
+        # the store may be remote: take the buffer off the loop thread
+        try:
+            q: List[Dict[str, Any]] = await asyncio.to_thread(self.buffers.pop_all, user_id)
+        except Exception:
+            logger.exception("Failed to read buffered messages for user %s", user_id)
+            return
         if not q:
             return
 
         conns = get_connections(user_id)
         if not conns:
             # connection vanished — re-buffer messages
-            with self._buffers_lock:
-                self._buffers.setdefault(user_id, deque()).extendleft(reversed(q))
+            await asyncio.to_thread(self._requeue, user_id, q)
             return
 
-        # send buffered messages sequentially to all connections; on failure, re-buffer remaining
-        try:
-            while q:
-                msg = q.popleft()
-                # attempt to send to all connections; if any fails, re-buffer for retry
-                failed = False
-                for conn in list(conns):
-                    try:
-                        await conn.send_json(msg)
-                    except Exception:
-                        logger.exception("Failed to send buffered message to user %s on conn %s", user_id, conn)
-                        failed = True
-                if failed:
-                    # put current msg and remaining back to buffer and stop
-                    with self._buffers_lock:
-                        dq = self._buffers.setdefault(user_id, deque())
-                        dq.appendleft(msg)
-                        while q:
-                            dq.appendleft(q.pop())
-                    return
-        except Exception:
-            logger.exception("Unexpected error while flushing buffer for user %s", user_id)
+        # queue buffered messages on every connection; a connection that fails re-buffers what it did not send
+        for conn in conns:
+            for msg in q:
+                if not conn.send(msg):
+                    break
 
     def on_kafka_message(self, topic: str, value: Dict[str, Any], key: str | None):
         """
-        Called from Kafka consumer thread. Schedule sending or buffer if no connection.
-        Also persist bot message into DB.
+        Called from Kafka consumer thread. Route to the replica(s) holding the user's connections or buffer.
+        Also queue the bot message for the write-behind persister.
         """
+        if topic == ERROR_TOPIC:
+            self._on_error(value)
+            return
         try:
             envelope, _ = unwrap_payload_or_legacy(value)
         except Exception:
@@ -136,52 +310,54 @@ class KafkaWSBridge:
             logger.debug("Received envelope without user_id: %s", envelope)
             return
 
-        out_msg = self._prepare_outgoing(envelope)
-
-        # Persist message to DB (do not block delivery on DB errors)
-        try:
-            text = (envelope.get("payload") or {}).get("text") or (envelope.get("payload") or {}).get("reply")
-            with Session(engine) as session:
-                m = Message(user_id=str(user_id), correlation_id=envelope.get("correlation_id"), direction="bot", text=text, payload=envelope.get("payload"))
-                session.add(m)
-                session.commit()
-        except Exception:
-            logger.exception("Failed to persist message for user %s", user_id)
-
-        # Ensure we have the loop reference
-        if not self.loop:
-            # not started yet - buffer the message
-            logger.debug("Loop not ready, buffering message for user %s", user_id)
-            self._buffer_message(user_id, out_msg)
+        if envelope.get("event") == CHUNK_EVENT:
+            # chunks are neither persisted nor buffered: the final assistant.response carries the full text
+            self._route(user_id, self._prepare_chunk(envelope), buffer=False)
             return
 
-        # try to get active connections
-        conns = get_connections(user_id)
-        if not conns:
-            logger.debug("No active WS for user %s, buffering", user_id)
-            self._buffer_message(user_id, out_msg)
+        # deliver first: the DB write is queued and never delays the socket
+        frame = self._prepare_outgoing(envelope)
+        seq = self._log_frame(user_id, frame)
+        if seq is None:
+            self._route(user_id, frame)
+        else:
+            # the log keeps the frame for offline users: nothing to buffer
+            self._route(user_id, dict(frame, msg_seq=seq), buffer=False)
+        self._persist(user_id, envelope)
+
+    def _on_error(self, value: Dict[str, Any]) -> None:
+        user_id = value.get("user_id") if isinstance(value, dict) else None
+        if not user_id:
+            logger.debug("Received chat error without user_id: %s", value)
             return
+        frame = {
+            "type": "error",
+            "correlation_id": value.get("correlation_id"),
+            "reason": value.get("reason"),
+            "retryable": bool(value.get("retryable")),
+        }
+        # ошибка нужна только тем, кто ждёт ответ сейчас: в лог и буфер она не попадает
+        self._route(user_id, frame, buffer=False)
 
-        # schedule sending on the captured loop
-        async def _send_to_all():
-            failed_any = False
-            for conn in list(conns):
-                try:
-                    await conn.send_json(out_msg)
-                except Exception:
-                    logger.exception("Failed to send envelope to user %s on conn %s", user_id, conn)
-                    failed_any = True
-            if failed_any:
-                # buffer for retry
-                self._buffer_message(user_id, out_msg)
+    def _log_frame(self, user_id: str, frame: Dict[str, Any]) -> int | None:
+        if self.log is None:
+            return None
+        try:
+            return self.log.append(user_id, frame)
+        except Exception:
+            logger.exception("Failed to append to delivery log of user %s; falling back to buffering", user_id)
+            return None
 
-        # schedule create_task in a thread-safe way
+    def _persist(self, user_id: str, envelope: Dict[str, Any]) -> None:
+        # blocks only when the DB falls behind, which throttles the consumer (backpressure)
+        payload = envelope.get("payload") or {}
         try:
-            # schedule by passing callback and coroutine as arg
-            self.loop.call_soon_threadsafe(self._schedule_create_task, _send_to_all())
+            persister.submit(
+                user_id, "bot", text=payload.get("text") or payload.get("reply"),
+                correlation_id=envelope.get("correlation_id"), payload=envelope.get("payload"),
+            )
         except Exception:
-            logger.exception("Failed to schedule send task for user %s, buffering", user_id)
-            self._buffer_message(user_id, out_msg)
+            logger.exception("Failed to queue message for user %s", user_id)
 
 
 bridge = KafkaWSBridge()
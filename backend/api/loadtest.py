@@ -0,0 +1,362 @@
+"""WebSocket gateway load test.
+
+    python -m api.loadtest [--clients 2000] [--rate 500] [--duration 30] [--chunks 0]
+    python -m api.loadtest --target ws://gateway:8000 --fake-assistant [...]
+
+Opens ``clients`` WebSockets to ``/api/chat/{user_id}`` (at most ``connect-rate`` new
+connections per second), then sends ``rate`` messages per second in total, spread over
+the clients, for ``duration`` seconds. Every message is answered by a synthetic
+assistant after ``reply-delay`` seconds, optionally preceded by ``chunks`` streamed
+chunks; the client measures the time from sending to receiving the final response.
+
+By default the gateway runs in this process on a local port with in-memory transports:
+user.message goes to an in-memory assistant instead of Kafka, its responses are fed
+straight into the bridge, the connection registry and the offline buffers are local
+and nothing is persisted, so no Kafka, Redis or Postgres is needed. With ``--target``
+a running gateway is loaded instead; ``--fake-assistant`` then answers user.message
+from Kafka with synthetic assistant.response events.
+
+Reported: connect time percentiles and failures, delivery latency percentiles,
+messages without an answer, frames dropped or clients disconnected by the gateway
+(in-process only) and resident memory per connection (in-process: both sides).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import queue
+import random
+import resource
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("loadtest")
+
+RESPONSE_EVENT = "assistant.response"
+CHUNK_EVENT = "assistant.response.chunk"
+
+
+def _percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def _raise_fd_limit(needed: int) -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        target = hard if hard == resource.RLIM_INFINITY else min(hard, needed)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        if target < needed:
+            logger.warning("Open file limit is %d; %d connections may fail", target, needed)
+
+
+def _answer(user_envelope: Dict[str, Any], chunks: int) -> List[Dict[str, Any]]:
+    """Synthetic assistant output for one user.message: chunks, then the final response."""
+    payload = user_envelope.get("payload") or {}
+    base = {
+        "user_id": user_envelope.get("user_id"),
+        "session_id": user_envelope.get("session_id"),
+        "correlation_id": user_envelope.get("correlation_id"),
+        "source": "loadtest-assistant",
+    }
+    text = f"re: {payload.get('text')}"
+    events = [dict(base, event=CHUNK_EVENT, payload={"seq": i, "delta": text[i::chunks]}) for i in range(chunks)]
+    events.append(dict(base, event=RESPONSE_EVENT, payload={"text": text, "reply": text}))
+    return events
+
+
+class InMemoryAssistant:
+    """
+    Stands in for Kafka and the assistant: produce() accepts user.message envelopes and
+    one consumer thread feeds the answers to the bridge after ``delay`` seconds, the
+    way the Kafka listener thread does.
+    """
+
+    def __init__(self, bridge, delay: float, chunks: int):
+        self.bridge = bridge
+        self.delay = delay
+        self.chunks = chunks
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="loadtest-assistant", daemon=True)
+
+    def produce(self, topic: str, value: Dict[str, Any], key: Optional[str] = None, flush: bool = True):
+        self._queue.put((time.monotonic() + self.delay, value))
+
+    def flush(self):
+        pass
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        # задержка у всех ответов одинаковая, поэтому очередь упорядочена по времени ответа
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            due, envelope = item
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            for event in _answer(envelope, self.chunks):
+                self.bridge.on_kafka_message(RESPONSE_EVENT, event, event["correlation_id"])
+
+
+class _LocalRegistry:
+    """Single-node ConnectionRegistry without Redis."""
+
+    def __init__(self, node_id: str = "loadtest"):
+        self.node_id = node_id
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def register(self, user_id):
+        with self._lock:
+            self._counts[user_id] = self._counts.get(user_id, 0) + 1
+
+    def unregister(self, user_id):
+        with self._lock:
+            if self._counts.get(user_id, 0) <= 1:
+                self._counts.pop(user_id, None)
+            else:
+                self._counts[user_id] -= 1
+
+    def unregister_all(self, user_ids):
+        with self._lock:
+            self._counts.clear()
+
+    def nodes_for(self, user_id):
+        return [self.node_id] if self._counts.get(user_id) else []
+
+
+class _NullPersister:
+    def submit(self, *args, **kwargs) -> bool:
+        return True
+
+
+async def _serve_in_process(args):
+    """Start the chat router on a local port with in-memory transports; returns (url, stop coroutine)."""
+    import uvicorn
+    from fastapi import FastAPI
+
+    from api import kafka_ws_bridge
+    from api.buffers import LocalBufferStore
+    from api.routes import chat
+
+    bridge = kafka_ws_bridge.bridge
+    bridge.registry = _LocalRegistry()
+    bridge.buffers = LocalBufferStore()
+    bridge.log = None
+    # the Kafka listener and the Redis node channel are not started
+    bridge.loop = asyncio.get_running_loop()
+    assistant = InMemoryAssistant(bridge, args.reply_delay, args.chunks)
+    chat.producer = assistant
+    chat.persister = kafka_ws_bridge.persister = _NullPersister()
+    assistant.start()
+
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/api")
+    config = uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning",
+                            backlog=max(2048, args.connect_rate), ws_ping_interval=None)
+    server = uvicorn.Server(config)
+    task = asyncio.get_running_loop().create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    async def stop():
+        server.should_exit = True
+        await task
+        assistant.stop()
+
+    return f"ws://127.0.0.1:{port}", stop
+
+
+def _start_fake_assistant(args):
+    """Answer user.message from Kafka with synthetic assistant.response events (for --target)."""
+    from agents_shared.kafka_client import KafkaClient
+
+    client = KafkaClient(group_id="loadtest-assistant", topics=["user.message"], client_id="loadtest-assistant")
+    pending: "queue.Queue[tuple]" = queue.Queue()
+
+    def on_message(topic, value, key):
+        pending.put((time.monotonic() + args.reply_delay, value))
+
+    def answer():
+        while True:
+            due, envelope = pending.get()
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            events = _answer(envelope, args.chunks)
+            for event in events:
+                client.produce(RESPONSE_EVENT, event, key=event["correlation_id"], flush=event is events[-1])
+
+    client.on_message = on_message
+    threading.Thread(target=client.listen_forever, name="loadtest-kafka", daemon=True).start()
+    threading.Thread(target=answer, name="loadtest-answers", daemon=True).start()
+
+
+class Stats:
+    def __init__(self):
+        self.connect_seconds: List[float] = []
+        self.connect_failures = 0
+        self.latencies: List[float] = []
+        self.sent = 0
+        self.chunks = 0
+        self.closed_by_server = 0
+        self.pending: Dict[str, float] = {}
+
+
+async def _client(index: int, url: str, args, stats: Stats, start_at: float, stop_at: float, ready: asyncio.Event):
+    import websockets
+
+    await asyncio.sleep(max(0.0, start_at - time.monotonic()))
+    user_id = f"{args.user_prefix}{index}"
+    started = time.monotonic()
+    try:
+        ws = await websockets.connect(f"{url}/api/chat/{user_id}", open_timeout=30, ping_interval=None,
+                                      compression="deflate" if args.deflate else None, max_queue=None)
+    except Exception:
+        stats.connect_failures += 1
+        return
+    stats.connect_seconds.append(time.monotonic() - started)
+
+    async def reader():
+        async for raw in ws:
+            frame = json.loads(raw)
+            if frame.get("type") == "chunk":
+                stats.chunks += 1
+                continue
+            text = frame.get("text") or ""
+            sent_at = stats.pending.pop(text[4:], None) if text.startswith("re: ") else None
+            if sent_at is not None:
+                stats.latencies.append(time.monotonic() - sent_at)
+
+    read_task = asyncio.get_running_loop().create_task(reader())
+    try:
+        await ready.wait()
+        # каждый клиент шлёт с интервалом clients / rate; случайная фаза разносит клиентов по времени
+        interval = args.clients / args.rate
+        next_at = time.monotonic() + random.uniform(0, interval)
+        n = 0
+        while next_at < stop_at and not read_task.done():
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+            next_at += interval
+            token = f"{user_id}:{n}"
+            stats.pending[token] = time.monotonic()
+            await ws.send(json.dumps({"message": {"text": token}}))
+            stats.sent += 1
+            n += 1
+        # ждём оставшиеся ответы
+        await asyncio.sleep(args.drain)
+    except Exception:
+        pass
+    finally:
+        if read_task.done():
+            # читатель завершился раньше времени — сервер закрыл соединение
+            stats.closed_by_server += 1
+        read_task.cancel()
+        await ws.close()
+
+
+def _gateway_counters() -> Dict[str, float]:
+    from api import connections
+
+    return {
+        "dropped": sum(connections._dropped.value(reason=r) for r in ("slow_consumer", "closed")),
+        "slow_disconnects": connections._slow_disconnects.value(),
+    }
+
+
+async def _run(args):
+    stop_server = None
+    if args.target:
+        url = args.target.rstrip("/")
+        if args.fake_assistant:
+            _start_fake_assistant(args)
+    else:
+        url, stop_server = await _serve_in_process(args)
+
+    stats = Stats()
+    ready = asyncio.Event()
+    rss_before = _rss_bytes()
+    loop_started = time.monotonic()
+    connect_window = args.clients / args.connect_rate
+    stop_at = loop_started + connect_window + args.duration
+    tasks = [
+        asyncio.get_running_loop().create_task(
+            _client(i, url, args, stats, loop_started + i / args.connect_rate, stop_at, ready))
+        for i in range(args.clients)
+    ]
+    # нагрузка начинается, когда все клиенты подключены (или не смогли)
+    while len(stats.connect_seconds) + stats.connect_failures < args.clients:
+        await asyncio.sleep(0.1)
+    connected = len(stats.connect_seconds)
+    rss_connected = _rss_bytes()
+    ready.set()
+    load_started = time.monotonic()
+    await asyncio.gather(*tasks)
+    load_seconds = time.monotonic() - load_started - args.drain
+
+    counters = _gateway_counters() if stop_server is not None else None
+    if stop_server is not None:
+        await stop_server()
+
+    ms = 1000
+    print(f"clients:    {connected}/{args.clients} connected, {stats.connect_failures} failed, "
+          f"connect p50 {_percentile(stats.connect_seconds, 0.5) * ms:.1f} ms, "
+          f"p99 {_percentile(stats.connect_seconds, 0.99) * ms:.1f} ms")
+    print(f"messages:   {stats.sent} sent ({stats.sent / max(load_seconds, 1e-9):.0f}/s), "
+          f"{len(stats.latencies)} answered, {len(stats.pending)} unanswered, {stats.chunks} chunks")
+    print(f"latency:    p50 {_percentile(stats.latencies, 0.5) * ms:.1f} ms, p95 {_percentile(stats.latencies, 0.95) * ms:.1f} ms, "
+          f"p99 {_percentile(stats.latencies, 0.99) * ms:.1f} ms, max {max(stats.latencies, default=float('nan')) * ms:.1f} ms "
+          f"(reply delay {args.reply_delay * ms:.0f} ms)")
+    if counters is not None:
+        print(f"gateway:    {counters['dropped']:.0f} frames dropped, {counters['slow_disconnects']:.0f} slow consumers disconnected, "
+              f"{stats.closed_by_server} clients closed by the server")
+    scope = "client side only" if args.target else "client + gateway"
+    print(f"memory:     {(rss_connected - rss_before) / max(connected, 1) / 1024:.1f} KB per connection ({scope})")
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--connect-rate", type=int, default=500, help="new connections per second")
+    parser.add_argument("--rate", type=float, default=500, help="messages per second over all clients")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load after all clients connected")
+    parser.add_argument("--reply-delay", type=float, default=0.05, help="synthetic assistant latency, seconds")
+    parser.add_argument("--chunks", type=int, default=0, help="streamed chunks before each final response")
+    parser.add_argument("--drain", type=float, default=5, help="seconds to wait for the last answers")
+    parser.add_argument("--deflate", action="store_true", help="negotiate permessage-deflate")
+    parser.add_argument("--user-prefix", default="load-")
+    parser.add_argument("--port", type=int, default=0, help="in-process gateway port (0: any free port)")
+    parser.add_argument("--target", help="load a running gateway, e.g. ws://localhost:8000")
+    parser.add_argument("--fake-assistant", action="store_true",
+                        help="with --target: answer user.message from Kafka with synthetic responses")
+    args = parser.parse_args()
+    # клиент и сервер в одном процессе: по два дескриптора на соединение
+    _raise_fd_limit(args.clients * (1 if args.target else 2) + 256)
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
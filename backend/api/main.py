@@ -1,13 +1,17 @@
+import asyncio
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from agents_shared.metrics import render_metrics
 from .routes import files, chat
 
-from db import init_db
+from db import init_db, dispose_engines
 from contextlib import asynccontextmanager
 
 # import bridge so we can start it on app startup
 from api.kafka_ws_bridge import bridge
+from api.persistence import persister
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -16,13 +20,19 @@ async def lifespan(app: FastAPI):
         init_db()
     except Exception:
         pass
+    # start write-behind message persister before the bridge starts producing rows
+    persister.start()
     # start Kafka consumer bridge
     try:
         bridge.start_in_background()
     except Exception:
         pass
     yield
-    # shutdown logic can be added here if needed
+    # leave the gateway cluster so that other replicas stop routing to this node
+    await asyncio.to_thread(bridge.stop)
+    # write out queued chat messages before exit
+    await asyncio.to_thread(persister.stop)
+    await dispose_engines()
 
 app = FastAPI(title="Multi-Agent GreenTech Lawyer Backend", lifespan=lifespan)
 
@@ -41,5 +51,9 @@ app.include_router(chat.router, prefix="/api")
 async def health():
     return {"status": "ok"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return render_metrics()
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
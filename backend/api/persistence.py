@@ -0,0 +1,200 @@
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+from sqlalchemy import insert
+from sqlmodel import Session
+
+from agents_shared.metrics import counter, gauge, histogram
+from api.deps import history_cache
+from api.services.history_cache import HistoryCache
+from api.services.history_service import encode_cursor, history_item
+from db import engine
+from models.message import Message
+
+logger = logging.getLogger("message_persister")
+
+PERSIST_BATCH_SIZE = int(os.getenv("MESSAGE_PERSIST_BATCH_SIZE", "200"))
+PERSIST_FLUSH_INTERVAL = float(os.getenv("MESSAGE_PERSIST_FLUSH_INTERVAL", "0.2"))
+PERSIST_QUEUE_SIZE = int(os.getenv("MESSAGE_PERSIST_QUEUE_SIZE", "10000"))
+# how long submit() waits for room in a full queue before dropping the row
+PERSIST_SUBMIT_TIMEOUT = float(os.getenv("MESSAGE_PERSIST_SUBMIT_TIMEOUT", "5"))
+PERSIST_MAX_RETRIES = int(os.getenv("MESSAGE_PERSIST_MAX_RETRIES", "5"))
+
+_batch_size = histogram(
+    "api_message_persist_batch_size", "Rows written per message batch",
+    buckets=(1, 5, 10, 25, 50, 100, 200, 500, 1000),
+)
+_flush_seconds = histogram("api_message_persist_flush_seconds", "Time to insert one message batch")
+_lag_seconds = histogram("api_message_persist_lag_seconds", "Time from submit to commit of a message")
+_queue_depth = gauge("api_message_persist_queue_depth", "Messages waiting to be written")
+_rows = counter("api_message_persist_rows_total", "Messages handled by the write-behind persister", ["status"])
+
+_STOP = object()
+
+
+class MessagePersister:
+    """
+    Write-behind storage for chat messages.
+
+    submit() only puts a row into a bounded queue; a background thread inserts rows in
+    batches of up to ``batch_size`` or every ``flush_interval`` seconds, whichever comes
+    first, as one multi-row INSERT. When the database is slow the queue fills up and
+    submit() blocks the caller (the Kafka consumer thread) for up to ``submit_timeout``,
+    which slows down consumption instead of growing memory. stop() drains the queue.
+
+    Accepted messages are also pushed to the per-user :class:`HistoryCache` right away,
+    so the chat history endpoint sees them before the batch reaches Postgres; every
+    push is settled once its row is written, dropped or has finally failed.
+    """
+
+    def __init__(self, batch_size: int = PERSIST_BATCH_SIZE, flush_interval: float = PERSIST_FLUSH_INTERVAL,
+                 queue_size: int = PERSIST_QUEUE_SIZE, submit_timeout: float = PERSIST_SUBMIT_TIMEOUT,
+                 max_retries: int = PERSIST_MAX_RETRIES, bind=None, cache: Optional[HistoryCache] = None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.submit_timeout = submit_timeout
+        self.max_retries = max_retries
+        self.bind = bind if bind is not None else engine
+        self.cache = cache
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # id строк, учтённых в кэше как незаписанные (push удался)
+        self._pushed: set = set()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="message-persister", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Flush everything queued so far and stop the writer thread."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.error("Message persister did not drain within %.1fs; %d messages left", timeout, self._queue.qsize())
+
+    def submit(self, user_id: str, direction: str, text: Optional[str] = None,
+               correlation_id: Optional[str] = None, payload: Optional[Dict[str, Any]] = None) -> bool:
+        """Queue one message; returns False if it was dropped because the queue stayed full."""
+        row = {
+            "id": uuid4(),
+            "user_id": str(user_id),
+            "correlation_id": correlation_id,
+            "direction": direction,
+            "text": text,
+            "payload": payload,
+            # время фиксируется при приёме, а не при записи — порядок истории не зависит от батчей
+            "created_at": datetime.now(timezone.utc),
+        }
+        # до постановки в очередь: пересборка кэша увидит сообщение как незаписанное
+        if self.cache is not None and self.cache.push(
+            row["user_id"], encode_cursor(row["created_at"], row["id"]),
+            history_item(row["id"], direction, text, payload, row["created_at"]),
+        ):
+            self._pushed.add(row["id"])
+        if self._thread is None:
+            # writer not started (scripts, tests) — write synchronously
+            return self._write([(row, time.monotonic())])
+        try:
+            self._queue.put((row, time.monotonic()), timeout=self.submit_timeout)
+        except queue.Full:
+            _rows.inc(status="dropped")
+            logger.error("Message queue is full for %.1fs; dropping message for user %s", self.submit_timeout, user_id)
+            self._settle([row], written=False)
+            return False
+        _queue_depth.set(self._queue.qsize())
+        return True
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch: List = []
+            deadline = None
+            while len(batch) < self.batch_size:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    # всё, что успели поставить до stop(), дописываем
+                    batch.extend(self._drain())
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            _queue_depth.set(self._queue.qsize())
+            for i in range(0, len(batch), self.batch_size):
+                self._write(batch[i:i + self.batch_size])
+
+    def _drain(self) -> List:
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return items
+            if item is not _STOP:
+                items.append(item)
+
+    def _settle(self, rows: List[Dict[str, Any]], written: bool) -> None:
+        if self.cache is None:
+            return
+        counts: Dict[str, int] = {}
+        for row in rows:
+            if row["id"] in self._pushed:
+                self._pushed.discard(row["id"])
+                counts[row["user_id"]] = counts.get(row["user_id"], 0) + 1
+            elif not written:
+                counts.setdefault(row["user_id"], 0)
+        self.cache.settle(counts, written)
+
+    def _write(self, batch: List) -> bool:
+        if not batch:
+            return True
+        rows = [row for row, _ in batch]
+        delay = 0.5
+        for attempt in range(1, self.max_retries + 1):
+            started = time.monotonic()
+            try:
+                with Session(self.bind) as session:
+                    # executemany одного INSERT — драйвер отправляет многострочную вставку
+                    session.execute(insert(Message), rows)
+                    session.commit()
+            except Exception:
+                if attempt == self.max_retries:
+                    _rows.inc(len(rows), status="failed")
+                    logger.exception("Failed to persist %d messages after %d attempts", len(rows), attempt)
+                    self._settle(rows, written=False)
+                    return False
+                logger.warning("Message batch insert failed (attempt %d), retrying in %.1fs", attempt, delay, exc_info=True)
+                time.sleep(delay)
+                delay = min(delay * 2, 10.0)
+                continue
+            now = time.monotonic()
+            _flush_seconds.observe(now - started)
+            _batch_size.observe(len(rows))
+            for _, submitted in batch:
+                _lag_seconds.observe(now - submitted)
+            _rows.inc(len(rows), status="written")
+            self._settle(rows, written=True)
+            return True
+        return False
+
+
+persister = MessagePersister(cache=history_cache)
@@ -1,25 +1,41 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from agents_shared.kafka_client import KafkaClient
 from agents_shared.envelope import create_envelope, validate_envelope
 from api.connections import save_connection, drop_connection
+from api.delivery_log import DEFAULT_DEVICE
 from api.kafka_ws_bridge import bridge
-from sqlmodel import Session, select
-from db import engine
-from models.message import Message
+from api.wire import WireProtocol, negotiate, slim_frame
+from api.waiters import waiters, CHAT_HTTP_TIMEOUT, CHAT_HTTP_MAX_TIMEOUT
+from api.schemas import ChatAskReq
+from api.deps import history_cache
+from api.persistence import persister
+from api.services.history_service import HistoryService, InvalidCursor, HISTORY_DEFAULT_LIMIT, HISTORY_MAX_LIMIT
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db import get_async_session
 import asyncio
+import json
 import logging
+import os
+import time
+import uuid
 
 router = APIRouter()
+history_service = HistoryService(history_cache)
+
+# pages with at least this many messages are streamed
+HISTORY_STREAM_THRESHOLD = int(os.getenv("HISTORY_STREAM_THRESHOLD", "100"))
 
 REQUEST_TOPIC = "user.message"
 producer = KafkaClient(group_id="api-producer-group", topics=[], client_id="api-producer")
 
 
-def _produce_sync(message: dict, user_id: str):
+def _produce_sync(message: dict, user_id: str, correlation_id: str | None = None):
     """
     Вынесенная синхронная функция — она будет выполняться в отдельном потоке
     чтобы не блокировать asyncio event loop.
     message expected to be a dict containing at least 'text' and optional 'documents' list.
+    Returns the produced envelope, None if it was invalid.
     """
     # normalize payload
     payload = {}
@@ -40,6 +56,7 @@ def _produce_sync(message: dict, user_id: str):
         source="ws-gateway",
         event="user.message",
         payload=payload,
+        correlation_id=correlation_id,
     )
 
     # optional validation
@@ -47,37 +64,55 @@ def _produce_sync(message: dict, user_id: str):
         validate_envelope(envelope)
     except Exception:
         logging.exception("Invalid envelope")
-        return
+        return None
 
     producer.produce(
         REQUEST_TOPIC,
         envelope,
         key=envelope["correlation_id"]
     )
+    return envelope
+
+
+async def _receive(websocket: WebSocket, protocol: WireProtocol):
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    return protocol.decode(message)
 
 
 @router.websocket("/chat/{user_id}")
-async def chat_ws(websocket: WebSocket, user_id: str):
-    await websocket.accept()
-    save_connection(user_id, websocket)
+async def chat_ws(websocket: WebSocket, user_id: str, last_seen_seq: int | None = None,
+                  device_id: str = DEFAULT_DEVICE):
+    # clients offering the chat.v2.* subprotocols get slim, batched (optionally msgpack) frames;
+    # permessage-deflate is negotiated by the server (uvicorn --ws-per-message-deflate)
+    protocol = negotiate(websocket.scope.get("subprotocols") or [])
+    await websocket.accept(subprotocol=protocol.subprotocol)
+    # last_seen_seq: the newest msg_seq the client already has; the missed frames are replayed.
+    # device_id: a stable id of the client installation — acks are counted per device
+    conn = save_connection(user_id, websocket, last_seen_seq, protocol, device_id)
 
     try:
         while True:
-            data = await websocket.receive_json()
+            data = await _receive(websocket, protocol)
+            if "ack" in data:
+                # the client received every frame up to this msg_seq
+                try:
+                    bridge.on_ack(user_id, int(data["ack"]), device_id)
+                except (TypeError, ValueError):
+                    conn.send({"error": "invalid ack"}, buffer=False)
+                continue
             message = data.get("message")
 
             if not message:
-                await websocket.send_json({"error": "no message provided"})
+                conn.send({"error": "no message provided"}, buffer=False)
                 continue
 
             try:
-                # persist user message to DB synchronously (don't block loop for long)
+                # queue user message for the write-behind persister (blocks only when its queue is full)
                 try:
                     text = message.get("text") if isinstance(message, dict) else str(message)
-                    with Session(engine) as session:
-                        m = Message(user_id=str(user_id), correlation_id=None, direction="user", text=text, payload=message if isinstance(message, dict) else None)
-                        session.add(m)
-                        session.commit()
+                    await asyncio.to_thread(persister.submit, user_id, "user", text=text, payload=message if isinstance(message, dict) else None)
                 except Exception:
                     logging.exception("Failed to persist user message for user %s", user_id)
 
@@ -85,31 +120,140 @@ async def chat_ws(websocket: WebSocket, user_id: str):
 
             except Exception as e:
                 logging.exception("Kafka produce failed")
-                await websocket.send_json({"error": "internal server error"})
+                conn.send({"error": "internal server error"}, buffer=False)
                 continue
 
     except WebSocketDisconnect:
-        drop_connection(user_id)
+        drop_connection(user_id, websocket)
         logging.info(f"User {user_id} disconnected")
 
 
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+# comment lines keep proxies from closing an idle event stream
+SSE_KEEPALIVE = float(os.getenv("CHAT_SSE_KEEPALIVE", "15"))
+
+
+async def _stream_answer(waiter, user_id: str, timeout: float, started: float):
+    try:
+        yield _sse("accepted", {"correlation_id": waiter.correlation_id})
+        deadline = started + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                waiters.observe("sse", "timeout")
+                yield _sse("timeout", {"correlation_id": waiter.correlation_id})
+                return
+            try:
+                frame = await waiter.next(min(remaining, SSE_KEEPALIVE))
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if frame.get("type") == "chunk":
+                yield _sse("chunk", frame)
+                continue
+            if frame.get("type") == "error":
+                waiters.observe("sse", "error")
+                yield _sse("error", frame)
+                return
+            waiters.observe("sse", "answered", time.monotonic() - started)
+            yield _sse("message", slim_frame(frame))
+            return
+    finally:
+        # also runs when the client goes away mid-stream
+        waiters.close(waiter)
+        await asyncio.to_thread(bridge.release, user_id)
+
+
+@router.post("/chat/{user_id}/messages")
+async def chat_http(
+    user_id: str,
+    req: ChatAskReq,
+    stream: bool = False,
+    timeout: float = Query(CHAT_HTTP_TIMEOUT, gt=0, le=CHAT_HTTP_MAX_TIMEOUT),
+):
+    """
+    Ask without a WebSocket: produces user.message and waits for the assistant.response
+    with the same correlation_id. stream=true answers with Server-Sent Events
+    (chunk events, then the message); otherwise the request long-polls until the
+    answer or the timeout (504; the answer will still appear in the history).
+    A failure reported on chat.error ends the request with 503 (retry later) or 502,
+    or with an SSE error event.
+    """
+    message = req.message
+    correlation_id = str(uuid.uuid4())
+    # the waiter is registered before producing so that even an instant answer finds it
+    waiter = waiters.open(correlation_id, user_id, stream)
+    try:
+        await asyncio.to_thread(bridge.hold, user_id)
+        text = message.get("text") if isinstance(message, dict) else str(message)
+        try:
+            await asyncio.to_thread(persister.submit, user_id, "user", text=text,
+                                    correlation_id=correlation_id, payload=message if isinstance(message, dict) else None)
+        except Exception:
+            logging.exception("Failed to persist user message for user %s", user_id)
+        envelope = await asyncio.to_thread(_produce_sync, message, user_id, correlation_id)
+        if envelope is None:
+            raise HTTPException(status_code=400, detail="invalid message")
+    except BaseException:
+        waiters.close(waiter)
+        await asyncio.to_thread(bridge.release, user_id)
+        raise
+    started = time.monotonic()
+
+    if stream:
+        return StreamingResponse(
+            _stream_answer(waiter, user_id, timeout, started),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    try:
+        frame = await waiter.next(timeout)
+    except asyncio.TimeoutError:
+        waiters.observe("poll", "timeout")
+        raise HTTPException(status_code=504, detail={"correlation_id": correlation_id, "error": "assistant did not answer in time"})
+    finally:
+        waiters.close(waiter)
+        await asyncio.to_thread(bridge.release, user_id)
+    if frame.get("type") == "error":
+        waiters.observe("poll", "error")
+        # 503: агенту не хватило мощности, вопрос можно задать позже; 502: агент не смог ответить
+        raise HTTPException(status_code=503 if frame.get("retryable") else 502,
+                            detail={"correlation_id": correlation_id, "error": frame.get("reason")})
+    waiters.observe("poll", "answered", time.monotonic() - started)
+    return slim_frame(frame)
+
+
+def _stream_page(page: dict):
+    # большие страницы отдаются по сообщению, без сборки всего JSON в памяти
+    yield '{"user_id": ' + json.dumps(page["user_id"])
+    for field in ("before", "after", "has_more"):
+        yield f', "{field}": ' + json.dumps(page[field])
+    yield ', "history": ['
+    for i, item in enumerate(page["history"]):
+        yield ("," if i else "") + json.dumps(item, ensure_ascii=False, default=str)
+    yield "]}"
+
+
 @router.get("/chat/history/{user_id}")
-async def get_chat_history(user_id: str):
-    # Read last 200 messages for this user ordered by created_at asc
+async def get_chat_history(
+    user_id: str,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int = Query(HISTORY_DEFAULT_LIMIT, ge=1, le=HISTORY_MAX_LIMIT),
+    session: AsyncSession = Depends(get_async_session),
+):
+    # Newest `limit` messages (oldest first); `before`/`after` cursors page through the rest
     try:
-        with Session(engine) as session:
-            stmt = select(Message).where(Message.user_id == str(user_id)).order_by(Message.created_at)
-            results = session.exec(stmt).all()
-            history = []
-            for m in results:
-                history.append({
-                    "id": str(m.id),
-                    "type": "user" if m.direction == "user" else "bot",
-                    "text": m.text,
-                    "ts": int(m.created_at.timestamp() * 1000),
-                    "payload": m.payload or {},
-                })
-        return {"user_id": user_id, "history": history}
+        page = await history_service.page(session, user_id, before=before, after=after, limit=limit)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception:
         logging.exception("Failed to load chat history for %s", user_id)
-        return {"user_id": user_id, "history": []}
+        return {"user_id": user_id, "history": [], "before": None, "after": None, "has_more": False}
+    if len(page["history"]) >= HISTORY_STREAM_THRESHOLD:
+        return StreamingResponse(_stream_page(page), media_type="application/json")
+    return page
@@ -4,8 +4,8 @@ import logging
 from redis import Redis
 
 from api.deps import minio_client, MINIO_BUCKET, kafka_client, KAFKA_PRODUCE_TOPIC, get_redis_client
-from api.schemas import UploadReq, NotifyReq
-from api.services.files_service import FilesService
+from api.schemas import UploadReq, NotifyReq, BatchUploadReq, CompleteUploadReq, AbortUploadReq, BatchNotifyReq
+from api.services.files_service import FilesService, UPLOAD_BATCH_MAX
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +15,39 @@ files_service = FilesService(minio_client, MINIO_BUCKET, kafka_client, KAFKA_PRO
 @router.post("/upload-url")
 def get_upload_url(req: UploadReq):
     try:
-        return files_service.create_presigned_url(req.filename)
+        if req.size is None:
+            return files_service.create_presigned_url(req.filename)
+        return files_service.create_upload(req.filename, req.size, req.content_type)
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/upload-urls")
+def get_upload_urls(req: BatchUploadReq):
+    # one call for a whole batch of files; large files get multipart uploads
+    if len(req.files) > UPLOAD_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"at most {UPLOAD_BATCH_MAX} files per request")
+    try:
+        return {"uploads": files_service.create_uploads([(f.filename, f.size, f.content_type) for f in req.files])}
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/complete-upload")
+def complete_upload(req: CompleteUploadReq):
+    parts = [(p.part_number, p.etag) for p in req.parts] if req.parts else None
+    try:
+        return files_service.complete_multipart_upload(req.object_id, req.upload_id, parts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/abort-upload")
+def abort_upload(req: AbortUploadReq):
+    try:
+        return files_service.abort_multipart_upload(req.object_id, req.upload_id)
     except Exception as e:
         logger.error(e)
         raise HTTPException(status_code=500, detail=str(e))
@@ -29,6 +61,15 @@ def notify_upload(msg: NotifyReq, redis_client=Depends(get_redis_client)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/notify-uploads")
+def notify_uploads(msg: BatchNotifyReq, redis_client=Depends(get_redis_client)):
+    if len(msg.uploads) > UPLOAD_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"at most {UPLOAD_BATCH_MAX} files per request")
+    try:
+        return files_service.notify_uploads(msg.uploads, redis_client)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/files-for-session/{session_id}")
 def get_files_for_session(session_id: str, redis_client: Redis = Depends(get_redis_client)):
     return files_service.get_files_for_session(session_id)
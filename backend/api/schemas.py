@@ -1,3 +1,5 @@
+from typing import Any, Dict, List
+
 from pydantic import BaseModel
 
 class UploadRequest(BaseModel):
@@ -9,10 +11,33 @@ class ChatMessage(BaseModel):
     user_id: str
     message: str
 
+class ChatAskReq(BaseModel):
+    # the same message object a WebSocket client sends: {"text": ..., "documents": [...]} or plain text
+    message: Dict[str, Any] | str
+
 class UploadReq(BaseModel):
     filename: str
     user_id: str
     content_type: str
+    # size in bytes; large files get a multipart upload
+    size: int | None = None
+
+class BatchUploadReq(BaseModel):
+    files: List[UploadReq]
+
+class UploadPart(BaseModel):
+    part_number: int
+    etag: str
+
+class CompleteUploadReq(BaseModel):
+    object_id: str
+    upload_id: str
+    # ETags returned by the part uploads; when omitted the parts are listed in storage
+    parts: List[UploadPart] | None = None
+
+class AbortUploadReq(BaseModel):
+    object_id: str
+    upload_id: str
 
 class NotifyReq(BaseModel):
     object_id: str
@@ -21,3 +46,6 @@ class NotifyReq(BaseModel):
     file_id: str | None = None
     content_type: str | None = None
     session_id: str | None = None
+
+class BatchNotifyReq(BaseModel):
+    uploads: List[NotifyReq]
@@ -1,8 +1,13 @@
+import logging
+import math
+import os
 import uuid
 from datetime import timedelta
+from urllib.parse import urlparse, urlunparse
 
 from fastapi import Depends
 from minio import Minio
+from minio.datatypes import Part
 from agents_shared.kafka_client import KafkaClient
 from redis import Redis
 
@@ -11,6 +16,23 @@ from agents_shared.redis_storage import get_active_documents_for_session, add_ac
 
 MINIO_PUBLIC_URL = "http://localhost/minio-api"
 
+# files larger than this are uploaded in parts, each with its own presigned URL
+UPLOAD_MULTIPART_THRESHOLD = int(os.getenv("UPLOAD_MULTIPART_THRESHOLD", str(64 * 1024 * 1024)))
+# S3 requires at least 5 MiB per part (except the last) and at most 10000 parts
+UPLOAD_PART_SIZE = max(int(os.getenv("UPLOAD_PART_SIZE", str(16 * 1024 * 1024))), 5 * 1024 * 1024)
+MAX_UPLOAD_PARTS = 10000
+# files per batch request
+UPLOAD_BATCH_MAX = int(os.getenv("UPLOAD_BATCH_MAX", "100"))
+
+logger = logging.getLogger(__name__)
+
+
+def _public_url(url: str) -> str:
+    # presigned URL of the internal endpoint -> URL behind the public /minio-api proxy
+    parsed = urlparse(url)
+    return urlunparse(parsed._replace(scheme="http", netloc="localhost", path="/minio-api" + parsed.path))
+
+
 class FilesService:
     def __init__(
         self,
@@ -34,28 +56,85 @@ class FilesService:
             object_name=object_id,
             expires=timedelta(seconds=expires),
         )
-        from urllib.parse import urlparse, urlunparse
+        return {"upload_url": _public_url(url), "object_id": object_id, "bucket": self.bucket}
+
+    def create_upload(self, filename: str, size: int | None = None, content_type: str | None = None, expires: int = 3600):
+        """
+        Single presigned PUT, or a presigned multipart upload when the file is larger than
+        UPLOAD_MULTIPART_THRESHOLD. The multipart answer has ``upload_id``, ``part_size`` and
+        ``part_urls`` (part N is uploaded to ``part_urls[N-1]``); the upload is finished with
+        complete_multipart_upload.
+        """
+        if size is None or size <= UPLOAD_MULTIPART_THRESHOLD:
+            return dict(self.create_presigned_url(filename, expires), multipart=False)
+        return self.create_multipart_upload(filename, size, content_type, expires)
 
-        parsed = urlparse(url)
-        public_url = urlunparse(parsed._replace(scheme="http", netloc="localhost", path="/minio-api" + parsed.path))
+    def create_uploads(self, files, expires: int = 3600):
+        """create_upload for every (filename, size, content_type) of a batch, in order."""
+        return [self.create_upload(filename, size, content_type, expires) for filename, size, content_type in files]
 
-        return {"upload_url": public_url, "object_id": object_id, "bucket": self.bucket}
+    def create_multipart_upload(self, filename: str, size: int, content_type: str | None = None, expires: int = 3600):
+        object_id = f"{uuid.uuid4().hex}_{filename}"
+        part_size = max(UPLOAD_PART_SIZE, math.ceil(size / MAX_UPLOAD_PARTS))
+        parts = math.ceil(size / part_size)
+        # у MinIO нет публичного API для presigned multipart — используются S3-вызовы клиента напрямую
+        upload_id = self.minio._create_multipart_upload(
+            self.bucket, object_id, {"Content-Type": content_type or "application/octet-stream"},
+        )
+        part_urls = [
+            _public_url(self.minio.get_presigned_url(
+                "PUT", self.bucket, object_id, expires=timedelta(seconds=expires),
+                extra_query_params={"uploadId": upload_id, "partNumber": str(n)},
+            ))
+            for n in range(1, parts + 1)
+        ]
+        return {
+            "multipart": True,
+            "object_id": object_id,
+            "bucket": self.bucket,
+            "upload_id": upload_id,
+            "part_size": part_size,
+            "part_urls": part_urls,
+        }
 
-    def notify_upload(self, object_id: str, bucket: str, user_id: str, file_id: str | None = None, content_type: str | None = None, session_id: str | None = None, redis_client: Redis = Depends(get_redis_client)):
+    def complete_multipart_upload(self, object_id: str, upload_id: str, parts: list[tuple[int, str]] | None = None):
         """
-        Публикация события об успешной загрузке файла в Kafka.
-        Также, если передан session_id, сразу добавляем файл в активные документы сессии в Redis,
-        чтобы фронт мог получить обновлённый список без ожидания потребителя Kafka.
+        Assemble the uploaded parts. ``parts`` are (part_number, etag) pairs from the part
+        uploads; without them the parts are listed in MinIO.
         """
-        file_id = file_id or object_id
-        payload = {
+        if parts:
+            completed = [Part(number, etag.strip('"')) for number, etag in sorted(parts)]
+        else:
+            listed = self.minio._list_parts(self.bucket, object_id, upload_id, max_parts=MAX_UPLOAD_PARTS)
+            completed = [Part(p.part_number, p.etag) for p in listed.parts]
+        if not completed:
+            raise ValueError("no uploaded parts")
+        self.minio._complete_multipart_upload(self.bucket, object_id, upload_id, completed)
+        return {"status": "ok", "object_id": object_id, "bucket": self.bucket, "parts": len(completed)}
+
+    def abort_multipart_upload(self, object_id: str, upload_id: str):
+        self.minio._abort_multipart_upload(self.bucket, object_id, upload_id)
+        return {"status": "aborted", "object_id": object_id}
+
+    @staticmethod
+    def _uploaded_event(object_id: str, bucket: str, user_id: str, file_id: str | None, content_type: str | None):
+        return {
             "bucket": bucket,
             "object_id": object_id,
             "user_id": user_id,
-            "file_id": file_id,
+            "file_id": file_id or object_id,
             "content_type": content_type
         }
 
+    def notify_upload(self, object_id: str, bucket: str, user_id: str, file_id: str | None = None, content_type: str | None = None, session_id: str | None = None, redis_client: Redis = Depends(get_redis_client)):
+        """
+        Публикация события об успешной загрузке файла в Kafka.
+        Также, если передан session_id, сразу добавляем файл в активные документы сессии в Redis,
+        чтобы фронт мог получить обновлённый список без ожидания потребителя Kafka.
+        """
+        payload = self._uploaded_event(object_id, bucket, user_id, file_id, content_type)
+        file_id = payload["file_id"]
+
         # try to add to redis active docs set synchronously if session_id provided
         try:
             if session_id and redis_client:
@@ -73,6 +152,25 @@ class FilesService:
 
         return {"status": "ok", "file_id": file_id}
 
+    def notify_uploads(self, uploads, redis_client: Redis):
+        """
+        notify_upload for a batch: all docs.uploaded events go to the producer buffer and are
+        flushed once. ``uploads`` are NotifyReq-like objects.
+        """
+        file_ids = []
+        for u in uploads:
+            payload = self._uploaded_event(u.object_id, u.bucket, u.user_id, u.file_id, u.content_type)
+            try:
+                if u.session_id and redis_client:
+                    add_active_document(redis_client, u.session_id, payload["file_id"])
+            except Exception:
+                logger.warning("Failed to add %s to active documents of session %s", payload["file_id"], u.session_id)
+            self.kafka.produce(self.kafka_topic, payload, key=payload["file_id"], flush=False)
+            file_ids.append(payload["file_id"])
+        # один flush на весь пакет: ожидание подтверждения брокера — одно на запрос
+        self.kafka.flush()
+        return {"status": "ok", "file_ids": file_ids}
+
     def get_files_for_session(self, session_id: str, redis_client: Redis):
         """
         Получение списка файлов, связанных с сессией.
@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from redis.exceptions import WatchError
+
+from agents_shared.metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "100"))
+HISTORY_CACHE_TTL = int(os.getenv("HISTORY_CACHE_TTL", str(24 * 3600)))
+
+_requests = counter("api_history_cache_requests_total", "First-page chat history lookups in Redis", ["result"])
+_fallback_seconds = histogram("api_history_cache_fallback_seconds", "Time to load the first history page from Postgres and rebuild the cache")
+
+
+class HistoryCache:
+    """
+    Last ``size`` messages of every user in a Redis list ``chat:history:{user_id}``, newest first.
+
+    Each item is ``{"cursor": ..., "message": ...}`` where ``message`` is the history API item.
+    Writes go through :meth:`push` when a message is accepted for persistence; it only extends
+    lists that already exist, so a list is always either absent or a complete tail of the
+    history. A missing list is rebuilt from Postgres by :meth:`arebuild`. A list shorter than
+    ``size`` holds the whole history of the user.
+
+    Messages reach Postgres later than the cache (write-behind), so ``chat:history:{user_id}:state``
+    counts pushes (``ver``) and messages not yet written (``pending``). A rebuild is applied
+    only if no message is pending and none was pushed since the snapshot taken before the
+    database read (WATCH on the state key). When a write fails, :meth:`settle` deletes the
+    list, since it holds a message that never reached the database.
+    """
+
+    def __init__(self, redis_client, async_redis=None, size: int = HISTORY_CACHE_SIZE, ttl: int = HISTORY_CACHE_TTL):
+        self.r = redis_client
+        self.ar = async_redis
+        self.size = size
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"chat:history:{user_id}"
+
+    @staticmethod
+    def _state_key(user_id: str) -> str:
+        return f"chat:history:{user_id}:state"
+
+    def push(self, user_id: str, cursor: str, message: Dict[str, Any]) -> bool:
+        """Add an accepted message; a successful push must be followed by :meth:`settle` once it is written."""
+        key = self._key(user_id)
+        state = self._state_key(user_id)
+        item = json.dumps({"cursor": cursor, "message": message}, ensure_ascii=False, default=str)
+        try:
+            pipe = self.r.pipeline(transaction=True)
+            pipe.hincrby(state, "ver", 1)
+            pipe.hincrby(state, "pending", 1)
+            pipe.expire(state, self.ttl)
+            pipe.lpushx(key, item)
+            pipe.ltrim(key, 0, self.size - 1)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+            return True
+        except Exception:
+            # список может отстать — удаляем, следующая загрузка истории пересоберёт его из БД
+            logger.exception("Failed to update history cache for %s", user_id)
+            try:
+                self.r.delete(key)
+            except Exception:
+                pass
+            return False
+
+    def settle(self, counts: Dict[str, int], written: bool) -> None:
+        """Messages pushed earlier were written (or finally failed): ``counts`` is user_id -> number."""
+        if not counts:
+            return
+        try:
+            pipe = self.r.pipeline(transaction=False)
+            for user_id, n in counts.items():
+                pipe.hincrby(self._state_key(user_id), "pending", -n)
+                if not written:
+                    # в списке есть сообщение, которого нет в БД
+                    pipe.delete(self._key(user_id))
+            pipe.execute()
+        except Exception:
+            logger.exception("Failed to settle history cache for %d users", len(counts))
+
+    async def asnapshot(self, user_id: str) -> Optional[str]:
+        """Version to pass to :meth:`arebuild`, taken before reading Postgres; None if a rebuild is unsafe now."""
+        try:
+            ver, pending = await self.ar.hmget(self._state_key(user_id), "ver", "pending")
+        except Exception:
+            logger.exception("Failed to read history cache state for %s", user_id)
+            return None
+        if int(pending or 0) > 0:
+            # сообщения ещё не в БД — пересобранный список потерял бы их
+            return None
+        return ver or "0"
+
+    async def aget(self, user_id: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """Newest-first items for a first page of ``limit`` messages, or None when Postgres must answer."""
+        if limit > self.size:
+            _requests.inc(result="bypass")
+            return None
+        try:
+            raw = await self.ar.lrange(self._key(user_id), 0, self.size - 1)
+        except Exception:
+            logger.exception("Failed to read history cache for %s", user_id)
+            raw = []
+        # полный список мог быть обрезан: has_more известен, только если в нём больше limit элементов
+        if not raw or (len(raw) >= self.size and limit >= len(raw)):
+            _requests.inc(result="miss")
+            return None
+        _requests.inc(result="hit")
+        return [json.loads(item) for item in raw]
+
+    async def arebuild(self, user_id: str, items: List[Dict[str, Any]], snapshot: Optional[str]) -> bool:
+        """
+        Replace the cached tail with ``items`` (newest first) loaded from Postgres after
+        :meth:`asnapshot` returned ``snapshot``. Skipped if messages were pushed since.
+        """
+        if not items or snapshot is None:
+            return False
+        key = self._key(user_id)
+        state = self._state_key(user_id)
+        try:
+            async with self.ar.pipeline(transaction=True) as pipe:
+                await pipe.watch(state)
+                ver, pending = await pipe.hmget(state, "ver", "pending")
+                if (ver or "0") != snapshot or int(pending or 0) > 0:
+                    _requests.inc(result="rebuild_skipped")
+                    return False
+                pipe.multi()
+                pipe.delete(key)
+                pipe.rpush(key, *(json.dumps(item, ensure_ascii=False, default=str) for item in items[:self.size]))
+                pipe.expire(key, self.ttl)
+                await pipe.execute()
+            return True
+        except WatchError:
+            # сообщение пришло во время пересборки — список соберёт следующий промах
+            _requests.inc(result="rebuild_skipped")
+            return False
+        except Exception:
+            logger.exception("Failed to rebuild history cache for %s", user_id)
+            return False
+
+    @staticmethod
+    def observe_fallback(seconds: float) -> None:
+        _fallback_seconds.observe(seconds)
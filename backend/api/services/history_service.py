@@ -0,0 +1,125 @@
+import base64
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import tuple_
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models.message import Message
+from .history_cache import HistoryCache
+
+HISTORY_DEFAULT_LIMIT = int(os.getenv("HISTORY_DEFAULT_LIMIT", "50"))
+HISTORY_MAX_LIMIT = int(os.getenv("HISTORY_MAX_LIMIT", "200"))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, message_id) -> str:
+    raw = f"{created_at.isoformat()}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, message_id = raw.split("|", 1)
+        return datetime.fromisoformat(ts), UUID(message_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"invalid cursor: {cursor!r}") from e
+
+
+def history_item(message_id, direction: str, text: Optional[str], payload: Optional[Dict[str, Any]],
+                 created_at: datetime) -> Dict[str, Any]:
+    return {
+        "id": str(message_id),
+        "type": "user" if direction == "user" else "bot",
+        "text": text,
+        "ts": int(created_at.timestamp() * 1000),
+        "payload": payload or {},
+    }
+
+
+def serialize_message(m: Message) -> Dict[str, Any]:
+    return history_item(m.id, m.direction, m.text, m.payload, m.created_at)
+
+
+class HistoryService:
+    """
+    Keyset pagination over a user's messages by (created_at, id).
+
+    Pages are always returned oldest first. Without a cursor the newest ``limit``
+    messages are returned; ``before`` walks back in time, ``after`` forward. Both
+    directions are served by the (user_id, created_at, id) index. The first page is
+    served from :class:`HistoryCache` when one is configured.
+    """
+
+    def __init__(self, cache: Optional[HistoryCache] = None):
+        self.cache = cache
+
+    async def page(self, session: AsyncSession, user_id: str, before: Optional[str] = None,
+                   after: Optional[str] = None, limit: int = HISTORY_DEFAULT_LIMIT) -> Dict[str, Any]:
+        if before and after:
+            raise InvalidCursor("use either before or after, not both")
+        limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+        if self.cache is not None and not before and not after:
+            return await self._first_page(session, user_id, limit)
+        key = tuple_(Message.created_at, Message.id)
+        stmt = select(Message).where(Message.user_id == str(user_id))
+        if after:
+            stmt = stmt.where(key > tuple_(*decode_cursor(after))).order_by(Message.created_at, Message.id)
+        else:
+            if before:
+                stmt = stmt.where(key < tuple_(*decode_cursor(before)))
+            stmt = stmt.order_by(Message.created_at.desc(), Message.id.desc())
+        # одна лишняя строка показывает, есть ли следующая страница
+        rows: List[Message] = list((await session.exec(stmt.limit(limit + 1))).all())
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not after:
+            rows.reverse()
+        items = [{"cursor": encode_cursor(m.created_at, m.id), "message": serialize_message(m)} for m in rows]
+        return self._page(user_id, items, has_more, after is not None)
+
+    async def _first_page(self, session: AsyncSession, user_id: str, limit: int) -> Dict[str, Any]:
+        cached = await self.cache.aget(user_id, limit)
+        if cached is not None:
+            page = cached[:limit]
+            page.reverse()
+            return self._page(user_id, page, len(cached) > limit, False)
+
+        started = time.monotonic()
+        # версия списка до чтения БД: пересборка не затрёт сообщения, принятые во время запроса
+        snapshot = await self.cache.asnapshot(user_id)
+        # промах: читаем сразу весь кэшируемый хвост, чтобы пересобрать список
+        fetch = max(limit, self.cache.size)
+        stmt = (
+            select(Message).where(Message.user_id == str(user_id))
+            .order_by(Message.created_at.desc(), Message.id.desc()).limit(fetch + 1)
+        )
+        rows: List[Message] = list((await session.exec(stmt)).all())
+        newest_first = [{"cursor": encode_cursor(m.created_at, m.id), "message": serialize_message(m)} for m in rows[:fetch]]
+        await self.cache.arebuild(user_id, newest_first, snapshot)
+        self.cache.observe_fallback(time.monotonic() - started)
+        page = newest_first[:limit]
+        page.reverse()
+        return self._page(user_id, page, len(rows) > limit, False)
+
+    @staticmethod
+    def _page(user_id: str, items: List[Dict[str, Any]], has_more: bool, forward: bool) -> Dict[str, Any]:
+        first = items[0]["cursor"] if items else None
+        last = items[-1]["cursor"] if items else None
+        return {
+            "user_id": user_id,
+            "history": [item["message"] for item in items],
+            # cursor for older messages (None when the beginning of history is reached)
+            "before": first if (has_more or forward) else None,
+            # cursor for newer messages; the newest page still returns it to poll for updates
+            "after": last,
+            "has_more": has_more,
+        }
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import os
+from typing import Any, Dict, Optional
+
+from agents_shared.metrics import counter, gauge, histogram
+
+logger = logging.getLogger("chat_waiters")
+
+# how long an HTTP chat request waits for the assistant by default and at most
+CHAT_HTTP_TIMEOUT = float(os.getenv("CHAT_HTTP_TIMEOUT", "60"))
+CHAT_HTTP_MAX_TIMEOUT = float(os.getenv("CHAT_HTTP_MAX_TIMEOUT", "300"))
+
+_waiting = gauge("api_chat_http_waiters", "HTTP chat requests waiting for the assistant on this node")
+_results = counter("api_chat_http_requests_total", "HTTP chat requests by mode and outcome", ["mode", "result"])
+_wait_seconds = histogram(
+    "api_chat_http_wait_seconds", "Time from producing user.message to the final assistant.response",
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+
+def frame_correlation_id(frame: Dict[str, Any]) -> Optional[str]:
+    envelope = frame.get("envelope")
+    if envelope is not None:
+        return envelope.get("correlation_id")
+    return frame.get("correlation_id")
+
+
+class ResponseWaiter:
+    """One HTTP request waiting for the frames of its correlation_id."""
+
+    __slots__ = ("correlation_id", "user_id", "stream", "frames")
+
+    def __init__(self, correlation_id: str, user_id: str, stream: bool):
+        self.correlation_id = correlation_id
+        self.user_id = user_id
+        # long-poll requests need only the final response; SSE also gets the chunks
+        self.stream = stream
+        self.frames: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+
+    async def next(self, timeout: float) -> Dict[str, Any]:
+        """Next frame; raises asyncio.TimeoutError after `timeout` seconds."""
+        return await asyncio.wait_for(self.frames.get(), timeout)
+
+
+class ResponseWaiters:
+    """
+    In-process registry correlation_id -> waiting HTTP request, fed by the bridge.
+
+    A waiter is a dict entry and a queue: no thread or connection is held while the
+    assistant works, so thousands of requests may wait at once. Like connections,
+    waiters belong to the event loop thread.
+    """
+
+    def __init__(self):
+        self._waiters: Dict[str, ResponseWaiter] = {}
+
+    def open(self, correlation_id: str, user_id: str, stream: bool) -> ResponseWaiter:
+        waiter = ResponseWaiter(correlation_id, user_id, stream)
+        self._waiters[correlation_id] = waiter
+        _waiting.set(len(self._waiters))
+        return waiter
+
+    def close(self, waiter: ResponseWaiter) -> None:
+        if self._waiters.get(waiter.correlation_id) is waiter:
+            del self._waiters[waiter.correlation_id]
+        _waiting.set(len(self._waiters))
+
+    def users(self) -> list[str]:
+        return list({w.user_id for w in self._waiters.values()})
+
+    def deliver(self, frame: Dict[str, Any]) -> bool:
+        """Hand a frame to the request waiting for it; False if nobody waits here."""
+        waiter = self._waiters.get(frame_correlation_id(frame))
+        if waiter is None:
+            return False
+        if frame.get("type") == "chunk" and not waiter.stream:
+            return True
+        waiter.frames.put_nowait(frame)
+        return True
+
+    @staticmethod
+    def observe(mode: str, result: str, waited: float | None = None) -> None:
+        _results.inc(mode=mode, result=result)
+        if waited is not None:
+            _wait_seconds.observe(waited)
+
+
+waiters = ResponseWaiters()
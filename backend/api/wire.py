@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from agents_shared.metrics import counter, histogram
+
+logger = logging.getLogger("ws_wire")
+
+try:
+    import msgpack
+except ImportError:  # binary mode is simply not offered
+    msgpack = None
+
+# WebSocket subprotocols of the compact protocol; a client that offers none gets the legacy JSON frames
+SUBPROTOCOL_JSON = "chat.v2.json"
+SUBPROTOCOL_MSGPACK = "chat.v2.msgpack"
+
+# frames queued within this window are sent as one batch frame (compact protocol only)
+WS_BATCH_WINDOW_MS = float(os.getenv("WS_BATCH_WINDOW_MS", "5"))
+WS_BATCH_MAX_FRAMES = int(os.getenv("WS_BATCH_MAX_FRAMES", "32"))
+
+_frame_bytes = histogram(
+    "api_ws_frame_bytes", "Size of encoded WebSocket frames before compression", ["protocol"],
+    buckets=(64, 256, 1024, 4096, 16384, 65536, 262144, 1048576),
+)
+_batched = histogram(
+    "api_ws_frames_per_batch", "Messages carried by one WebSocket frame",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+_negotiated = counter("api_ws_protocol_total", "WebSocket connections by negotiated wire protocol", ["protocol"])
+
+# (тип сообщения ASGI: "text" или "bytes", данные)
+Encoded = Tuple[str, Union[str, bytes]]
+
+
+def slim_frame(frame: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compact form of a final response: the envelope payload without the top-level
+    text/reply copies and without routing fields the client does not need.
+    Chunk and error frames are already compact and pass through unchanged.
+    """
+    envelope = frame.get("envelope")
+    if envelope is None:
+        return frame
+    slim = {
+        "type": "message",
+        "event": envelope.get("event"),
+        "correlation_id": envelope.get("correlation_id"),
+        "payload": envelope.get("payload") or {},
+    }
+    if "msg_seq" in frame:
+        slim["msg_seq"] = frame["msg_seq"]
+    return slim
+
+
+class WireProtocol:
+    """Legacy protocol: one JSON text frame per message, exactly as before."""
+
+    name = "json"
+    subprotocol: Optional[str] = None
+    batch_window = 0.0
+    batch_max = 1
+
+    def encode(self, frames: List[Dict[str, Any]]) -> Encoded:
+        data = json.dumps(frames[0], separators=(",", ":"), ensure_ascii=False)
+        _frame_bytes.observe(len(data), protocol=self.name)
+        return "text", data
+
+    def decode(self, message: Dict[str, Any]) -> Any:
+        if message.get("text") is not None:
+            return json.loads(message["text"])
+        return json.loads(message["bytes"])
+
+
+class CompactProtocol(WireProtocol):
+    """
+    Slim frames (see slim_frame) batched within a few milliseconds: several messages
+    go out as ``{"type": "batch", "frames": [...]}``. JSON text or msgpack binary.
+    """
+
+    def __init__(self, binary: bool, batch_window_ms: float = WS_BATCH_WINDOW_MS,
+                 batch_max: int = WS_BATCH_MAX_FRAMES):
+        self.binary = binary
+        self.name = "msgpack" if binary else "compact"
+        self.subprotocol = SUBPROTOCOL_MSGPACK if binary else SUBPROTOCOL_JSON
+        self.batch_window = batch_window_ms / 1000.0
+        self.batch_max = max(1, batch_max)
+
+    def encode(self, frames: List[Dict[str, Any]]) -> Encoded:
+        if len(frames) == 1:
+            body = slim_frame(frames[0])
+        else:
+            body = {"type": "batch", "frames": [slim_frame(f) for f in frames]}
+        _batched.observe(len(frames))
+        if self.binary:
+            data = msgpack.packb(body, default=str, use_bin_type=True)
+            _frame_bytes.observe(len(data), protocol=self.name)
+            return "bytes", data
+        data = json.dumps(body, separators=(",", ":"), ensure_ascii=False, default=str)
+        _frame_bytes.observe(len(data.encode()), protocol=self.name)
+        return "text", data
+
+    def decode(self, message: Dict[str, Any]) -> Any:
+        if message.get("bytes") is not None and self.binary:
+            return msgpack.unpackb(message["bytes"], raw=False)
+        return super().decode(message)
+
+
+LEGACY = WireProtocol()
+
+
+def negotiate(offered: List[str]) -> WireProtocol:
+    """Pick the protocol from the subprotocols offered by the client, in the client's order of preference."""
+    for name in offered or []:
+        if name == SUBPROTOCOL_MSGPACK and msgpack is not None:
+            protocol = CompactProtocol(binary=True)
+            break
+        if name == SUBPROTOCOL_JSON:
+            protocol = CompactProtocol(binary=False)
+            break
+    else:
+        protocol = LEGACY
+    _negotiated.inc(protocol=protocol.name)
+    return protocol
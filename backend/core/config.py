@@ -18,6 +18,16 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str = "postgres"
     POSTGRES_DB: str = "dbname"
 
+    # connection pools (per engine: the API has a sync and an async one)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 5.0
+    DB_POOL_RECYCLE: int = 1800
+    # psycopg prepares a statement server-side after it ran this many times on a connection;
+    # set to -1 to disable (e.g. behind pgbouncer in transaction mode)
+    DB_PREPARE_THRESHOLD: int = 5
+    DB_STATEMENT_CACHE_SIZE: int = 500
+
     @property
     def SQLALCHEMY_DATABASE_URI(self) -> PostgresDsn:
         return PostgresDsn.build(
@@ -1,9 +1,60 @@
+from typing import AsyncIterator
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from agents_shared.metrics import counter, gauge
 from core.config import settings
 
 # Using SQLALCHEMY_DATABASE_URI from settings
 DATABASE_URL = str(settings.SQLALCHEMY_DATABASE_URI)
-engine = create_engine(DATABASE_URL, echo=False)
+
+_pool_checked_out = gauge("api_db_pool_checked_out", "Connections currently checked out of the pool", ["engine"])
+_pool_open = gauge("api_db_pool_open", "Connections currently open in the pool", ["engine"])
+_pool_capacity = gauge("api_db_pool_capacity", "Maximum connections the pool may open (size + overflow)", ["engine"])
+_pool_connects = counter("api_db_pool_connects_total", "New database connections opened by the pool", ["engine"])
+
+
+def _pool_options() -> dict:
+    return {
+        "echo": False,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+        # кэш скомпилированных SQL-выражений SQLAlchemy
+        "query_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        # серверные prepared statements psycopg
+        "connect_args": {"prepare_threshold": settings.DB_PREPARE_THRESHOLD if settings.DB_PREPARE_THRESHOLD >= 0 else None},
+    }
+
+
+def _instrument_pool(sync_engine, name: str) -> None:
+    pool = sync_engine.pool
+    _pool_capacity.set(settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW, engine=name)
+
+    def _update(*_):
+        _pool_checked_out.set(pool.checkedout(), engine=name)
+        _pool_open.set(pool.checkedout() + pool.checkedin(), engine=name)
+
+    def _on_connect(*_):
+        _pool_connects.inc(engine=name)
+
+    event.listen(sync_engine, "connect", _on_connect)
+    for event_name in ("checkout", "checkin", "close", "close_detached"):
+        event.listen(sync_engine, event_name, _update)
+
+
+engine = create_engine(DATABASE_URL, **_pool_options())
+_instrument_pool(engine, "sync")
+
+# the same psycopg driver in async mode: used by request handlers so that queries never block the event loop
+async_engine = create_async_engine(DATABASE_URL, **_pool_options())
+_instrument_pool(async_engine.sync_engine, "async")
+async_session_factory = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
 
 
 def init_db():
@@ -17,3 +68,12 @@ def get_session():
     with Session(engine) as session:
         yield session
 
+
+async def get_async_session() -> AsyncIterator[AsyncSession]:
+    async with async_session_factory() as session:
+        yield session
+
+
+async def dispose_engines():
+    await async_engine.dispose()
+    engine.dispose()
@@ -10,8 +10,11 @@ TOPICS=(
     "user.message"
     "chat.response"
     "draft.created"
+    "draft.chunk"
     "draft.rejected"
     "legal.followup.requested"
+    "legal.followup.completed"
+    "legal.session.requested"
     "assistant.response"
   )
 
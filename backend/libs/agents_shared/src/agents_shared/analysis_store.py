@@ -0,0 +1,266 @@
+"""Durable store of legal analyses with a Redis read-through cache.
+
+Three tables (schema owned by the API's Alembic migrations):
+
+* ``clause_findings`` — content-addressed: one finding per clause hash, shared by every
+  document (and every revision of a contract) that contains the same clause text;
+* ``document_analyses`` — the final analysis of a document version, keyed by
+  (session_id, file_id, content_hash) with the list of its clause hashes;
+* ``session_reports`` — consolidated report over all documents of a session, keyed by
+  a fingerprint of the per-document analyses it was built from.
+
+Redis keeps hot copies (``legal:clause:{hash}``, ``legal:analysis:{content_hash}``)
+and the keys the other agents read: ``analysis:{session_id}:{file_id}`` and
+``session:{session_id}:report``. Postgres being unavailable degrades to Redis-only
+caching instead of failing the analysis.
+"""
+import json
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from .metrics import counter
+from .pg import PgConnection
+from .redis_storage import EXPIRE_TIME, _ensure_redis, save_analysis_to_redis
+
+logger = logging.getLogger("agents_shared.analysis_store")
+
+CLAUSE_PREFIX = "legal:clause"
+ANALYSIS_PREFIX = "legal:analysis"
+# how many recent analyses of a session are compared when looking for a previous version
+PREVIOUS_VERSION_SCAN = 20
+
+_lookups = counter("analysis_store_lookups_total", "Analysis store lookups", ["kind", "result"])
+
+
+class SessionReport(NamedTuple):
+    session_id: str
+    fingerprint: str
+    file_ids: List[str]
+    partial: bool
+    report_text: str
+
+
+def session_report_key(session_id: str) -> str:
+    return f"session:{session_id}:report"
+
+
+class StoredAnalysis(NamedTuple):
+    session_id: str
+    file_id: str
+    content_hash: str
+    findings_hash: str
+    clause_hashes: List[str]
+    analysis_text: str
+
+
+class AnalysisStore:
+    def __init__(self, redis_client=None, pg: Optional[PgConnection] = None, expire: int = EXPIRE_TIME):
+        self.r = _ensure_redis(redis_client)
+        self.pg = pg or PgConnection()
+        self.expire = expire
+
+    # --- clause findings ---
+
+    def get_clause_findings(self, hashes: Iterable[str]) -> Dict[str, str]:
+        """Findings for the given clause hashes that are already known (Redis first, then Postgres)."""
+        hashes = list(dict.fromkeys(hashes))
+        if not hashes:
+            return {}
+        found: Dict[str, str] = {}
+        try:
+            values = self.r.mget([f"{CLAUSE_PREFIX}:{h}" for h in hashes])
+            found = {h: v for h, v in zip(hashes, values) if v is not None}
+        except Exception:
+            logger.exception("Failed to read clause findings from Redis")
+
+        missing = [h for h in hashes if h not in found]
+        if missing:
+            try:
+                with self.pg.transaction() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            "SELECT clause_hash, finding FROM clause_findings WHERE clause_hash = ANY(%s)",
+                            (missing,),
+                        )
+                        from_pg = dict(cur.fetchall())
+            except Exception:
+                logger.exception("Failed to read clause findings from Postgres")
+                from_pg = {}
+            if from_pg:
+                found.update(from_pg)
+                self._cache_clauses(from_pg)
+
+        _lookups.inc(len(found), kind="clause", result="hit")
+        _lookups.inc(len(hashes) - len(found), kind="clause", result="miss")
+        return found
+
+    def save_clause_findings(self, findings: Dict[str, str]) -> None:
+        if not findings:
+            return
+        self._cache_clauses(findings)
+        try:
+            with self.pg.transaction() as conn:
+                with conn.cursor() as cur:
+                    cur.executemany(
+                        "INSERT INTO clause_findings (clause_hash, finding) VALUES (%s, %s) "
+                        "ON CONFLICT (clause_hash) DO NOTHING",
+                        list(findings.items()),
+                    )
+        except Exception:
+            logger.exception("Failed to persist %d clause findings", len(findings))
+
+    def _cache_clauses(self, findings: Dict[str, str]) -> None:
+        try:
+            pipe = self.r.pipeline(transaction=False)
+            for h, finding in findings.items():
+                pipe.set(f"{CLAUSE_PREFIX}:{h}", finding, ex=self.expire)
+            pipe.execute()
+        except Exception:
+            logger.exception("Failed to cache clause findings in Redis")
+
+    # --- document analyses ---
+
+    def get_by_content_hash(self, content_hash: str) -> Optional[StoredAnalysis]:
+        """Any stored analysis of exactly this document text (same file re-uploaded, other session...)."""
+        try:
+            cached = self.r.get(f"{ANALYSIS_PREFIX}:{content_hash}")
+            if cached:
+                _lookups.inc(kind="document", result="hit")
+                return StoredAnalysis(**json.loads(cached))
+        except Exception:
+            logger.exception("Failed to read cached analysis %s from Redis", content_hash)
+
+        rows = self._select(
+            "WHERE content_hash = %s ORDER BY created_at DESC LIMIT 1", (content_hash,)
+        )
+        _lookups.inc(kind="document", result="hit" if rows else "miss")
+        if not rows:
+            return None
+        self._cache_analysis(rows[0])
+        return rows[0]
+
+    def find_previous_version(self, session_id: str, clause_hashes: Sequence[str],
+                              min_overlap: float = 0.5) -> Optional[StoredAnalysis]:
+        """
+        The session's analysed document sharing the most clauses with this one — i.e. the
+        previous revision of the same contract — if at least `min_overlap` of clauses match.
+        """
+        if not session_id or not clause_hashes:
+            return None
+        rows = self._select(
+            "WHERE session_id = %s ORDER BY created_at DESC LIMIT %s", (session_id, PREVIOUS_VERSION_SCAN)
+        )
+        current = set(clause_hashes)
+        best, best_overlap = None, 0.0
+        for row in rows:
+            overlap = len(current & set(row.clause_hashes)) / max(len(current), 1)
+            if overlap > best_overlap:
+                best, best_overlap = row, overlap
+        if best is None or best_overlap < min_overlap:
+            return None
+        return best
+
+    def save_analysis(self, analysis: StoredAnalysis) -> str:
+        """Persist the analysis and publish it under ``analysis:{session_id}:{file_id}``; returns that key."""
+        try:
+            with self.pg.transaction() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "INSERT INTO document_analyses "
+                        "(session_id, file_id, content_hash, findings_hash, clause_hashes, analysis_text) "
+                        "VALUES (%s, %s, %s, %s, %s, %s) "
+                        "ON CONFLICT (session_id, file_id, content_hash) DO UPDATE SET "
+                        "findings_hash = EXCLUDED.findings_hash, clause_hashes = EXCLUDED.clause_hashes, "
+                        "analysis_text = EXCLUDED.analysis_text, created_at = now()",
+                        (
+                            analysis.session_id, analysis.file_id, analysis.content_hash,
+                            analysis.findings_hash, json.dumps(analysis.clause_hashes), analysis.analysis_text,
+                        ),
+                    )
+        except Exception:
+            logger.exception("Failed to persist analysis for file %s (session=%s)", analysis.file_id, analysis.session_id)
+        self._cache_analysis(analysis)
+        return save_analysis_to_redis(self.r, analysis.session_id, analysis.file_id, analysis.analysis_text, self.expire)
+
+    # --- session reports ---
+
+    def get_session_report(self, session_id: str, fingerprint: str) -> Optional[SessionReport]:
+        try:
+            cached = self.r.get(f"{session_report_key(session_id)}:meta")
+            if cached:
+                report = SessionReport(**json.loads(cached))
+                if report.fingerprint == fingerprint:
+                    _lookups.inc(kind="session", result="hit")
+                    return report
+        except Exception:
+            logger.exception("Failed to read cached session report for %s", session_id)
+        try:
+            with self.pg.transaction() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT file_ids, partial, report_text FROM session_reports "
+                        "WHERE session_id = %s AND fingerprint = %s",
+                        (session_id, fingerprint),
+                    )
+                    row = cur.fetchone()
+        except Exception:
+            logger.exception("Failed to query session report for %s", session_id)
+            row = None
+        _lookups.inc(kind="session", result="hit" if row else "miss")
+        if row is None:
+            return None
+        file_ids = row[0] if isinstance(row[0], list) else json.loads(row[0])
+        report = SessionReport(session_id, fingerprint, file_ids, row[1], row[2])
+        try:
+            self._cache_session_report(report)
+        except Exception:
+            logger.exception("Failed to cache session report for %s", session_id)
+        return report
+
+    def save_session_report(self, report: SessionReport) -> str:
+        """Persist the report and publish it under ``session:{session_id}:report``; returns that key."""
+        try:
+            with self.pg.transaction() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "INSERT INTO session_reports (session_id, fingerprint, file_ids, partial, report_text) "
+                        "VALUES (%s, %s, %s, %s, %s) "
+                        "ON CONFLICT (session_id, fingerprint) DO UPDATE SET "
+                        "partial = EXCLUDED.partial, report_text = EXCLUDED.report_text, created_at = now()",
+                        (report.session_id, report.fingerprint, json.dumps(report.file_ids), report.partial, report.report_text),
+                    )
+        except Exception:
+            logger.exception("Failed to persist session report for %s", report.session_id)
+        return self._cache_session_report(report)
+
+    def _cache_session_report(self, report: SessionReport) -> str:
+        key = session_report_key(report.session_id)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.set(key, report.report_text, ex=self.expire)
+        pipe.set(f"{key}:meta", json.dumps(report._asdict()), ex=self.expire)
+        pipe.execute()
+        return key
+
+    def _cache_analysis(self, analysis: StoredAnalysis) -> None:
+        try:
+            self.r.set(f"{ANALYSIS_PREFIX}:{analysis.content_hash}", json.dumps(analysis._asdict()), ex=self.expire)
+        except Exception:
+            logger.exception("Failed to cache analysis %s in Redis", analysis.content_hash)
+
+    def _select(self, where: str, params) -> List[StoredAnalysis]:
+        try:
+            with self.pg.transaction() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT session_id, file_id, content_hash, findings_hash, clause_hashes, analysis_text "
+                        "FROM document_analyses " + where,
+                        params,
+                    )
+                    rows = cur.fetchall()
+        except Exception:
+            logger.exception("Failed to query document analyses")
+            return []
+        return [
+            StoredAnalysis(r[0], r[1], r[2], r[3], r[4] if isinstance(r[4], list) else json.loads(r[4]), r[5])
+            for r in rows
+        ]
@@ -0,0 +1,307 @@
+"""Asyncio execution mode for agents: many in-flight messages per process.
+
+The consumer is polled from a single I/O thread (confluent-kafka is blocking) and every
+message becomes an asyncio task, up to ``max_in_flight`` at a time. At the limit the
+assigned partitions are paused and the consumer keeps polling, so the group membership
+is not lost while slow LLM calls finish. Coroutine handlers run on the event loop;
+plain functions run in a worker pool of the same size.
+
+Offsets are committed per partition only up to the lowest message still in flight, so
+a crash never skips an unfinished message even though handlers complete out of order.
+A position is committed only after the brokers acknowledged every message the agent
+produced before it, so outputs buffered with ``flush=False`` are not lost with the commit.
+When partitions are revoked in a rebalance, their in-flight messages are awaited (up to
+``drain_timeout``) and committed before the partitions go to another consumer.
+SIGTERM/SIGINT stop polling, wait up to ``drain_timeout`` for in-flight messages,
+flush the producer, commit and close the consumer.
+
+Per-stage latency is exported as ``agent_stage_seconds{agent, stage}``; the runtime
+records ``queue`` and ``handle`` and services add their own stages with :func:`stage_timer`.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from confluent_kafka import KafkaError, TopicPartition
+
+from .metrics import counter, gauge, histogram
+
+logger = logging.getLogger("agents_shared.async_runtime")
+
+MAX_IN_FLIGHT = int(os.getenv("AGENT_MAX_IN_FLIGHT", "256"))
+DRAIN_TIMEOUT = float(os.getenv("AGENT_DRAIN_TIMEOUT", "30"))
+
+_stage_seconds = histogram("agent_stage_seconds", "Latency of message processing stages", ["agent", "stage"])
+_in_flight = gauge("agent_inflight_messages", "Messages being processed concurrently", ["agent"])
+_messages = counter("agent_messages_total", "Messages processed by the agent runtime", ["agent", "status"])
+
+
+@contextmanager
+def stage_timer(agent: str, stage: str) -> Iterator[None]:
+    """Record the duration of a processing stage (works around awaits as well)."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        _stage_seconds.observe(time.monotonic() - started, agent=agent, stage=stage)
+
+
+class OffsetTracker:
+    """
+    Per-partition commit position that never passes a message still in flight.
+
+    finished() also takes the producer sequence number reached when the message was done;
+    committable() releases a position only once every message up to that sequence number
+    has been delivered.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple[str, int], Set[int]] = {}
+        self._highest: Dict[Tuple[str, int], int] = {}
+        self._committed: Dict[Tuple[str, int], int] = {}
+        # (позиция, номер последнего отправленного сообщения) в порядке роста позиции
+        self._ready: Dict[Tuple[str, int], Deque[Tuple[int, int]]] = {}
+
+    def started(self, topic: str, partition: int, offset: int) -> None:
+        tp = (topic, partition)
+        self._pending.setdefault(tp, set()).add(offset)
+        self._highest[tp] = max(offset, self._highest.get(tp, -1))
+
+    def finished(self, topic: str, partition: int, offset: int, produced: int = 0) -> Optional[int]:
+        """Mark the offset done; returns the new commit position if it advanced."""
+        tp = (topic, partition)
+        if tp not in self._highest:
+            # партицию уже отозвали
+            return None
+        pending = self._pending.get(tp, set())
+        pending.discard(offset)
+        position = min(pending) if pending else self._highest[tp] + 1
+        if position <= self._committed.get(tp, -1):
+            return None
+        self._committed[tp] = position
+        self._ready.setdefault(tp, deque()).append((position, produced))
+        return position
+
+    def committable(self, delivered: int, partitions: Optional[Iterable[Tuple[str, int]]] = None) -> Dict[Tuple[str, int], int]:
+        """Positions whose outputs are delivered up to sequence ``delivered``; each is returned once."""
+        result = {}
+        for tp in list(self._ready) if partitions is None else [tp for tp in partitions if tp in self._ready]:
+            ready = self._ready[tp]
+            while ready and ready[0][1] <= delivered:
+                result[tp] = ready.popleft()[0]
+            if not ready:
+                del self._ready[tp]
+        return result
+
+    def reset(self, partitions: Iterable[Tuple[str, int]]) -> None:
+        """Forget partitions that were revoked or (re)assigned."""
+        for tp in partitions:
+            self._pending.pop(tp, None)
+            self._highest.pop(tp, None)
+            self._committed.pop(tp, None)
+            self._ready.pop(tp, None)
+
+
+class AsyncAgentRuntime:
+    def __init__(self, name: str, kafka_client, handler: Callable[[str, dict, Optional[str]], Any],
+                 max_in_flight: int = MAX_IN_FLIGHT, poll_timeout: float = 1.0, drain_timeout: float = DRAIN_TIMEOUT):
+        self.name = name
+        self.kafka = kafka_client
+        self.consumer = kafka_client.consumer.c
+        self.handler = handler
+        self.max_in_flight = max_in_flight
+        self.poll_timeout = poll_timeout
+        self.drain_timeout = drain_timeout
+        self._is_async = asyncio.iscoroutinefunction(handler)
+        # consumer calls (poll/commit/pause/close) are serialised on one thread
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-kafka")
+        self._workers = None if self._is_async else ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=f"{name}-worker")
+        self._offsets = OffsetTracker()
+        # задача -> её партиция, чтобы при ребалансе дождаться только отзываемых
+        self._tasks: Dict[asyncio.Task, Tuple[str, int]] = {}
+        self._paused = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._slot_freed: Optional[asyncio.Event] = None
+
+    def stop(self) -> None:
+        if self._stopping is not None and not self._stopping.is_set():
+            logger.info("Stopping %s runtime: draining %d in-flight messages", self.name, len(self._tasks))
+            self._stopping.set()
+
+    async def _io_call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._io, lambda: fn(*args, **kwargs))
+
+    async def run(self) -> None:
+        loop = self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._slot_freed = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        # колбэки ребаланса вызываются внутри poll() на I/O-потоке
+        if self.kafka.consumer.topics:
+            await self._io_call(self.consumer.subscribe, self.kafka.consumer.topics,
+                                on_assign=self._on_assign, on_revoke=self._on_revoke, on_lost=self._on_lost)
+        logger.info("%s async runtime started (max_in_flight=%d)", self.name, self.max_in_flight)
+        try:
+            while not self._stopping.is_set():
+                await self._flush_commits()
+                if len(self._tasks) >= self.max_in_flight:
+                    await self._set_paused(True)
+                    self._slot_freed.clear()
+                    try:
+                        await asyncio.wait_for(self._slot_freed.wait(), self.poll_timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    # poll keeps the consumer in the group while its partitions are paused
+                    msg = await self._io_call(self.consumer.poll, 0)
+                else:
+                    await self._set_paused(False)
+                    msg = await self._io_call(self.consumer.poll, self.poll_timeout)
+                if msg is None:
+                    continue
+                if msg.error():
+                    if msg.error().code() != KafkaError._PARTITION_EOF:
+                        logger.error("Consumer error: %s", msg.error())
+                    continue
+                self._dispatch(msg)
+        finally:
+            await self._drain()
+
+    async def _set_paused(self, paused: bool) -> None:
+        if paused == self._paused:
+            return
+        assignment = await self._io_call(self.consumer.assignment)
+        if assignment:
+            await self._io_call(self.consumer.pause if paused else self.consumer.resume, assignment)
+        self._paused = paused
+        logger.debug("%s partitions %s", self.name, "paused" if paused else "resumed")
+
+    def _on_assign(self, consumer, partitions) -> None:
+        self._offsets.reset((p.topic, p.partition) for p in partitions)
+        # новые партиции не на паузе — основной цикл приостановит их снова, если нужно
+        self._paused = False
+        logger.info("%s assigned %s", self.name, [(p.topic, p.partition) for p in partitions])
+
+    def _on_revoke(self, consumer, partitions) -> None:
+        revoked = {(p.topic, p.partition) for p in partitions}
+        self._release(revoked)
+        # выходы должны дойти до брокера раньше, чем уйдёт коммит
+        self.kafka.flush()
+        committable = self._offsets.committable(self.kafka.producer.delivered_through(), revoked)
+        if committable:
+            offsets = [TopicPartition(t, p, pos) for (t, p), pos in committable.items()]
+            try:
+                consumer.commit(offsets=offsets, asynchronous=False)
+            except Exception:
+                logger.exception("Failed to commit offsets of revoked partitions %s", offsets)
+        self._offsets.reset(revoked)
+        logger.info("%s revoked %s", self.name, sorted(revoked))
+
+    def _on_lost(self, consumer, partitions) -> None:
+        # партиции уже у другого консьюмера — коммитить нельзя, сообщения будут обработаны там
+        lost = {(p.topic, p.partition) for p in partitions}
+        self._release(lost, timeout=0)
+        self._offsets.reset(lost)
+        logger.warning("%s lost %s", self.name, sorted(lost))
+
+    def _release(self, partitions: Set[Tuple[str, int]], timeout: Optional[float] = None) -> None:
+        """Called on the I/O thread: finish (or cancel) in-flight messages of the given partitions."""
+        if self._loop is None or not partitions:
+            return
+        timeout = self.drain_timeout if timeout is None else timeout
+        future = asyncio.run_coroutine_threadsafe(self._finish_partitions(partitions, timeout), self._loop)
+        try:
+            future.result()
+        except Exception:
+            logger.exception("Failed to finish in-flight messages of %s", sorted(partitions))
+
+    async def _finish_partitions(self, partitions: Set[Tuple[str, int]], timeout: float) -> None:
+        tasks = [task for task, tp in self._tasks.items() if tp in partitions]
+        if not tasks:
+            return
+        logger.info("Rebalance: waiting up to %.0fs for %d in-flight messages", timeout, len(tasks))
+        pending: Set[asyncio.Task] = set(tasks)
+        if timeout > 0:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning("Rebalance: cancelled %d messages still in flight", len(pending))
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def _dispatch(self, msg) -> None:
+        self._offsets.started(msg.topic(), msg.partition(), msg.offset())
+        task = asyncio.create_task(self._process(msg, time.monotonic()))
+        self._tasks[task] = (msg.topic(), msg.partition())
+        _in_flight.set(len(self._tasks), agent=self.name)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.pop(task, None)
+        _in_flight.set(len(self._tasks), agent=self.name)
+        self._slot_freed.set()
+
+    async def _process(self, msg, received: float) -> None:
+        _stage_seconds.observe(time.monotonic() - received, agent=self.name, stage="queue")
+        topic = msg.topic()
+        try:
+            key = msg.key().decode() if msg.key() else None
+            value = json.loads(msg.value().decode("utf-8"))
+            with stage_timer(self.name, "handle"):
+                if self._is_async:
+                    await self.handler(topic, value, key)
+                else:
+                    await asyncio.get_running_loop().run_in_executor(self._workers, self.handler, topic, value, key)
+            _messages.inc(agent=self.name, status="ok")
+        except asyncio.CancelledError:
+            # not finished — its offset stays uncommitted and the message is redelivered
+            _messages.inc(agent=self.name, status="cancelled")
+            raise
+        except Exception:
+            logger.exception("Error handling message topic=%s offset=%s", topic, msg.offset())
+            _messages.inc(agent=self.name, status="error")
+        # всё, что обработчик отправил, имеет номер не больше текущего
+        self._offsets.finished(topic, msg.partition(), msg.offset(), self.kafka.producer.produced())
+
+    async def _flush_commits(self, asynchronous: bool = True) -> None:
+        # отчёты о доставке приходят только во время poll продюсера
+        await self._io_call(self.kafka.producer.poll, 0)
+        committable = self._offsets.committable(self.kafka.producer.delivered_through())
+        if not committable:
+            return
+        offsets = [TopicPartition(t, p, pos) for (t, p), pos in committable.items()]
+        try:
+            await self._io_call(self.consumer.commit, offsets=offsets, asynchronous=asynchronous)
+        except Exception:
+            logger.exception("Failed to commit offsets %s", offsets)
+
+    async def _drain(self) -> None:
+        if self._tasks:
+            logger.info("Waiting up to %.0fs for %d in-flight messages", self.drain_timeout, len(self._tasks))
+            _, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning("Cancelled %d messages still in flight after the drain timeout", len(pending))
+                await asyncio.gather(*pending, return_exceptions=True)
+        try:
+            await self._io_call(self.kafka.flush)
+            await self._flush_commits(asynchronous=False)
+        finally:
+            await self._io_call(self.consumer.close)
+            self._io.shutdown(wait=False)
+            if self._workers is not None:
+                self._workers.shutdown(wait=False)
+        logger.info("%s async runtime stopped", self.name)
@@ -0,0 +1,116 @@
+"""Delayed re-delivery of Kafka messages through a Redis sorted set.
+
+When an agent cannot get an LLM permit it defers the message instead of blocking
+the consumer: the message is parked in ``deferred:{queue}`` scored by its due time
+and a background pump re-publishes due messages to their original topic. Claiming
+is atomic (Lua), so with several replicas each message is re-published once.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from .metrics import counter, gauge, histogram
+from .redis_storage import _ensure_redis
+
+logger = logging.getLogger("agents_shared.deferral")
+
+MAX_DEFERRALS = int(os.getenv("MAX_DEFERRALS", "20"))
+PUMP_INTERVAL = float(os.getenv("DEFERRAL_PUMP_INTERVAL", "0.5"))
+MAX_DEFER_SECONDS = float(os.getenv("MAX_DEFER_SECONDS", "60"))
+
+_deferred = counter("deferred_messages_total", "Messages parked until an LLM permit is available", ["queue", "topic"])
+_dropped = counter("deferred_messages_dropped_total", "Messages dropped after too many deferrals", ["queue", "topic"])
+_queue_seconds = histogram("deferred_message_queue_seconds", "Time a message spent deferred before re-delivery", ["queue"])
+_backlog = gauge("deferred_messages_backlog", "Messages currently parked", ["queue"])
+
+# KEYS[1]=zset; ARGV: now, batch  -> due members, removed atomically
+_CLAIM_LUA = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #items > 0 then
+  redis.call('ZREM', KEYS[1], unpack(items))
+end
+return items
+"""
+
+DEFER_META_KEY = "_deferral"
+
+
+class DeferredQueue:
+    def __init__(self, queue: str, kafka_client, redis_client=None):
+        self.queue = queue
+        self.key = f"deferred:{queue}"
+        self.kafka = kafka_client
+        self.r = _ensure_redis(redis_client)
+        self._claim = self.r.register_script(_CLAIM_LUA) if self.r is not None else None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def defer(self, topic: str, value: Dict[str, Any], key: Optional[str], delay: float) -> bool:
+        """
+        Park a message for `delay` seconds (with jitter so replicas don't wake in lockstep).
+        Returns False when the message was dropped after MAX_DEFERRALS attempts.
+        """
+        meta = dict(value.get(DEFER_META_KEY) or {})
+        attempts = int(meta.get("attempts", 0)) + 1
+        if attempts > MAX_DEFERRALS:
+            logger.error("Dropping message key=%s topic=%s after %d deferrals", key, topic, attempts - 1)
+            _dropped.inc(queue=self.queue, topic=topic)
+            return False
+        meta["attempts"] = attempts
+        meta.setdefault("first_deferred_at", time.time())
+        # exponential growth on repeated deferrals, capped
+        delay = min(max(delay, 0.1) * (1.5 ** (attempts - 1)), MAX_DEFER_SECONDS)
+        item = json.dumps({
+            "id": uuid.uuid4().hex,
+            "topic": topic,
+            "key": key,
+            "deferred_at": time.time(),
+            "value": {**value, DEFER_META_KEY: meta},
+        })
+        due = time.time() + delay * random.uniform(0.8, 1.2)
+        if self.r is None:
+            raise RuntimeError("Redis client not available")
+        self.r.zadd(self.key, {item: due})
+        _deferred.inc(queue=self.queue, topic=topic)
+        logger.info("Deferred message key=%s topic=%s for %.1fs (attempt %d)", key, topic, delay, attempts)
+        return True
+
+    def pump_once(self, batch: int = 100) -> int:
+        items = self._claim(keys=[self.key], args=[time.time(), batch])
+        now = time.time()
+        for raw in items:
+            try:
+                item = json.loads(raw)
+                self.kafka.produce(item["topic"], item["value"], key=item.get("key"), flush=False)
+                _queue_seconds.observe(now - item.get("deferred_at", now), queue=self.queue)
+            except Exception:
+                logger.exception("Failed to re-publish deferred message; parking it again")
+                self.r.zadd(self.key, {raw: now + PUMP_INTERVAL * 4})
+        if items:
+            self.kafka.flush()
+        return len(items)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                moved = self.pump_once()
+                _backlog.set(self.r.zcard(self.key), queue=self.queue)
+                if moved:
+                    continue
+            except Exception:
+                logger.exception("Deferred queue pump failed")
+            self._stop.wait(PUMP_INTERVAL)
+
+    def start(self) -> None:
+        if self.r is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"deferral-{self.queue}")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
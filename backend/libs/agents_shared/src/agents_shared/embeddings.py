@@ -0,0 +1,86 @@
+"""Pluggable text embedders used by the document retrieval index.
+
+EMBEDDER selects the implementation:
+  * ``hashing`` (default) — feature-hashed word and character n-grams, pure Python,
+    no model download; robust enough to Russian inflection for chunk retrieval;
+  * ``sentence-transformers:<model>`` — a local CPU model, e.g.
+    ``sentence-transformers:sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2``.
+
+The vector dimension must match ``document_chunks.embedding`` (EMBEDDING_DIM, 384).
+"""
+import hashlib
+import math
+import os
+import re
+from typing import List, Protocol, Sequence
+
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "384"))
+EMBEDDER = os.getenv("EMBEDDER", "hashing")
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class Embedder(Protocol):
+    dim: int
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        ...
+
+
+class HashingEmbedder:
+    """Signed feature hashing over words and in-word character trigrams, L2-normalised."""
+
+    def __init__(self, dim: int = EMBEDDING_DIM, trigram_weight: float = 0.5):
+        self.dim = dim
+        self.trigram_weight = trigram_weight
+
+    def _features(self, text: str):
+        for word in _WORD_RE.findall(text.lower()):
+            yield word, 1.0
+            if len(word) > 3:
+                padded = f"#{word}#"
+                for i in range(len(padded) - 2):
+                    yield padded[i:i + 3], self.trigram_weight
+
+    def _embed_one(self, text: str) -> List[float]:
+        counts = {}
+        for feature, weight in self._features(text):
+            h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            idx = h % self.dim
+            sign = 1.0 if (h >> 63) & 1 else -1.0
+            counts[idx] = counts.get(idx, 0.0) + sign * weight
+        vec = [0.0] * self.dim
+        for idx, value in counts.items():
+            # sublinear tf keeps repeated boilerplate from dominating
+            vec[idx] = math.copysign(1.0 + math.log(abs(value)), value) if abs(value) >= 1.0 else value
+        norm = math.sqrt(sum(v * v for v in vec))
+        if norm:
+            vec = [v / norm for v in vec]
+        return vec
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        return [self._embed_one(t) for t in texts]
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        vectors = self.model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True)
+        return [v.tolist() for v in vectors]
+
+
+def get_embedder(spec: str = EMBEDDER) -> Embedder:
+    if spec.startswith("sentence-transformers:"):
+        embedder = SentenceTransformerEmbedder(spec.split(":", 1)[1])
+    elif spec == "hashing":
+        embedder = HashingEmbedder()
+    else:
+        raise ValueError(f"Unknown EMBEDDER: {spec}")
+    if embedder.dim != EMBEDDING_DIM:
+        raise ValueError(f"Embedder dimension {embedder.dim} does not match EMBEDDING_DIM={EMBEDDING_DIM}")
+    return embedder
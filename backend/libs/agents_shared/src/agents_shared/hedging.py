@@ -0,0 +1,251 @@
+"""Per-call deadlines and request hedging for LLM calls.
+
+Each call runs in a worker thread under a deadline. When hedging is enabled and the
+call is still running after the template's observed p95 latency, an identical second
+request is issued; the first successful response wins and the loser is cancelled
+(its HTTP client is closed). A hedge budget caps hedged requests at a fraction of
+traffic so a slow provider is not hit with twice the load.
+
+:meth:`HedgedCaller.acall` is the asyncio counterpart: the loser is simply cancelled.
+
+Latency per template is kept in a sliding window (for the threshold) and exported
+as the ``llm_template_latency_seconds`` histogram.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+from .metrics import counter, histogram
+
+logger = logging.getLogger("agents_shared.hedging")
+
+HEDGING_ENABLED = os.getenv("LLM_HEDGING", "false").lower() in ("1", "true", "yes")
+DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+HEDGE_BUDGET_RATIO = float(os.getenv("LLM_HEDGE_BUDGET_RATIO", "0.05"))
+HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "10.0"))
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "16"))
+LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "500"))
+
+_template_latency = histogram("llm_template_latency_seconds", "Winning LLM call latency per prompt template", ["template"])
+_hedges = counter("llm_hedged_requests_total", "Hedge requests issued", ["template"])
+_hedge_wins = counter("llm_hedge_wins_total", "Calls where the hedge answered first", ["template"])
+_hedge_skipped = counter("llm_hedge_skipped_total", "Hedges not issued because the budget was exhausted", ["template"])
+_deadline_exceeded = counter("llm_deadline_exceeded_total", "LLM calls that missed their deadline", ["template"])
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CancelToken:
+    """Lets the winner close the loser's client to abort its in-flight HTTP request."""
+
+    def __init__(self):
+        self.cancelled = False
+        self._resource = None
+        self._lock = threading.Lock()
+
+    def bind(self, resource) -> None:
+        with self._lock:
+            self._resource = resource
+            cancelled = self.cancelled
+        if cancelled:
+            self._close(resource)
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            resource = self._resource
+        if resource is not None:
+            self._close(resource)
+
+    @staticmethod
+    def _close(resource) -> None:
+        try:
+            resource.close()
+        except Exception:
+            logger.debug("Failed to close cancelled LLM client", exc_info=True)
+
+
+class LatencyTracker:
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, template: str, seconds: float) -> None:
+        _template_latency.observe(seconds, template=template)
+        with self._lock:
+            samples = self._samples.get(template)
+            if samples is None:
+                samples = deque(maxlen=self.window)
+                self._samples[template] = samples
+            samples.append(seconds)
+
+    def percentile(self, template: str, q: float) -> Optional[float]:
+        with self._lock:
+            samples = list(self._samples.get(template) or ())
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        samples.sort()
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class HedgeBudget:
+    """Every primary call earns `ratio` of a hedge; a hedge spends one."""
+
+    def __init__(self, ratio: float = HEDGE_BUDGET_RATIO, burst: float = 5.0):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def earn(self) -> None:
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class HedgedCaller:
+    def __init__(self, enabled: bool = HEDGING_ENABLED, workers: int = HEDGE_WORKERS):
+        self.enabled = enabled
+        self.latency = LatencyTracker()
+        self.budget = HedgeBudget()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-call")
+
+    def hedge_delay(self, template: str) -> float:
+        p = self.latency.percentile(template, HEDGE_PERCENTILE)
+        return max(HEDGE_MIN_DELAY, p if p is not None else HEDGE_DEFAULT_DELAY)
+
+    def call(self, fn: Callable[..., Any], payload: Dict[str, Any], template: str = "unknown",
+             deadline: float = DEADLINE_SECONDS) -> Any:
+        """
+        Run fn(payload, cancel_token, hedge) under a deadline, hedging once if it is slow.
+        Exceptions of the primary call propagate; a failed hedge is ignored.
+        """
+        started = time.monotonic()
+        deadline_at = started + deadline
+        self.budget.earn()
+        tokens: Dict[Future, CancelToken] = {}
+
+        def submit(hedge: bool) -> Future:
+            token = CancelToken()
+            future = self._pool.submit(fn, payload, token, hedge)
+            tokens[future] = token
+            return future
+
+        primary = submit(False)
+        pending = {primary}
+        hedge: Optional[Future] = None
+
+        if self.enabled:
+            done, _ = wait({primary}, timeout=min(self.hedge_delay(template), deadline))
+            if not done:
+                if self.budget.try_spend():
+                    hedge = submit(True)
+                    pending.add(hedge)
+                    _hedges.inc(template=template)
+                    logger.info("Hedging slow LLM call template=%s after %.2fs", template, time.monotonic() - started)
+                else:
+                    _hedge_skipped.inc(template=template)
+
+        try:
+            while pending:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    error = future.exception()
+                    if error is None:
+                        self.latency.observe(template, time.monotonic() - started)
+                        if future is hedge:
+                            _hedge_wins.inc(template=template)
+                        return future.result()
+                    if future is primary and hedge is None:
+                        raise error
+                    logger.info("%s LLM request failed: %s", "Hedge" if future is hedge else "Primary", error)
+                if not pending:
+                    # both failed — surface the primary's error
+                    raise primary.exception()
+            _deadline_exceeded.inc(template=template)
+            raise DeadlineExceeded(f"LLM call for template {template} exceeded {deadline:.1f}s deadline")
+        finally:
+            for future, token in tokens.items():
+                if not future.done():
+                    future.cancel()
+                    token.cancel()
+
+    async def acall(self, fn: Callable[[Dict[str, Any], bool], Awaitable[Any]], payload: Dict[str, Any],
+                    template: str = "unknown", deadline: float = DEADLINE_SECONDS) -> Any:
+        """Async variant of call(): fn(payload, hedge) is a coroutine function."""
+        started = time.monotonic()
+        deadline_at = started + deadline
+        self.budget.earn()
+
+        primary = asyncio.ensure_future(fn(payload, False))
+        tasks: Set[asyncio.Future] = {primary}
+        pending = {primary}
+        hedge: Optional[asyncio.Future] = None
+        try:
+            if self.enabled:
+                done, _ = await asyncio.wait({primary}, timeout=min(self.hedge_delay(template), deadline))
+                if not done:
+                    if self.budget.try_spend():
+                        hedge = asyncio.ensure_future(fn(payload, True))
+                        tasks.add(hedge)
+                        pending.add(hedge)
+                        _hedges.inc(template=template)
+                        logger.info("Hedging slow LLM call template=%s after %.2fs", template, time.monotonic() - started)
+                    else:
+                        _hedge_skipped.inc(template=template)
+
+            while pending:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        self.latency.observe(template, time.monotonic() - started)
+                        if task is hedge:
+                            _hedge_wins.inc(template=template)
+                        return task.result()
+                    if task is primary and hedge is None:
+                        raise error
+                    logger.info("%s LLM request failed: %s", "Hedge" if task is hedge else "Primary", error)
+                if not pending:
+                    raise primary.exception()
+            _deadline_exceeded.inc(template=template)
+            raise DeadlineExceeded(f"LLM call for template {template} exceeded {deadline:.1f}s deadline")
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+_hedger: Optional[HedgedCaller] = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger() -> HedgedCaller:
+    global _hedger
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = HedgedCaller()
+        return _hedger
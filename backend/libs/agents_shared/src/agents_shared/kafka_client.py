@@ -1,9 +1,10 @@
 import json
 import logging
 import os
+import threading
 
 from confluent_kafka import Producer, Consumer, KafkaError
-from typing import Callable, Optional
+from typing import Callable, List, Optional, Set, Tuple
 
 KAFKA_BOOTSTRAP = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092")
 
@@ -17,12 +18,48 @@ class KafkaProducer:
             'linger.ms': 5,
         }
         self.p = Producer(conf)
+        # номера отправленных сообщений без подтверждения брокера
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._undelivered: Set[int] = set()
 
     def produce(self, topic: str, value: dict, key: Optional[str] = None, on_delivery: Optional[Callable] = None):
         data = json.dumps(value).encode('utf-8')
-        self.p.produce(topic, value=data, key=key, on_delivery=on_delivery)
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self._undelivered.add(seq)
+
+        def delivered(err, msg):
+            with self._lock:
+                self._undelivered.discard(seq)
+            if err is not None:
+                logger.error("Delivery to %s failed: %s", topic, err)
+            if on_delivery is not None:
+                on_delivery(err, msg)
+
+        try:
+            self.p.produce(topic, value=data, key=key, on_delivery=delivered)
+        except Exception:
+            with self._lock:
+                self._undelivered.discard(seq)
+            raise
         self.p.poll(0)
 
+    def produced(self) -> int:
+        """Sequence number of the last message handed to the producer."""
+        with self._lock:
+            return self._seq
+
+    def delivered_through(self) -> int:
+        """Highest sequence number such that it and every earlier message got a delivery report."""
+        with self._lock:
+            return min(self._undelivered) - 1 if self._undelivered else self._seq
+
+    def poll(self, timeout: float = 0):
+        """Serve pending delivery reports."""
+        self.p.poll(timeout)
+
     def flush(self):
         self.p.flush()
 
@@ -37,13 +74,15 @@ class KafkaConsumer:
             'client.id': client_id,
         }
         self.c = Consumer(conf)
+        self.topics = topics
         if topics:
             self.c.subscribe(topics)
 
-    def consume_loop(self, handler: Callable[[str, dict, Optional[str]], None], poll_timeout=1.0):
-        """Бесконечный цикл потребления сообщений"""
+    def consume_loop(self, handler: Callable[[str, dict, Optional[str]], None], poll_timeout=1.0,
+                     should_stop: Optional[Callable[[], bool]] = None):
+        """Цикл потребления сообщений; завершается, когда should_stop() вернёт True (текущее сообщение дообрабатывается)"""
         try:
-            while True:
+            while not (should_stop and should_stop()):
                 msg = self.c.poll(poll_timeout)
                 if msg is None:
                     continue
@@ -65,6 +104,36 @@ class KafkaConsumer:
         finally:
             self.c.close()
 
+    def consume_batches(self, handler: Callable[[List[Tuple[str, dict, Optional[str]]]], None], batch_size: int = 64,
+                        poll_timeout=1.0, should_stop: Optional[Callable[[], bool]] = None):
+        """Как consume_loop, но отдаёт обработчику пачки до batch_size сообщений; оффсеты коммитятся после пачки"""
+        try:
+            while not (should_stop and should_stop()):
+                msgs = self.c.consume(num_messages=batch_size, timeout=poll_timeout)
+                if not msgs:
+                    continue
+
+                batch = []
+                for msg in msgs:
+                    if msg.error():
+                        if msg.error().code() != KafkaError._PARTITION_EOF:
+                            logger.error("Consumer error: %s", msg.error())
+                        continue
+                    try:
+                        key = msg.key().decode() if msg.key() else None
+                        batch.append((msg.topic(), json.loads(msg.value().decode('utf-8')), key))
+                    except Exception:
+                        logger.exception("Failed to decode message topic=%s offset=%s", msg.topic(), msg.offset())
+
+                try:
+                    if batch:
+                        handler(batch)
+                    self.c.commit(asynchronous=False)
+                except Exception:
+                    logger.exception("Error handling batch of %d messages", len(batch))
+        finally:
+            self.c.close()
+
 
 class KafkaClient:
     def __init__(
@@ -82,15 +151,34 @@ class KafkaClient:
         )
         self.on_message = on_message
 
-    def produce(self, topic: str, value: dict, key: Optional[str] = None):
-        """Отправляет сообщение в Kafka"""
+    def produce(self, topic: str, value: dict, key: Optional[str] = None, flush: bool = True):
+        """Отправляет сообщение в Kafka.
+
+        flush=False оставляет сообщение в буфере продюсера (linger.ms) — используется
+        для потоковых чанков, где ожидание подтверждения на каждое сообщение слишком дорого.
+        """
         self.producer.produce(topic, value, key=key)
+        if flush:
+            self.producer.flush()
+
+    def flush(self):
         self.producer.flush()
 
-    def listen_forever(self, poll_timeout: float = 1.0):
-        """Запускает бесконечный цикл прослушивания сообщений"""
+    def listen_forever(self, poll_timeout: float = 1.0, should_stop: Optional[Callable[[], bool]] = None):
+        """Запускает цикл прослушивания сообщений до сигнала остановки"""
         if not self.on_message:
             logger.warning("No on_message handler set")
             return
 
-        self.consumer.consume_loop(self.on_message, poll_timeout)
+        try:
+            self.consumer.consume_loop(self.on_message, poll_timeout, should_stop=should_stop)
+        finally:
+            self.producer.flush()
+
+    def listen_batches(self, handler: Callable[[List[Tuple[str, dict, Optional[str]]]], None], batch_size: int = 64,
+                       poll_timeout: float = 1.0, should_stop: Optional[Callable[[], bool]] = None):
+        """Цикл пакетной обработки: handler получает список (topic, value, key)"""
+        try:
+            self.consumer.consume_batches(handler, batch_size, poll_timeout, should_stop=should_stop)
+        finally:
+            self.producer.flush()
@@ -0,0 +1,128 @@
+"""Prometheus metrics shared by the API and the agents.
+
+Thin wrappers over ``prometheus_client`` that keep the calling convention used across
+the code base: metrics are declared with :func:`counter`, :func:`gauge` and
+:func:`histogram`, and label values are passed as keyword arguments
+(``_requests.inc(result="hit")``). The API serves :func:`render_metrics` on ``/metrics``;
+agents expose the same registry with :func:`start_metrics_server` (enabled by ``METRICS_PORT``).
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from typing import Dict, Sequence
+
+import prometheus_client
+from prometheus_client import REGISTRY, generate_latest
+
+logger = logging.getLogger("agents_shared.metrics")
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# seconds; tuned for network + LLM latencies
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# *_created-серии удваивают вывод и нигде не используются
+prometheus_client.disable_created_metrics()
+
+
+class _Metric:
+    def __init__(self, metric, labelnames: Sequence[str]):
+        self._metric = metric
+        self.name = metric._name
+        self.labelnames = tuple(labelnames)
+
+    def _check(self, labels: Dict[str, str]) -> None:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+
+    def _child(self, labels: Dict[str, str]):
+        self._check(labels)
+        return self._metric.labels(**labels) if labels else self._metric
+
+    def _sample(self, suffix: str, labels: Dict[str, str]) -> float:
+        # чтение не должно создавать пустую серию с этими метками
+        self._check(labels)
+        value = REGISTRY.get_sample_value(self.name + suffix, {k: str(v) for k, v in labels.items()})
+        return value or 0.0
+
+
+class Counter(_Metric):
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        self._child(labels).inc(amount)
+
+    def value(self, **labels) -> float:
+        return self._sample("_total", labels)
+
+
+class Gauge(_Metric):
+    def set(self, value: float, **labels) -> None:
+        self._child(labels).set(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        self._child(labels).inc(amount)
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self._child(labels).dec(amount)
+
+    def value(self, **labels) -> float:
+        return self._sample("", labels)
+
+
+class Histogram(_Metric):
+    def observe(self, value: float, **labels) -> None:
+        self._child(labels).observe(value)
+
+    def count(self, **labels) -> int:
+        return int(self._sample("_count", labels))
+
+
+_metrics: Dict[str, _Metric] = {}
+_lock = threading.Lock()
+
+
+def _get_or_create(cls, factory, name: str, description: str, labelnames: Sequence[str], **kwargs) -> _Metric:
+    # модуль может импортироваться повторно (тесты, перезагрузка) — prometheus_client не даёт
+    # зарегистрировать имя дважды, поэтому возвращаем уже созданную метрику
+    with _lock:
+        existing = _metrics.get(name)
+        if existing is not None:
+            if not isinstance(existing, cls) or existing.labelnames != tuple(labelnames):
+                raise ValueError(f"metric {name} already registered with a different type or labels")
+            return existing
+        metric = cls(factory(name, description, labelnames, **kwargs), labelnames)
+        _metrics[name] = metric
+        return metric
+
+
+def counter(name: str, description: str, labelnames: Sequence[str] = ()) -> Counter:
+    return _get_or_create(Counter, prometheus_client.Counter, name, description, labelnames)
+
+
+def gauge(name: str, description: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return _get_or_create(Gauge, prometheus_client.Gauge, name, description, labelnames)
+
+
+def histogram(name: str, description: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return _get_or_create(Histogram, prometheus_client.Histogram, name, description, labelnames, buckets=buckets)
+
+
+def render_metrics() -> str:
+    """All metrics of the process in the Prometheus text exposition format."""
+    return generate_latest(REGISTRY).decode("utf-8")
+
+
+def start_metrics_server(port: int = METRICS_PORT):
+    """Serve /metrics from a daemon thread. Does nothing when port is 0."""
+    if not port:
+        return None
+    try:
+        started = prometheus_client.start_http_server(port)
+    except OSError:
+        logger.exception("Failed to start metrics server on port %s", port)
+        return None
+    logger.info("Metrics server listening on :%s/metrics", port)
+    # prometheus_client < 0.20 returns nothing
+    return started[0] if started else None
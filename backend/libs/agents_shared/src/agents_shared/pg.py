@@ -0,0 +1,64 @@
+"""Postgres connection helpers for agents.
+
+Agents talk to Postgres with plain psycopg (no ORM); the schema itself is owned by
+the API's Alembic migrations.
+"""
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+logger = logging.getLogger("agents_shared.pg")
+
+
+def get_database_url() -> str:
+    url = os.getenv("DATABASE_URL")
+    if url:
+        # accept SQLAlchemy-style URLs as well
+        return url.replace("postgresql+psycopg://", "postgresql://", 1)
+    return "postgresql://{user}:{password}@{host}:{port}/{db}".format(
+        user=os.getenv("POSTGRES_USER", "user"),
+        password=os.getenv("POSTGRES_PASSWORD", "postgres"),
+        host=os.getenv("POSTGRES_SERVER", "db"),
+        port=os.getenv("POSTGRES_PORT", "5432"),
+        db=os.getenv("POSTGRES_DB", "dbname"),
+    )
+
+
+class PgConnection:
+    """Lazily opened, self-healing single connection shared by one agent process."""
+
+    def __init__(self, dsn: Optional[str] = None):
+        self.dsn = dsn or get_database_url()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        import psycopg
+
+        return psycopg.connect(self.dsn, autocommit=False)
+
+    @contextmanager
+    def transaction(self) -> Iterator["psycopg.Connection"]:  # noqa: F821
+        """Yield an open connection; commit on success, rollback and drop it on failure."""
+        with self._lock:
+            if self._conn is None or self._conn.closed:
+                self._conn = self._connect()
+            conn = self._conn
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                try:
+                    conn.rollback()
+                except Exception:
+                    # connection is broken — reopen on next use
+                    self._conn = None
+                raise
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and not self._conn.closed:
+                self._conn.close()
+            self._conn = None
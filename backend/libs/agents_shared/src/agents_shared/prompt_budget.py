@@ -0,0 +1,255 @@
+"""Token-budget-aware prompt assembly shared by the legal and assistant agents.
+
+A prompt is a template plus named sections (document context, previous analysis,
+history, the user's question...). The builder counts tokens with a tokenizer for the
+target model, splits the budget left after the fixed template text across sections
+by weight, and trims each section at sentence/clause boundaries instead of cutting
+characters mid-clause.
+
+PROMPT_TOKENIZER names a Hugging Face tokenizer matching the model (requires the
+``tokenizers`` package, e.g. ``ai-sage/GigaChat-20B-A3B-instruct``); without it a
+heuristic calibrated for Russian text is used. Exact prompt token counts reported by
+GigaChat (``usage.prompt_tokens``) are recorded by the LLM clients.
+"""
+import logging
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, List, NamedTuple, Protocol, Sequence, Tuple
+
+from .metrics import counter, histogram
+
+logger = logging.getLogger("agents_shared.prompt_budget")
+
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "")
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "32768"))
+PROMPT_SAFETY_TOKENS = int(os.getenv("PROMPT_SAFETY_TOKENS", "256"))
+
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+_prompt_tokens = histogram("llm_prompt_size_tokens", "Assembled prompt size in tokens", ["template"], buckets=TOKEN_BUCKETS)
+_prompt_tokens_total = counter("llm_prompt_tokens_total", "Prompt tokens sent to the LLM", ["template"])
+_sections_trimmed = counter("llm_prompt_sections_trimmed_total", "Prompt sections trimmed to fit the budget", ["template", "section"])
+_usage_tokens = counter("llm_usage_tokens_total", "Tokens billed by the LLM as reported in responses", ["template", "kind"])
+_call_seconds = histogram("llm_call_seconds", "LLM call latency", ["template"])
+
+_PIECE_RE = re.compile(r"[A-Za-z]+|[А-Яа-яЁё]+|\d+|\S", re.UNICODE)
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+_CLAUSE_RE = re.compile(r"(?<=[;:,])\s+")
+
+
+class TokenCounter(Protocol):
+    def count(self, text: str) -> int:
+        ...
+
+
+class HeuristicTokenCounter:
+    """
+    Approximates BPE tokenizers of GigaChat-family models without loading one:
+    Cyrillic words average ~3 characters per token, Latin ~4, digits ~3, punctuation 1.
+    """
+
+    def count(self, text: str) -> int:
+        total = 0
+        for piece in _PIECE_RE.findall(text or ""):
+            ch = piece[0]
+            if ch.isalpha():
+                per_token = 4 if ch.isascii() else 3
+                total += math.ceil(len(piece) / per_token)
+            elif ch.isdigit():
+                total += math.ceil(len(piece) / 3)
+            else:
+                total += 1
+        return total
+
+
+class HFTokenCounter:
+    def __init__(self, name: str):
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_pretrained(name)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+@lru_cache(maxsize=1)
+def get_token_counter() -> TokenCounter:
+    if PROMPT_TOKENIZER:
+        try:
+            return HFTokenCounter(PROMPT_TOKENIZER)
+        except Exception:
+            logger.exception("Failed to load tokenizer %s; using heuristic token counts", PROMPT_TOKENIZER)
+    return HeuristicTokenCounter()
+
+
+def prompt_budget(max_output_tokens: int, cap: int = 0) -> int:
+    """Tokens available for the prompt once the completion and a safety margin are reserved."""
+    budget = LLM_CONTEXT_TOKENS - max_output_tokens - PROMPT_SAFETY_TOKENS
+    if cap:
+        budget = min(budget, cap)
+    return max(budget, 0)
+
+
+# sentence -> clause -> word: trimming descends to a finer boundary only when a single unit overflows
+_SPLITTERS = (_SENTENCE_RE, _CLAUSE_RE, re.compile(r"\s+"))
+
+
+def _spans(text: str, pattern: re.Pattern) -> List[Tuple[int, int]]:
+    spans = []
+    pos = 0
+    for m in pattern.finditer(text):
+        if text[pos:m.start()].strip():
+            spans.append((pos, m.start()))
+        pos = m.end()
+    if text[pos:].strip():
+        spans.append((pos, len(text)))
+    return spans
+
+
+def trim_to_tokens(text: str, max_tokens: int, counter: TokenCounter, keep: str = "head", _level: int = 0) -> str:
+    """
+    Trim text to max_tokens on sentence boundaries, falling back to clauses and then words
+    for a single oversized sentence. keep="tail" keeps the end (e.g. the latest history).
+    Original formatting between the kept units is preserved.
+    """
+    if not text or max_tokens <= 0:
+        return ""
+    if counter.count(text) <= max_tokens:
+        return text
+    if _level >= len(_SPLITTERS):
+        return ""
+
+    spans = _spans(text, _SPLITTERS[_level])
+    if keep == "tail":
+        spans.reverse()
+    used = 0
+    taken = 0
+    for start, end in spans:
+        cost = counter.count(text[start:end])
+        if used + cost > max_tokens:
+            break
+        used += cost
+        taken += 1
+
+    if taken == 0:
+        start, end = spans[0]
+        return trim_to_tokens(text[start:end], max_tokens, counter, keep, _level + 1)
+    if keep == "tail":
+        return text[spans[taken - 1][0]:].strip()
+    return text[:spans[taken - 1][1]].strip()
+
+
+@dataclass
+class Section:
+    name: str
+    text: str
+    weight: float = 1.0
+    # required sections (the user's question) are never trimmed
+    required: bool = False
+    keep: str = "head"
+
+
+class PromptReport(NamedTuple):
+    template: str
+    budget: int
+    total_tokens: int
+    section_tokens: Dict[str, int]
+    trimmed: List[str]
+
+
+class BuiltPrompt(NamedTuple):
+    text: str
+    report: PromptReport
+
+
+@dataclass
+class PromptBuilder:
+    render: Callable[..., str]
+    counter: TokenCounter = field(default_factory=get_token_counter)
+
+    def _allocate(self, needs: Dict[str, int], weights: Dict[str, float], available: int) -> Dict[str, int]:
+        """Weighted water-filling: sections needing less than their share give the rest back."""
+        alloc: Dict[str, int] = {}
+        pending = dict(needs)
+        remaining = available
+        while pending and remaining > 0:
+            total_weight = sum(weights[n] for n in pending)
+            satisfied = {
+                n: need for n, need in pending.items()
+                if need <= remaining * weights[n] / total_weight
+            }
+            if not satisfied:
+                for n in pending:
+                    alloc[n] = int(remaining * weights[n] / total_weight)
+                return alloc
+            for n, need in satisfied.items():
+                alloc[n] = need
+                remaining -= need
+                del pending[n]
+        for n in pending:
+            alloc.setdefault(n, 0)
+        return alloc
+
+    def build(self, template: str, sections: Sequence[Section], budget: int, **fixed) -> BuiltPrompt:
+        counter = self.counter
+        empty = {s.name: "" for s in sections}
+        overhead = counter.count(self.render(template, **empty, **fixed))
+
+        values: Dict[str, str] = {}
+        section_tokens: Dict[str, int] = {}
+        available = budget - overhead
+        for s in sections:
+            if s.required:
+                values[s.name] = s.text
+                section_tokens[s.name] = counter.count(s.text)
+                available -= section_tokens[s.name]
+
+        flexible = [s for s in sections if not s.required]
+        needs = {s.name: counter.count(s.text) for s in flexible}
+        alloc = self._allocate(needs, {s.name: s.weight for s in flexible}, max(available, 0))
+
+        trimmed: List[str] = []
+        for s in flexible:
+            if needs[s.name] <= alloc[s.name]:
+                values[s.name] = s.text
+                section_tokens[s.name] = needs[s.name]
+                continue
+            values[s.name] = trim_to_tokens(s.text, alloc[s.name], counter, keep=s.keep)
+            section_tokens[s.name] = counter.count(values[s.name])
+            trimmed.append(s.name)
+            _sections_trimmed.inc(template=template, section=s.name)
+
+        text = self.render(template, **values, **fixed)
+        total = counter.count(text)
+        _prompt_tokens.observe(total, template=template)
+        _prompt_tokens_total.inc(total, template=template)
+        if trimmed:
+            logger.info("Prompt %s trimmed %s to fit %d tokens", template, trimmed, budget)
+        logger.debug("Prompt %s: %d tokens (budget %d) sections=%s", template, total, budget, section_tokens)
+        return BuiltPrompt(text, PromptReport(template, budget, total, section_tokens, trimmed))
+
+
+def record_llm_usage(metadata: Dict, response, latency: float) -> Dict:
+    """
+    Attach the model-reported token usage to the call metadata and export it, so cost
+    and latency can be tracked against prompt size. Returns the enriched metadata.
+    """
+    template = metadata.get("template", "unknown")
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    if prompt_tokens is not None:
+        _usage_tokens.inc(prompt_tokens, template=template, kind="prompt")
+    if completion_tokens is not None:
+        _usage_tokens.inc(completion_tokens, template=template, kind="completion")
+    _call_seconds.observe(latency, template=template)
+    logger.info(
+        "LLM call template=%s prompt_tokens=%s (estimated %s) completion_tokens=%s latency=%.2fs",
+        template, prompt_tokens, metadata.get("prompt_tokens"), completion_tokens, latency,
+    )
+    return {**metadata, "usage_prompt_tokens": prompt_tokens, "usage_completion_tokens": completion_tokens}
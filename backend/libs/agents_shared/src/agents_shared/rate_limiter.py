@@ -0,0 +1,437 @@
+"""Distributed LLM rate limiter and concurrency governor shared by all agent replicas.
+
+Every LLM call takes a permit: one token from a Redis token bucket (requests per
+second with burst) plus a slot in a Redis lease semaphore (concurrent calls), both
+per model. Priority classes share the same bucket but lower classes must leave a
+reserve for higher ones and may only use a fraction of the concurrency slots.
+
+429 responses shrink the model's effective rate for all replicas (multiplicative
+decrease) and open a cooldown window; successful calls slowly restore it (additive
+increase). A caller that cannot get a permit within ``max_wait`` gets
+:class:`PermitUnavailable` and is expected to defer the message (see
+:mod:`agents_shared.deferral`) instead of sleeping in a retry loop.
+
+Limits are configured with LLM_RATE_LIMITS (JSON, per model, "default" as fallback):
+
+    {"GigaChat": {"rps": 2, "burst": 5, "concurrency": 8}}
+
+and priority classes with LLM_PRIORITY_CLASSES:
+
+    {"interactive": {"reserve": 0.0, "concurrency_share": 1.0},
+     "batch": {"reserve": 0.5, "concurrency_share": 0.5}}
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+from .metrics import counter, gauge, histogram
+from .redis_storage import _ensure_redis
+
+logger = logging.getLogger("agents_shared.rate_limiter")
+
+DEFAULT_LIMITS = {"rps": 1.0, "burst": 5, "concurrency": 4}
+DEFAULT_PRIORITIES = {
+    "interactive": {"reserve": 0.0, "concurrency_share": 1.0},
+    "batch": {"reserve": 0.5, "concurrency_share": 0.5},
+}
+
+LLM_RATE_LIMITS: Dict[str, Dict[str, float]] = json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))
+LLM_PRIORITY_CLASSES: Dict[str, Dict[str, float]] = json.loads(os.getenv("LLM_PRIORITY_CLASSES", "{}")) or DEFAULT_PRIORITIES
+PERMIT_MAX_WAIT = float(os.getenv("LLM_PERMIT_MAX_WAIT", "5"))
+LEASE_TTL = float(os.getenv("LLM_PERMIT_LEASE_TTL", "120"))
+MIN_RATE_FACTOR = float(os.getenv("LLM_MIN_RATE_FACTOR", "0.1"))
+RATE_RECOVERY_STEP = float(os.getenv("LLM_RATE_RECOVERY_STEP", "0.05"))
+KEY_PREFIX = "llm:rl"
+
+_permit_wait = histogram("llm_permit_wait_seconds", "Time spent waiting for an LLM permit", ["model", "priority"])
+_permit_denied = counter("llm_permit_denied_total", "LLM permits not granted within max wait", ["model", "priority", "reason"])
+_throttled = counter("llm_throttled_total", "429 responses received from the LLM provider", ["model"])
+_inflight = gauge("llm_inflight_calls", "LLM calls in flight in this process", ["model"])
+_rate_factor = gauge("llm_rate_factor", "Adaptive multiplier applied to the configured LLM rate", ["model"])
+
+
+class PermitUnavailable(Exception):
+    """No permit within the allowed wait; the message should be deferred by retry_after seconds."""
+
+    def __init__(self, model: str, reason: str, retry_after: float):
+        super().__init__(f"LLM permit unavailable for {model}: {reason} (retry after {retry_after:.1f}s)")
+        self.model = model
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RateLimited(PermitUnavailable):
+    """The provider answered 429 despite the limiter; treated the same way as a missing permit."""
+
+
+# KEYS[1]=bucket hash, KEYS[2]=factor, KEYS[3]=cooldown
+# ARGV: rps, burst, now, reserve_tokens
+# returns {granted (0/1), wait_seconds * 1000}
+_BUCKET_LUA = """
+local cooldown = tonumber(redis.call('GET', KEYS[3]) or '0')
+local now = tonumber(ARGV[3])
+if cooldown > now then
+  return {0, math.ceil((cooldown - now) * 1000)}
+end
+local factor = tonumber(redis.call('GET', KEYS[2]) or '1')
+local rate = tonumber(ARGV[1]) * factor
+local burst = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local granted = 0
+local wait = 0
+if tokens - 1 >= reserve then
+  tokens = tokens - 1
+  granted = 1
+else
+  wait = (1 + reserve - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+return {granted, math.ceil(wait * 1000)}
+"""
+
+# KEYS[1]=bucket hash; ARGV: burst — return a token taken for a call that got no lease
+_REFUND_LUA = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+  redis.call('HSET', KEYS[1], 'tokens', math.min(tonumber(ARGV[1]), tokens + 1))
+end
+return 0
+"""
+
+# KEYS[1]=lease zset; ARGV: now, limit, lease_id, lease_ttl
+_ACQUIRE_LUA = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+  redis.call('ZADD', KEYS[1], now + tonumber(ARGV[4]), ARGV[3])
+  redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[4])) + 60)
+  return 1
+end
+return 0
+"""
+
+# KEYS[1]=factor; ARGV: multiplier, additive step, min, max
+_ADJUST_LUA = """
+local f = tonumber(redis.call('GET', KEYS[1]) or '1')
+f = f * tonumber(ARGV[1]) + tonumber(ARGV[2])
+f = math.max(tonumber(ARGV[3]), math.min(tonumber(ARGV[4]), f))
+redis.call('SET', KEYS[1], f, 'EX', 3600)
+return tostring(f)
+"""
+
+
+def _limits_for(model: str) -> Dict[str, float]:
+    conf = dict(DEFAULT_LIMITS)
+    conf.update(LLM_RATE_LIMITS.get("default", {}))
+    conf.update(LLM_RATE_LIMITS.get(model, {}))
+    return conf
+
+
+def _priority_for(priority: str) -> Dict[str, float]:
+    return LLM_PRIORITY_CLASSES.get(priority) or LLM_PRIORITY_CLASSES.get("interactive") or DEFAULT_PRIORITIES["interactive"]
+
+
+class RateLimiter:
+    def __init__(self, redis_client=None):
+        self.r = _ensure_redis(redis_client)
+        self._scripts: Dict[str, Any] = {}
+        self._calls_since_recovery: Dict[str, int] = {}
+
+    def _script(self, name: str, source: str):
+        script = self._scripts.get(name)
+        if script is None:
+            script = self.r.register_script(source)
+            self._scripts[name] = script
+        return script
+
+    def _keys(self, model: str):
+        base = f"{KEY_PREFIX}:{model}"
+        return f"{base}:bucket", f"{base}:factor", f"{base}:cooldown", f"{base}:leases"
+
+    def _try_token(self, model: str, limits: Dict[str, float], reserve_share: float) -> float:
+        """Returns 0 when a token was taken, otherwise the suggested wait in seconds."""
+        bucket, factor, cooldown, _ = self._keys(model)
+        granted, wait_ms = self._script("bucket", _BUCKET_LUA)(
+            keys=[bucket, factor, cooldown],
+            args=[limits["rps"], limits["burst"], time.time(), limits["burst"] * reserve_share],
+        )
+        return 0.0 if int(granted) else max(int(wait_ms) / 1000.0, 0.01)
+
+    def _try_lease(self, model: str, limit: int, lease_id: str) -> bool:
+        leases = self._keys(model)[3]
+        return bool(self._script("acquire", _ACQUIRE_LUA)(keys=[leases], args=[time.time(), limit, lease_id, LEASE_TTL]))
+
+    def _refund_token(self, model: str, limits: Dict[str, float]) -> None:
+        try:
+            self._script("refund", _REFUND_LUA)(keys=[self._keys(model)[0]], args=[limits["burst"]])
+        except Exception:
+            logger.exception("Failed to refund LLM rate token for %s", model)
+
+    def _release(self, model: str, lease_id: str) -> None:
+        try:
+            self.r.zrem(self._keys(model)[3], lease_id)
+        except Exception:
+            # lease expires by itself after LEASE_TTL
+            logger.exception("Failed to release LLM lease %s for %s", lease_id, model)
+
+    def acquire(self, model: str, priority: str = "interactive", max_wait: float = PERMIT_MAX_WAIT) -> Optional[str]:
+        """
+        Take a rate token and a concurrency lease, waiting at most max_wait seconds.
+        Returns the lease id (None when Redis is unavailable and the limiter fails open).
+        """
+        if self.r is None:
+            return None
+        limits = _limits_for(model)
+        pclass = _priority_for(priority)
+        slots = max(1, int(limits["concurrency"] * pclass.get("concurrency_share", 1.0)))
+        started = time.monotonic()
+        deadline = started + max_wait
+        lease_id = uuid.uuid4().hex
+        try:
+            while True:
+                wait = self._try_token(model, limits, pclass.get("reserve", 0.0))
+                if wait == 0.0:
+                    break
+                if time.monotonic() + wait > deadline:
+                    _permit_denied.inc(model=model, priority=priority, reason="rate")
+                    raise PermitUnavailable(model, "rate", wait)
+                time.sleep(wait)
+            backoff = 0.05
+            while not self._try_lease(model, slots, lease_id):
+                if time.monotonic() + backoff > deadline:
+                    _permit_denied.inc(model=model, priority=priority, reason="concurrency")
+                    # вызова не будет — токен возвращается в бакет
+                    self._refund_token(model, limits)
+                    raise PermitUnavailable(model, "concurrency", backoff * 4)
+                time.sleep(backoff * (0.5 + random.random()))
+                backoff = min(backoff * 2, 1.0)
+        except PermitUnavailable:
+            raise
+        except Exception:
+            logger.exception("Rate limiter unavailable for %s; allowing call", model)
+            return None
+        finally:
+            _permit_wait.observe(time.monotonic() - started, model=model, priority=priority)
+        return lease_id
+
+    @contextmanager
+    def permit(self, model: str, priority: str = "interactive", max_wait: float = PERMIT_MAX_WAIT) -> Iterator[None]:
+        lease_id = self.acquire(model, priority, max_wait)
+        _inflight.inc(model=model)
+        try:
+            yield
+        except RateLimited:
+            raise
+        except Exception as e:
+            retry_after = throttle_retry_after(e)
+            if retry_after is not None:
+                self.report_throttled(model, retry_after)
+                raise RateLimited(model, "429", retry_after) from e
+            raise
+        else:
+            self._report_success(model)
+        finally:
+            _inflight.dec(model=model)
+            if lease_id:
+                self._release(model, lease_id)
+
+    def report_throttled(self, model: str, retry_after: float) -> None:
+        """Halve the shared rate and pause the bucket for every replica."""
+        _throttled.inc(model=model)
+        if self.r is None:
+            return
+        _, factor, cooldown, _ = self._keys(model)
+        try:
+            new_factor = float(self._script("adjust", _ADJUST_LUA)(keys=[factor], args=[0.5, 0, MIN_RATE_FACTOR, 1.0]))
+            self.r.set(cooldown, time.time() + retry_after, ex=max(1, int(retry_after) + 1))
+            _rate_factor.set(new_factor, model=model)
+            logger.warning("LLM %s throttled: rate factor %.2f, cooldown %.1fs", model, new_factor, retry_after)
+        except Exception:
+            logger.exception("Failed to record throttling for %s", model)
+
+    def _report_success(self, model: str) -> None:
+        # recover the shared rate gradually; writing on every call would make Redis the bottleneck
+        calls = self._calls_since_recovery.get(model, 0) + 1
+        if calls < 10 or self.r is None:
+            self._calls_since_recovery[model] = calls
+            return
+        self._calls_since_recovery[model] = 0
+        try:
+            new_factor = float(self._script("adjust", _ADJUST_LUA)(
+                keys=[self._keys(model)[1]], args=[1.0, RATE_RECOVERY_STEP, MIN_RATE_FACTOR, 1.0]
+            ))
+            _rate_factor.set(new_factor, model=model)
+        except Exception:
+            logger.debug("Failed to update rate factor for %s", model, exc_info=True)
+
+
+class AsyncRateLimiter(RateLimiter):
+    """
+    The same buckets, leases and adaptive rate as RateLimiter, driven by a redis.asyncio
+    client so that waiting for a permit does not block the event loop.
+    """
+
+    async def _try_token(self, model: str, limits: Dict[str, float], reserve_share: float) -> float:
+        bucket, factor, cooldown, _ = self._keys(model)
+        granted, wait_ms = await self._script("bucket", _BUCKET_LUA)(
+            keys=[bucket, factor, cooldown],
+            args=[limits["rps"], limits["burst"], time.time(), limits["burst"] * reserve_share],
+        )
+        return 0.0 if int(granted) else max(int(wait_ms) / 1000.0, 0.01)
+
+    async def _try_lease(self, model: str, limit: int, lease_id: str) -> bool:
+        leases = self._keys(model)[3]
+        return bool(await self._script("acquire", _ACQUIRE_LUA)(keys=[leases], args=[time.time(), limit, lease_id, LEASE_TTL]))
+
+    async def _refund_token(self, model: str, limits: Dict[str, float]) -> None:
+        try:
+            await self._script("refund", _REFUND_LUA)(keys=[self._keys(model)[0]], args=[limits["burst"]])
+        except Exception:
+            logger.exception("Failed to refund LLM rate token for %s", model)
+
+    async def _release(self, model: str, lease_id: str) -> None:
+        try:
+            await self.r.zrem(self._keys(model)[3], lease_id)
+        except Exception:
+            logger.exception("Failed to release LLM lease %s for %s", lease_id, model)
+
+    async def acquire(self, model: str, priority: str = "interactive", max_wait: float = PERMIT_MAX_WAIT) -> Optional[str]:
+        if self.r is None:
+            return None
+        limits = _limits_for(model)
+        pclass = _priority_for(priority)
+        slots = max(1, int(limits["concurrency"] * pclass.get("concurrency_share", 1.0)))
+        started = time.monotonic()
+        deadline = started + max_wait
+        lease_id = uuid.uuid4().hex
+        try:
+            while True:
+                wait = await self._try_token(model, limits, pclass.get("reserve", 0.0))
+                if wait == 0.0:
+                    break
+                if time.monotonic() + wait > deadline:
+                    _permit_denied.inc(model=model, priority=priority, reason="rate")
+                    raise PermitUnavailable(model, "rate", wait)
+                await asyncio.sleep(wait)
+            backoff = 0.05
+            while not await self._try_lease(model, slots, lease_id):
+                if time.monotonic() + backoff > deadline:
+                    _permit_denied.inc(model=model, priority=priority, reason="concurrency")
+                    await self._refund_token(model, limits)
+                    raise PermitUnavailable(model, "concurrency", backoff * 4)
+                await asyncio.sleep(backoff * (0.5 + random.random()))
+                backoff = min(backoff * 2, 1.0)
+        except (PermitUnavailable, asyncio.CancelledError):
+            raise
+        except Exception:
+            logger.exception("Rate limiter unavailable for %s; allowing call", model)
+            return None
+        finally:
+            _permit_wait.observe(time.monotonic() - started, model=model, priority=priority)
+        return lease_id
+
+    @asynccontextmanager
+    async def permit(self, model: str, priority: str = "interactive", max_wait: float = PERMIT_MAX_WAIT) -> AsyncIterator[None]:
+        lease_id = await self.acquire(model, priority, max_wait)
+        _inflight.inc(model=model)
+        try:
+            yield
+        except RateLimited:
+            raise
+        except Exception as e:
+            retry_after = throttle_retry_after(e)
+            if retry_after is not None:
+                await self.report_throttled(model, retry_after)
+                raise RateLimited(model, "429", retry_after) from e
+            raise
+        else:
+            await self._report_success(model)
+        finally:
+            _inflight.dec(model=model)
+            if lease_id:
+                await self._release(model, lease_id)
+
+    async def report_throttled(self, model: str, retry_after: float) -> None:
+        _throttled.inc(model=model)
+        if self.r is None:
+            return
+        _, factor, cooldown, _ = self._keys(model)
+        try:
+            new_factor = float(await self._script("adjust", _ADJUST_LUA)(keys=[factor], args=[0.5, 0, MIN_RATE_FACTOR, 1.0]))
+            await self.r.set(cooldown, time.time() + retry_after, ex=max(1, int(retry_after) + 1))
+            _rate_factor.set(new_factor, model=model)
+            logger.warning("LLM %s throttled: rate factor %.2f, cooldown %.1fs", model, new_factor, retry_after)
+        except Exception:
+            logger.exception("Failed to record throttling for %s", model)
+
+    async def _report_success(self, model: str) -> None:
+        calls = self._calls_since_recovery.get(model, 0) + 1
+        if calls < 10 or self.r is None:
+            self._calls_since_recovery[model] = calls
+            return
+        self._calls_since_recovery[model] = 0
+        try:
+            new_factor = float(await self._script("adjust", _ADJUST_LUA)(
+                keys=[self._keys(model)[1]], args=[1.0, RATE_RECOVERY_STEP, MIN_RATE_FACTOR, 1.0]
+            ))
+            _rate_factor.set(new_factor, model=model)
+        except Exception:
+            logger.debug("Failed to update rate factor for %s", model, exc_info=True)
+
+
+def throttle_retry_after(exc: BaseException) -> Optional[float]:
+    """
+    Return the suggested delay if exc (or its cause chain) is an HTTP 429 from the provider,
+    otherwise None. GigaChat's ResponseError carries (url, status_code, content, headers).
+    """
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        status = getattr(exc, "status_code", None)
+        headers = getattr(exc, "headers", None)
+        if status is None and len(getattr(exc, "args", ())) >= 2 and isinstance(exc.args[1], int):
+            status = exc.args[1]
+            headers = exc.args[3] if len(exc.args) >= 4 else None
+        if status == 429:
+            try:
+                return float((headers or {}).get("Retry-After", 1))
+            except (TypeError, ValueError, AttributeError):
+                return 1.0
+        exc = exc.__cause__ or exc.__context__
+    return None
+
+
+_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter(redis_client=None) -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter(redis_client)
+    return _limiter
+
+
+_async_limiter: Optional[AsyncRateLimiter] = None
+
+
+def get_async_rate_limiter(redis_client=None) -> AsyncRateLimiter:
+    """Limiter for the asyncio runtime; must be first called from inside the running event loop."""
+    global _async_limiter
+    if _async_limiter is None:
+        if redis_client is None:
+            import redis.asyncio as aioredis
+
+            redis_client = aioredis.from_url(os.getenv("REDIS_URL", "redis://redis:6379/0"), decode_responses=True)
+        _async_limiter = AsyncRateLimiter(redis_client)
+    return _async_limiter
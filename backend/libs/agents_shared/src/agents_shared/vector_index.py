@@ -0,0 +1,162 @@
+"""pgvector-backed chunk index for parsed documents.
+
+Documents are split into overlapping chunks at paragraph/sentence boundaries,
+embedded and stored in ``document_chunks`` keyed by session and file.
+Follow-up questions retrieve only the top-k chunks instead of the whole text.
+
+A search is always scoped to one session (and optionally one file), which holds a
+few hundred chunks at most, so it is an exact cosine scan over the rows found via the
+``(session_id, file_id)`` index. An HNSW scan over the whole table with the session
+as a post-filter would return fewer than k rows, or none, once other sessions' chunks
+fill the ``ef_search`` candidate list.
+"""
+import logging
+import os
+import re
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from .embeddings import Embedder
+from .pg import PgConnection
+
+logger = logging.getLogger("agents_shared.vector_index")
+
+CHUNK_SIZE = int(os.getenv("RETRIEVAL_CHUNK_SIZE", "1200"))
+CHUNK_OVERLAP = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP", "200"))
+TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?;…])\s+")
+
+
+class RetrievedChunk(NamedTuple):
+    file_id: str
+    chunk_index: int
+    content: str
+    score: float
+
+
+def _units(text: str) -> List[str]:
+    """Paragraphs, further split into sentences when a paragraph alone exceeds the chunk size."""
+    units = []
+    for para in _PARAGRAPH_RE.split(text):
+        para = para.strip()
+        if not para:
+            continue
+        if len(para) <= CHUNK_SIZE:
+            units.append(para)
+            continue
+        for sentence in _SENTENCE_RE.split(para):
+            sentence = sentence.strip()
+            # hard wrap pathological sentences (OCR output without punctuation)
+            while len(sentence) > CHUNK_SIZE:
+                units.append(sentence[:CHUNK_SIZE])
+                sentence = sentence[CHUNK_SIZE - CHUNK_OVERLAP:]
+            if sentence:
+                units.append(sentence)
+    return units
+
+
+def chunk_text(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    chunks: List[str] = []
+    current: List[str] = []
+    current_len = 0
+    for unit in _units(text or ""):
+        if current and current_len + len(unit) + 1 > size:
+            chunks.append("\n".join(current))
+            # carry trailing units over as overlap so a clause cut at the border stays retrievable
+            tail: List[str] = []
+            tail_len = 0
+            for prev in reversed(current):
+                if tail_len + len(prev) > overlap:
+                    break
+                tail.insert(0, prev)
+                tail_len += len(prev) + 1
+            current, current_len = tail, tail_len
+        current.append(unit)
+        current_len += len(unit) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _vector_literal(vec: List[float]) -> str:
+    return "[" + ",".join(f"{v:.6f}" for v in vec) + "]"
+
+
+class DocumentIndex:
+    def __init__(self, embedder: Embedder, pg: Optional[PgConnection] = None):
+        self.embedder = embedder
+        self.pg = pg or PgConnection()
+
+    def ingest(self, session_id: str, file_id: str, text: str) -> int:
+        return self.ingest_many([(session_id, file_id, text)])
+
+    def ingest_many(self, documents: Iterable[Tuple[str, str, str]]) -> int:
+        """
+        Bulk path: chunk and embed every document, then replace their chunks with a single COPY.
+        Returns the number of chunks written.
+        """
+        rows = []
+        keys = []
+        for session_id, file_id, text in documents:
+            chunks = chunk_text(text)
+            keys.append((session_id, file_id))
+            if not chunks:
+                continue
+            vectors = self.embedder.embed(chunks)
+            for idx, (content, vec) in enumerate(zip(chunks, vectors)):
+                rows.append((session_id, file_id, idx, content, _vector_literal(vec)))
+        if not keys:
+            return 0
+
+        with self.pg.transaction() as conn:
+            with conn.cursor() as cur:
+                cur.executemany(
+                    "DELETE FROM document_chunks WHERE session_id = %s AND file_id = %s",
+                    keys,
+                )
+                with cur.copy(
+                    "COPY document_chunks (session_id, file_id, chunk_index, content, embedding) FROM STDIN"
+                ) as copy:
+                    for row in rows:
+                        copy.write_row(row)
+        logger.info("Indexed %d chunks for %d documents", len(rows), len(keys))
+        return len(rows)
+
+    def search(self, session_id: str, query: str, k: int = TOP_K, file_id: Optional[str] = None) -> List[RetrievedChunk]:
+        if not query or not session_id:
+            return []
+        vec = _vector_literal(self.embedder.embed([query])[0])
+        where = "session_id = %(session_id)s"
+        params = {"vec": vec, "session_id": session_id, "k": k}
+        if file_id:
+            where += " AND file_id = %(file_id)s"
+            params["file_id"] = file_id
+        # MATERIALIZED не даёт планировщику выбрать HNSW-индекс: сначала строки сессии, потом точная сортировка
+        sql = (
+            "WITH scoped AS MATERIALIZED ("
+            "SELECT file_id, chunk_index, content, embedding <=> %(vec)s::vector AS distance "
+            f"FROM document_chunks WHERE {where}) "
+            "SELECT file_id, chunk_index, content, 1 - distance AS score "
+            "FROM scoped ORDER BY distance LIMIT %(k)s"
+        )
+
+        with self.pg.transaction() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                rows = cur.fetchall()
+        return [RetrievedChunk(r[0], r[1], r[2], float(r[3])) for r in rows]
+
+    def delete(self, session_id: str, file_id: str) -> None:
+        with self.pg.transaction() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM document_chunks WHERE session_id = %s AND file_id = %s",
+                    (session_id, file_id),
+                )
+
+
+def format_context(chunks: List[RetrievedChunk]) -> str:
+    """Render retrieved chunks in document order so the prompt reads naturally."""
+    ordered = sorted(chunks, key=lambda c: (c.file_id, c.chunk_index))
+    return "\n\n".join(f"[{c.file_id} #{c.chunk_index}]\n{c.content}" for c in ordered)
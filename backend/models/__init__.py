@@ -1,3 +1,5 @@
 from .session import Session
 from .user import User
 from .message import Message
+from .document_chunk import DocumentChunk
+from .analysis import ClauseFinding, DocumentAnalysis, SessionReport
@@ -0,0 +1,49 @@
+from datetime import datetime, timezone
+from typing import Optional, List
+
+from sqlalchemy import JSON, UniqueConstraint
+from sqlmodel import SQLModel, Field, Column
+
+
+class ClauseFinding(SQLModel, table=True):
+    """Content-addressed finding for one contract clause, reused across document versions."""
+    __tablename__ = "clause_findings"
+
+    # sha256 of the normalised clause text and the analysis prompt version
+    clause_hash: str = Field(primary_key=True)
+    finding: str = Field(nullable=False)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class DocumentAnalysis(SQLModel, table=True):
+    __tablename__ = "document_analyses"
+    __table_args__ = (
+        UniqueConstraint("session_id", "file_id", "content_hash", name="uq_document_analyses_version"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    session_id: str = Field(index=True, nullable=False)
+    file_id: str = Field(nullable=False)
+    content_hash: str = Field(index=True, nullable=False)
+    # hash over non-green findings: the summary is regenerated only when it changes
+    findings_hash: str = Field(nullable=False)
+    clause_hashes: List[str] = Field(sa_column=Column(JSON, nullable=False))
+    analysis_text: str = Field(nullable=False)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class SessionReport(SQLModel, table=True):
+    """Consolidated analysis of all documents of a session (main contract plus annexes)."""
+    __tablename__ = "session_reports"
+    __table_args__ = (
+        UniqueConstraint("session_id", "fingerprint", name="uq_session_reports_fingerprint"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    session_id: str = Field(index=True, nullable=False)
+    # hash over (file_id, analysis) pairs the report was built from
+    fingerprint: str = Field(nullable=False)
+    file_ids: List[str] = Field(sa_column=Column(JSON, nullable=False))
+    partial: bool = Field(default=False, nullable=False)
+    report_text: str = Field(nullable=False)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -0,0 +1,31 @@
+from datetime import datetime, timezone
+from typing import Optional, List
+
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import Index
+from sqlmodel import SQLModel, Field, Column
+
+# must match EMBEDDING_DIM of the agents' embedder
+EMBEDDING_DIM = 384
+
+
+class DocumentChunk(SQLModel, table=True):
+    __tablename__ = "document_chunks"
+    __table_args__ = (
+        Index("ix_document_chunks_session_file", "session_id", "file_id"),
+        Index(
+            "ix_document_chunks_embedding_hnsw",
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_cosine_ops"},
+        ),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    session_id: str = Field(nullable=False)
+    file_id: str = Field(nullable=False)
+    chunk_index: int = Field(nullable=False)
+    content: str = Field(nullable=False)
+    embedding: List[float] = Field(sa_column=Column(Vector(EMBEDDING_DIM), nullable=False))
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
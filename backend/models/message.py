@@ -3,11 +3,15 @@ from uuid import UUID, uuid4
 from typing import Optional, Dict, Any
 
 from sqlmodel import SQLModel, Field, Column
-from sqlalchemy import JSON
+from sqlalchemy import JSON, Index
 
 
 class Message(SQLModel, table=True):
     __tablename__ = "messages"
+    __table_args__ = (
+        # keyset pagination of chat history: WHERE user_id = ? AND (created_at, id) < (?, ?)
+        Index("ix_messages_user_created_id", "user_id", "created_at", "id"),
+    )
 
     id: UUID = Field(default_factory=uuid4, primary_key=True)
     # user_id stored as string to decouple from internal users table
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# тесты запускаются из backend/: python -m pytest tests
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (BACKEND, os.path.join(BACKEND, "libs", "agents_shared", "src")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
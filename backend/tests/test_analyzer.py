@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+
+from agents.legal.src.analyzer import IncompleteReview, IncrementalAnalyzer
+
+TEXT = (
+    "1. Арендатор вносит арендную плату ежемесячно до пятого числа.\n\n"
+    "2. Арендодатель передаёт помещение в исправном состоянии.\n\n"
+    "3. За просрочку платежа начисляется неустойка 1% в день."
+)
+
+
+class _Store:
+    def __init__(self):
+        self.findings = {}
+        self.saved = []
+
+    def get_by_content_hash(self, doc_hash):
+        return None
+
+    def get_clause_findings(self, hashes):
+        return {h: self.findings[h] for h in hashes if h in self.findings}
+
+    def save_clause_findings(self, findings):
+        self.findings.update(findings)
+
+    def find_previous_version(self, session_id, hashes):
+        return None
+
+    def save_analysis(self, analysis):
+        self.saved.append(analysis)
+        return f"analysis:{analysis.session_id}:{analysis.file_id}"
+
+
+class _LLM:
+    """Answers clause reviews from a script of replies; summaries get a fixed text."""
+
+    def __init__(self, *reviews):
+        self.reviews = list(reviews)
+        self.prompts = []
+
+    def __call__(self, payload):
+        self.prompts.append(payload)
+        if payload["metadata"]["template"] == "clause_review":
+            return SimpleNamespace(text=self.reviews.pop(0))
+        return SimpleNamespace(text="резюме")
+
+
+def test_clause_missing_from_answer_is_asked_again():
+    llm = _LLM("[1] ЗЕЛЁНЫЙ\n[3] КРАСНЫЙ: высокая неустойка", "[1] ЗЕЛЁНЫЙ")
+    store = _Store()
+
+    result = IncrementalAnalyzer(store, llm).analyze("s", "f", TEXT)
+
+    assert len(store.findings) == 3
+    # второй запрос содержит только пропущенный пункт
+    assert "помещение" in llm.prompts[1]["prompt"]
+    assert "неустойка" not in llm.prompts[1]["prompt"]
+    assert result.llm_calls == 3
+
+
+def test_review_fails_when_clause_stays_unanswered():
+    llm = _LLM("[1] ЗЕЛЁНЫЙ\n[3] КРАСНЫЙ", "")
+    store = _Store()
+
+    with pytest.raises(IncompleteReview) as e:
+        IncrementalAnalyzer(store, llm).analyze("s", "f", TEXT)
+
+    assert [c.label for c in e.value.missing] == ["2."]
+    assert store.saved == []
+    # полученные выводы сохранены и будут переиспользованы при следующей попытке
+    assert len(store.findings) == 2
@@ -0,0 +1,74 @@
+import pytest
+
+from agents.assistant.src.answer_cache import (
+    ANSWER_CACHE_THRESHOLD, PREFIX, AnswerCache, minhash, question_key, shingles, similarity, topic_of,
+)
+
+
+def _score(a: str, b: str) -> float:
+    return similarity(minhash(shingles(a)), minhash(shingles(b)))
+
+
+@pytest.mark.parametrize("a, b", [
+    ("нужно ли платить ндс", "не нужно платить ндс"),
+    ("может ли арендодатель расторгнуть договор", "может ли арендатор расторгнуть договор"),
+    ("срок 10 дней", "срок 100 дней"),
+    ("можно ли уволить работника", "нельзя ли уволить работника"),
+])
+def test_meaning_changes_change_the_key(a, b):
+    assert question_key(a) != question_key(b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("нужно ли платить ндс при упрощенке", "Нужно ли платить НДС на упрощенке?"),
+    ("сколько длится срок исковой давности", "Сколько длится срок исковой давности?"),
+])
+def test_paraphrases_keep_the_key_and_match(a, b):
+    assert question_key(a) == question_key(b)
+    assert _score(a, b) >= ANSWER_CACHE_THRESHOLD
+
+
+def test_role_declensions_share_a_key():
+    assert question_key("права арендатора") == question_key("арендатор") == "арендатор"
+    assert question_key("обязанности арендодателя") == "арендодател"
+
+
+def test_key_words_are_not_truncated():
+    # основа из 6 символов «аренда» у обеих сторон совпала бы
+    assert "атор" in shingles("арендатор")
+    assert "тель" in shingles("арендодатель")
+
+
+def test_topic():
+    assert topic_of("вычет по НДФЛ") == "tax"
+    assert topic_of("отпуск работника") == "labor"
+    assert topic_of("что такое доверенность") == "general"
+
+
+@pytest.fixture
+def cache():
+    fakeredis = pytest.importorskip("fakeredis")
+    return AnswerCache(fakeredis.FakeRedis(decode_responses=True))
+
+
+def test_stored_answer_is_found_by_a_paraphrase(cache):
+    entry_id = cache.store("сколько длится срок исковой давности", "Три года.")
+
+    assert cache.lookup("сколько длится срок исковой давности").entry_id == entry_id
+    hit = cache.lookup("Сколько длится срок исковой давности?")
+    assert hit.entry_id == entry_id
+    assert hit.answer == "Три года."
+
+
+def test_question_with_another_key_is_a_miss(cache):
+    cache.store("срок 10 дней", "Десять дней.")
+
+    assert cache.lookup("срок 100 дней") is None
+
+
+def test_expired_entry_is_dropped_from_the_bands(cache):
+    entry_id = cache.store("что такое доверенность", "Документ о полномочиях.")
+    cache.r.delete(f"{PREFIX}:entry:{entry_id}")
+
+    assert cache.lookup("что такое доверенность") is None
+    assert cache.r.zscore(f"{PREFIX}:lru", entry_id) is None
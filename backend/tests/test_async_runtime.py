@@ -0,0 +1,141 @@
+import asyncio
+
+from agents_shared.async_runtime import AsyncAgentRuntime, OffsetTracker
+
+
+def test_position_stops_at_lowest_message_in_flight():
+    tracker = OffsetTracker()
+    for offset in (10, 11, 12):
+        tracker.started("t", 0, offset)
+
+    assert tracker.finished("t", 0, 11) == 10
+    assert tracker.finished("t", 0, 12) is None
+    assert tracker.finished("t", 0, 10) == 13
+
+
+def test_partitions_are_tracked_separately():
+    tracker = OffsetTracker()
+    tracker.started("t", 0, 5)
+    tracker.started("t", 1, 7)
+
+    assert tracker.finished("t", 1, 7) == 8
+    assert tracker.finished("t", 0, 5) == 6
+
+
+def test_position_waits_for_delivery_of_outputs():
+    tracker = OffsetTracker()
+    tracker.started("t", 0, 1)
+    tracker.started("t", 0, 2)
+    tracker.finished("t", 0, 1, produced=3)
+    tracker.finished("t", 0, 2, produced=5)
+
+    assert tracker.committable(delivered=2) == {}
+    assert tracker.committable(delivered=4) == {("t", 0): 2}
+    assert tracker.committable(delivered=5) == {("t", 0): 3}
+    # каждая позиция отдаётся один раз
+    assert tracker.committable(delivered=5) == {}
+
+
+def test_committable_can_be_limited_to_partitions():
+    tracker = OffsetTracker()
+    tracker.started("t", 0, 1)
+    tracker.started("t", 1, 1)
+    tracker.finished("t", 0, 1)
+    tracker.finished("t", 1, 1)
+
+    assert tracker.committable(delivered=0, partitions=[("t", 1)]) == {("t", 1): 2}
+    assert tracker.committable(delivered=0) == {("t", 0): 2}
+
+
+def test_reset_forgets_revoked_partition():
+    tracker = OffsetTracker()
+    tracker.started("t", 0, 1)
+    tracker.reset([("t", 0)])
+
+    assert tracker.finished("t", 0, 1) is None
+    tracker.started("t", 0, 40)
+    assert tracker.finished("t", 0, 40) == 41
+
+
+class _Partition:
+    def __init__(self, topic, partition):
+        self.topic = topic
+        self.partition = partition
+
+
+class _Producer:
+    def __init__(self):
+        self.seq = 0
+
+    def produced(self):
+        return self.seq
+
+    def delivered_through(self):
+        return self.seq
+
+
+class _Consumer:
+    def __init__(self):
+        self.committed = []
+
+    def commit(self, offsets, asynchronous):
+        self.committed.extend((o.topic, o.partition, o.offset) for o in offsets)
+
+
+class _Kafka:
+    def __init__(self):
+        self.producer = _Producer()
+        self.consumer = type("C", (), {"c": _Consumer(), "topics": ["t"]})()
+        self.flushed = 0
+
+    def flush(self):
+        self.flushed += 1
+
+
+class _Message:
+    def __init__(self, partition, offset):
+        self._partition = partition
+        self._offset = offset
+
+    def topic(self):
+        return "t"
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return None
+
+    def value(self):
+        return b"{}"
+
+
+def test_revoke_waits_for_in_flight_messages_and_commits_them():
+    kafka = _Kafka()
+    release = asyncio.Event()
+
+    async def handler(topic, value, key):
+        await release.wait()
+        kafka.producer.seq += 1
+
+    async def scenario():
+        runtime = AsyncAgentRuntime("test", kafka, handler, drain_timeout=5)
+        runtime._loop = asyncio.get_running_loop()
+        runtime._slot_freed = asyncio.Event()
+        runtime._dispatch(_Message(0, 7))
+        runtime._dispatch(_Message(1, 3))
+        loop = asyncio.get_running_loop()
+        # on_revoke вызывается из poll() на I/O-потоке
+        revoke = loop.run_in_executor(None, runtime._on_revoke, kafka.consumer.c, [_Partition("t", 0)])
+        await asyncio.sleep(0.05)
+        assert not revoke.done()
+        release.set()
+        await revoke
+        await asyncio.gather(*runtime._tasks)
+
+    asyncio.run(scenario())
+    assert kafka.flushed == 1
+    assert kafka.consumer.c.committed == [("t", 0, 8)]
@@ -0,0 +1,90 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from api.delivery_log import DeliveryLog
+
+
+@pytest.fixture
+def log():
+    return DeliveryLog(fakeredis.FakeRedis(decode_responses=True))
+
+
+def _seqs(frames):
+    return [f["msg_seq"] for f in frames]
+
+
+def test_stream_is_trimmed_to_the_slowest_device(log):
+    log.attach("u", "laptop")
+    log.attach("u", "phone")
+    for i in range(5):
+        log.append("u", {"text": str(i)})
+
+    log.ack("u", 4, "laptop")
+    log.ack("u", 2, "phone")
+
+    assert _seqs(log.since("u", None)) == [3, 4, 5]
+    log.ack("u", 5, "phone")
+    assert _seqs(log.since("u", 4)) == [5]
+
+
+def test_new_device_holds_the_stream_from_its_replay_start(log):
+    for i in range(3):
+        log.append("u", {"text": str(i)})
+
+    assert log.attach("u", "phone") is None
+    log.ack("u", 3, "laptop")
+
+    assert _seqs(log.since("u", None)) == [1, 2, 3]
+
+
+def test_reconnect_without_last_seen_seq_resumes_after_own_ack(log):
+    log.attach("u", "laptop")
+    log.attach("u", "phone")
+    for i in range(3):
+        log.append("u", {"text": str(i)})
+    log.ack("u", 2, "phone")
+    log.ack("u", 3, "laptop")
+
+    assert log.attach("u", "phone") == 2
+    # переподключение ничего не подтверждает само
+    assert log.acked("u", "phone") == 2
+    assert _seqs(log.since("u", 2)) == [3]
+
+
+def test_acks_only_move_forward(log):
+    for i in range(3):
+        log.append("u", {"text": str(i)})
+
+    log.ack("u", 3, "laptop")
+    log.ack("u", 1, "laptop")
+
+    assert log.acked("u", "laptop") == 3
+    assert log.acked("u", "phone") is None
+
+
+def test_seq_from_before_a_counter_reset_is_ignored(log):
+    for i in range(5):
+        log.append("u", {"text": str(i)})
+    log.attach("u", "phone")
+    log.ack("u", 5, "phone")
+    log.r.flushall()
+    log.append("u", {"text": "after reset"})
+
+    assert log.head("u") == 1
+    assert log.attach("u", "phone", last_seen_seq=5) is None
+    assert log.acked("u", "phone") == 0
+    assert _seqs(log.since("u", None)) == [1]
+
+
+def test_stale_ack_of_a_device_is_replaced(log):
+    log.attach("u", "phone")
+    for i in range(3):
+        log.append("u", {"text": str(i)})
+    log.ack("u", 3, "phone")
+    log.r.delete("ws:seq:u", "ws:log:u")
+    log.append("u", {"text": "after eviction"})
+
+    assert log.attach("u", "phone") is None
+    assert log.acked("u", "phone") == 0
+    assert _seqs(log.since("u", None)) == [1]
@@ -0,0 +1,22 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import pytest
+
+from api.services.history_service import InvalidCursor, decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2026, 3, 1, 12, 30, 5, 123456, tzinfo=timezone.utc)
+    message_id = uuid4()
+
+    cursor = encode_cursor(created_at, message_id)
+
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (created_at, message_id)
+
+
+@pytest.mark.parametrize("cursor", ["", "не-курсор", "bm90LWEtY3Vyc29y", encode_cursor(datetime(2026, 1, 1), "x")])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from api.kafka_ws_bridge import ERROR_TOPIC, KafkaWSBridge
+from api.waiters import waiters
+
+
+def test_chat_error_resolves_the_waiting_request():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    bridge = KafkaWSBridge(redis_conn=r, log=None)
+
+    async def scenario():
+        bridge.loop = asyncio.get_running_loop()
+        waiter = waiters.open("c1", "u", stream=False)
+        try:
+            bridge.hold("u")
+            bridge.on_kafka_message(ERROR_TOPIC, {"user_id": "u", "correlation_id": "c1",
+                                                  "reason": "no permit", "retryable": True}, "c1")
+            return await waiter.next(1.0)
+        finally:
+            waiters.close(waiter)
+
+    frame = asyncio.run(scenario())
+
+    assert frame == {"type": "error", "correlation_id": "c1", "reason": "no permit", "retryable": True}
+    # ошибки не попадают в буфер офлайн-доставки
+    assert bridge.buffers.pop_all("u") == []
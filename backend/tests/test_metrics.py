@@ -0,0 +1,37 @@
+import pytest
+
+from agents_shared.metrics import counter, gauge, histogram, render_metrics
+
+
+def test_labelled_metrics_keep_the_kwargs_convention():
+    hits = counter("test_cache_hits_total", "Cache hits", ["result"])
+    hits.inc(result="hit")
+    hits.inc(2, result="hit")
+
+    assert hits.value(result="hit") == 3
+    assert hits.value(result="miss") == 0
+    # чтение не создаёт серию
+    assert 'test_cache_hits_total{result="miss"}' not in render_metrics()
+
+
+def test_gauge_and_histogram():
+    depth = gauge("test_queue_depth", "Queue depth")
+    depth.set(5)
+    depth.dec()
+    latency = histogram("test_latency_seconds", "Latency", ["stage"], buckets=(0.1, 1.0))
+    latency.observe(0.5, stage="llm")
+
+    assert depth.value() == 4
+    assert latency.count(stage="llm") == 1
+    assert 'test_latency_seconds_bucket{le="1.0",stage="llm"} 1.0' in render_metrics()
+
+
+def test_same_name_returns_the_registered_metric():
+    assert counter("test_repeated_total", "x") is counter("test_repeated_total", "x")
+    with pytest.raises(ValueError):
+        gauge("test_repeated_total", "x")
+
+
+def test_wrong_labels_are_rejected():
+    with pytest.raises(ValueError):
+        counter("test_labels_total", "x", ["kind"]).inc(other="a")
@@ -0,0 +1,39 @@
+from api.persistence import MessagePersister
+
+
+class _Cache:
+    """Records the calls the persister makes to HistoryCache."""
+
+    def __init__(self, push_ok: bool = True):
+        self.push_ok = push_ok
+        self.pushed = []
+        self.settled = []
+
+    def push(self, user_id, cursor, message):
+        self.pushed.append(user_id)
+        return self.push_ok
+
+    def settle(self, counts, written):
+        self.settled.append((counts, written))
+
+
+class _BrokenBind:
+    pass
+
+
+def test_failed_write_invalidates_cached_history():
+    cache = _Cache()
+    persister = MessagePersister(bind=_BrokenBind(), cache=cache, max_retries=1)
+
+    assert persister.submit("u1", "user", text="привет") is False
+    assert cache.pushed == ["u1"]
+    assert cache.settled == [({"u1": 1}, False)]
+
+
+def test_failed_push_is_not_counted_as_pending():
+    cache = _Cache(push_ok=False)
+    persister = MessagePersister(bind=_BrokenBind(), cache=cache, max_retries=1)
+
+    persister.submit("u1", "user", text="привет")
+    # счётчик незаписанных не трогаем, но список всё равно удаляем
+    assert cache.settled == [({"u1": 0}, False)]
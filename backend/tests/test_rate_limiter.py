@@ -0,0 +1,46 @@
+import pytest
+
+from agents_shared.rate_limiter import PermitUnavailable, RateLimiter
+
+
+class _Limiter(RateLimiter):
+    """Token bucket and leases kept in memory instead of Redis scripts."""
+
+    def __init__(self, tokens: int, free_slots: int):
+        self.r = object()
+        self._scripts = {}
+        self._calls_since_recovery = {}
+        self.tokens = tokens
+        self.free_slots = free_slots
+
+    def _try_token(self, model, limits, reserve_share):
+        if self.tokens < 1:
+            return 1.0
+        self.tokens -= 1
+        return 0.0
+
+    def _try_lease(self, model, limit, lease_id):
+        if self.free_slots < 1:
+            return False
+        self.free_slots -= 1
+        return True
+
+    def _refund_token(self, model, limits):
+        self.tokens += 1
+
+
+def test_denied_lease_returns_the_token():
+    limiter = _Limiter(tokens=1, free_slots=0)
+
+    with pytest.raises(PermitUnavailable) as e:
+        limiter.acquire("m", max_wait=0.01)
+
+    assert e.value.reason == "concurrency"
+    assert limiter.tokens == 1
+
+
+def test_granted_permit_spends_the_token():
+    limiter = _Limiter(tokens=1, free_slots=1)
+
+    assert limiter.acquire("m", max_wait=0.01) is not None
+    assert limiter.tokens == 0
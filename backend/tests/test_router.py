@@ -0,0 +1,55 @@
+import pytest
+
+from agents.assistant.src.router import LLM, MENU, IntentRouter
+
+
+@pytest.fixture(scope="module")
+def router():
+    return IntentRouter()
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("Привет!", "greeting"),
+    ("благодарю вас", "thanks"),
+    ("до свидания", "goodbye"),
+    ("что ты умеешь?", "capabilities"),
+    # перефразировки, которые ловит только классификатор
+    ("спасибочки", "thanks"),
+    ("до скорого", "goodbye"),
+    ("чем ты можешь быть полезен", "capabilities"),
+])
+def test_routes_small_talk_to_templates(router, text, intent):
+    decision = router.route(text)
+    assert decision.intent == intent
+    assert decision.reply
+
+
+@pytest.mark.parametrize("text", [
+    "спасибо, а как подать иск",
+    "привет, что такое аванс",
+    "что ты можешь сказать про ндфл",
+    "здравствуйте, у меня вопрос по аренде",
+    "добрый вечер, подскажи про ндс",
+    "можно ли уволить сотрудника на испытательном сроке",
+])
+def test_questions_go_to_llm(router, text):
+    decision = router.route(text)
+    assert decision.intent == LLM
+    assert decision.reply is None
+
+
+def test_long_messages_skip_classifier(router):
+    decision = router.route("привет " + "очень длинный вопрос про договор аренды " * 5)
+    assert decision.intent == LLM
+    assert decision.source == "length"
+
+
+def test_menu_selection(router):
+    assert router.route("", {"menu": "deadlines"}).menu_item == "deadlines"
+    decision = router.route("Ключевые сроки")
+    assert (decision.intent, decision.menu_item) == (MENU, "deadlines")
+
+
+def test_covers_requires_every_word(router):
+    assert router.covers("thanks", "спасибо большое")
+    assert not router.covers("thanks", "спасибо а как подать иск")
@@ -0,0 +1,82 @@
+import pytest
+
+from agents.validator.src.engine import BLOCK, WARN, CompiledRules, Rule, literal_anchor
+from agents.validator.src.morphology import Normalizer
+
+RULES = [
+    Rule("secret", "nda", BLOCK, terms=("коммерческая тайна", "секрет")),
+    Rule("card", "pii", BLOCK, regex=r"\bкарта\s+\d{4}\b"),
+    Rule("digits", "pii", WARN, regex=r"\d{3}-\d{2}"),
+]
+
+
+@pytest.fixture(scope="module")
+def compiled():
+    return CompiledRules(RULES, Normalizer(use_lemmatizer=False), version="t")
+
+
+def _ids(violations):
+    return [v.rule_id for v in violations]
+
+
+def test_literal_anchor_is_the_longest_required_literal():
+    assert literal_anchor(r"\bкарта\s+\d{4}\b") == "карта"
+    assert literal_anchor(r"\d{3}-\d{2}") is None
+    assert literal_anchor("(") is None
+
+
+def test_terms_match_inflected_words_and_phrases(compiled):
+    text = "Это секреты фирмы, а также коммерческой тайны партнёра."
+
+    violations = compiled.match(text)
+
+    assert _ids(violations) == ["secret", "secret"]
+    assert violations[0].text == "секреты"
+    assert violations[1].text == "коммерческой тайны"
+
+
+def test_regex_rules_with_and_without_anchor(compiled):
+    text = "Карта 1234 и номер 555-12"
+
+    violations = compiled.match(text)
+
+    assert _ids(violations) == ["card", "digits"]
+    assert [v.text for v in violations] == ["Карта 1234", "555-12"]
+    assert all(text[v.start:v.end] == v.text for v in violations)
+
+
+def test_clean_text_has_no_violations(compiled):
+    assert compiled.match("Добрый день, договор готов.") == []
+
+
+def test_stream_finds_a_phrase_split_across_chunks(compiled):
+    text = "Сведения составляют коммерческую тайну общества."
+    stream = compiled.stream()
+
+    found = []
+    for i in range(0, len(text), 5):
+        found += stream.feed(text[i:i + 5])
+    found += stream.finish()
+
+    assert found == compiled.match(text)
+
+
+def test_stream_holds_back_a_cut_word(compiled):
+    stream = compiled.stream()
+
+    assert stream.feed("это сек") == []
+    assert _ids(stream.feed("рет")) == []
+    assert _ids(stream.finish()) == ["secret"]
+
+
+def test_stream_reports_regex_matches_once(compiled):
+    stream = compiled.stream()
+
+    first = stream.feed("номер 555-12 ")
+    second = stream.feed("и ещё текст ")
+    third = stream.feed("карта 9876 ")
+
+    assert _ids(first) == ["digits"]
+    assert second == []
+    assert _ids(third) == ["card"]
+    assert stream.finish() == []
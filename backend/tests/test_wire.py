@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from api import wire
+from api.wire import LEGACY, SUBPROTOCOL_JSON, SUBPROTOCOL_MSGPACK, CompactProtocol, negotiate, slim_frame
+
+RESPONSE = {
+    "type": "message",
+    "text": "Готово",
+    "reply": "Готово",
+    "msg_seq": 7,
+    "envelope": {
+        "event": "assistant.response",
+        "correlation_id": "c1",
+        "user_id": "u",
+        "payload": {"text": "Готово"},
+    },
+}
+
+
+def test_slim_frame_keeps_only_what_the_client_needs():
+    assert slim_frame(RESPONSE) == {
+        "type": "message",
+        "event": "assistant.response",
+        "correlation_id": "c1",
+        "payload": {"text": "Готово"},
+        "msg_seq": 7,
+    }
+    chunk = {"type": "chunk", "correlation_id": "c1", "text": "Го"}
+    assert slim_frame(chunk) is chunk
+
+
+def test_legacy_protocol_sends_the_frame_unchanged():
+    kind, data = LEGACY.encode([RESPONSE])
+
+    assert kind == "text"
+    assert json.loads(data) == RESPONSE
+    assert LEGACY.decode({"text": data}) == RESPONSE
+
+
+def test_compact_protocol_batches_frames():
+    protocol = CompactProtocol(binary=False)
+    chunk = {"type": "chunk", "correlation_id": "c1", "text": "Го"}
+
+    kind, data = protocol.encode([chunk, RESPONSE])
+
+    assert kind == "text"
+    assert json.loads(data) == {"type": "batch", "frames": [chunk, slim_frame(RESPONSE)]}
+    _, single = protocol.encode([RESPONSE])
+    assert json.loads(single) == slim_frame(RESPONSE)
+
+
+def test_msgpack_protocol_round_trip():
+    pytest.importorskip("msgpack")
+    protocol = CompactProtocol(binary=True)
+
+    kind, data = protocol.encode([RESPONSE])
+
+    assert kind == "bytes"
+    assert protocol.decode({"bytes": data}) == slim_frame(RESPONSE)
+    assert protocol.decode({"text": '{"type": "ack"}'}) == {"type": "ack"}
+
+
+def test_negotiate_follows_the_client_preference(monkeypatch):
+    assert negotiate([]) is LEGACY
+    assert negotiate(["other"]) is LEGACY
+    assert negotiate([SUBPROTOCOL_JSON, SUBPROTOCOL_MSGPACK]).subprotocol == SUBPROTOCOL_JSON
+
+    monkeypatch.setattr(wire, "msgpack", None)
+    assert negotiate([SUBPROTOCOL_MSGPACK, SUBPROTOCOL_JSON]).subprotocol == SUBPROTOCOL_JSON
@@ -25,7 +25,14 @@ export function useChat(baseUrl: string, userId: string) {
       baseUrl,
       userId,
       (msg) => {
-        setMessages((prev) => [...prev, msg]);
+        // чанки и финальный ответ приходят с одним id — заменяем сообщение на месте
+        setMessages((prev) => {
+          const idx = prev.findIndex((m) => m.id === msg.id);
+          if (idx === -1) return [...prev, msg];
+          const next = prev.slice();
+          next[idx] = msg;
+          return next;
+        });
       },
       (s) => setStatus(s as any)
     );
@@ -11,13 +11,19 @@ export interface ChatMessage {
 export interface ChatHistoryResponse {
   user_id: string;
   history: ChatMessage[];
+  // курсоры страниц: before — более ранние сообщения, after — более новые
+  before?: string | null;
+  after?: string | null;
+  has_more?: boolean;
 }
 
 export async function fetchChatHistory(
   baseUrl: string,
-  userId: string
+  userId: string,
+  before?: string
 ): Promise<ChatHistoryResponse> {
-  const res = await fetch(`${baseUrl}/chat/history/${userId}`);
+  const query = before ? `?before=${encodeURIComponent(before)}` : "";
+  const res = await fetch(`${baseUrl}/chat/history/${userId}${query}`);
 
   if (!res.ok) {
     throw new Error("Failed to load chat history");
@@ -26,6 +32,17 @@ export async function fetchChatHistory(
   return res.json();
 }
 
+// стабильный id установки клиента: сервер считает подтверждения (ack) по устройствам
+function chatDeviceId(): string {
+  const key = "chat:deviceId";
+  let id = localStorage.getItem(key);
+  if (!id) {
+    id = crypto.randomUUID();
+    localStorage.setItem(key, id);
+  }
+  return id;
+}
+
 export function connectChatWS(
   baseUrl: string,
   userId: string,
@@ -34,15 +51,62 @@ export function connectChatWS(
 ) {
   const wsUrl = `${baseUrl.replace("http", "ws")}/chat/${userId}`;
 
-  return createWS(
-    wsUrl,
+  // последний полученный msg_seq: при переподключении сервер досылает только пропущенное
+  const seqKey = `chat:lastSeq:${userId}`;
+  let lastSeq = Number(localStorage.getItem(seqKey) ?? 0);
+
+  // частично полученные ответы: correlation_id -> дельты по seq
+  const streams = new Map<string, string[]>();
+
+  const deviceId = encodeURIComponent(chatDeviceId());
+
+  const conn = createWS(
+    () =>
+      lastSeq > 0
+        ? `${wsUrl}?device_id=${deviceId}&last_seen_seq=${lastSeq}`
+        : `${wsUrl}?device_id=${deviceId}`,
     (data) => {
+      if (data.type === "resume") {
+        // счётчик на сервере сброшен: наши номера больше не действуют
+        if (data.head_seq < lastSeq) {
+          lastSeq = 0;
+          localStorage.removeItem(seqKey);
+        }
+        return;
+      }
+
+      if (data.type === "chunk") {
+        const parts = streams.get(data.correlation_id) ?? [];
+        parts[data.seq] = data.delta;
+        streams.set(data.correlation_id, parts);
+
+        onBotMessage({
+          id: data.correlation_id,
+          type: "bot",
+          text: parts.join(""),
+          ts: Date.now(),
+          active_documents: [],
+        });
+        return;
+      }
+
+      if (typeof data.msg_seq === "number") {
+        // кадр мог прийти и вживую, и в досылке после переподключения
+        if (data.msg_seq <= lastSeq) return;
+        lastSeq = data.msg_seq;
+        localStorage.setItem(seqKey, String(lastSeq));
+        conn.send({ ack: lastSeq });
+      }
+
       const reply = data.reply || data.text;
 
       if (!reply) return;
 
+      const correlationId = data.envelope?.correlation_id;
+      if (correlationId) streams.delete(correlationId);
+
       onBotMessage({
-        id: crypto.randomUUID(),
+        id: correlationId || crypto.randomUUID(),
         type: "bot",
         text: reply,
         ts: Date.now(),
@@ -51,4 +115,6 @@ export function connectChatWS(
     },
     onStatus
   );
+
+  return conn;
 }
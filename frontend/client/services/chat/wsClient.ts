@@ -1,7 +1,8 @@
 export type WSStatus = "open" | "closed" | "reconnecting";
 
 export function createWS(
-  url: string,
+  // функция — чтобы при переподключении URL строился заново (например, с last_seen_seq)
+  url: string | (() => string),
   onMessage: (msg: any) => void,
   onStatus?: (status: WSStatus) => void
 ) {
@@ -11,7 +12,7 @@ export function createWS(
   const connect = () => {
     onStatus?.("reconnecting");
 
-    ws = new WebSocket(url);
+    ws = new WebSocket(typeof url === "function" ? url() : url);
 
     ws.onopen = () => {
       onStatus?.("open");